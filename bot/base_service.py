@@ -1,16 +1,28 @@
+import datetime
+import hashlib
+import json
 import logging
-from django.db.models import Q
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, F, OuterRef, Subquery, Sum, Count, Value, Max
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 
-from bot.models import Bot, BotCollection, BotSubscribe
-from bot.rag_service import Bot as RagBot
+from bot.models import Bot, BotCollection, BotSubscribe, BotDocument, BotPublishOutbox, BotPresetAnswer
+from bot.rag_service import Bot as RagBot, Conversations as RagConversation
 from bot.serializers import BotDetailSerializer
+from chat.models import Conversation
 from chat.serializers import ConversationCreateBaseSerializer
-from collection.models import Collection, CollectionDocument
-from collection.serializers import CollectionDocumentListSerializer
+from collection.models import Collection, CollectionDocument, CollectionStats
+from collection.serializers import CollectionDocumentListSerializer, bot_subscribe_personal_document_num
+from core.utils.common import papers_fingerprint
+from core.utils.pagination import keyset_after, keyset_cursor, decode_cursor, encode_cursor
 from core.utils.exceptions import InternalServerError
-from document.models import Document, DocumentLibrary
+from document.models import Document, DocumentLibrary, DocumentLibraryCache
 from document.serializers import DocumentApaListSerializer, CollectionDocumentListCollectionSerializer
+from user.models import OperationLogSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -18,16 +30,8 @@ logger = logging.getLogger(__name__)
 # 专题详情
 def bot_detail(user_id, bot):
     # bot = Bot.objects.get(pk=bot_id)
+    # 只读：收藏夹 total_personal 在文献增删时增量维护，偏差由 collection_stats_reconcile 修正
     bot_data = BotDetailSerializer(bot).data
-    if bot_data['collections']:
-        collections = Collection.objects.filter(id__in=bot_data['collections']).all()
-        for collection in collections:
-            if collection.id in ['s2', 'arxiv']:
-                continue
-            coll_doc_total = CollectionDocument.objects.filter(collection_id=collection.id, del_flag=False).count()
-            if collection.total_personal != coll_doc_total:
-                collection.total_personal = coll_doc_total
-                collection.save()
     if is_subscribed(user_id, bot):
         bot_data['subscribed'] = True
     else:
@@ -43,7 +47,7 @@ def is_subscribed(user_id, bot: Bot):
     return False
 
 
-def bot_documents(user_id, bot, list_type, page_size=10, page_num=1, keyword=None):
+def bot_documents(user_id, bot, list_type, page_size=10, page_num=1, keyword=None, cursor=None):
     """
     专题文献列表
     """
@@ -54,7 +58,8 @@ def bot_documents(user_id, bot, list_type, page_size=10, page_num=1, keyword=Non
     bot_is_subscribed = is_subscribed(user_id, bot)
     public_count, need_public, need_public_count, personal_count, public_collections = 0, False, 0, 0, []
     all_public_collections = Collection.objects.filter(id__in=collection_ids, type=Collection.TypeChoices.PUBLIC).all()
-    if page_num == 1:
+    # 公共库只在第一页返回，带 cursor 的后续页不再返回
+    if page_num == 1 and not cursor:
         if list_type in ['all', 'all_documents']:
             need_public = True
             need_public_count = len(all_public_collections)
@@ -70,9 +75,9 @@ def bot_documents(user_id, bot, list_type, page_size=10, page_num=1, keyword=Non
     start_num = page_size * (page_num - 1)
     # 个人上传文件库 关联的文献
     # 未发布专题 显示未公共库文献， 专题广场专题显示为订阅全文
-    ref_doc_lib_ids = (
-        set(ref_ds if ref_ds else []) & set(CollectionDocumentListSerializer._my_doc_lib_document_ids(user_id))
-    )
+    # 个人库作为子查询，只取关联文献中在个人库的部分
+    ref_doc_lib_ids = set(CollectionDocumentListSerializer._my_doc_lib_documents(user_id).filter(
+        document_id__in=ref_ds)) if ref_ds else set()
     if ref_ds:
         if list_type in ['personal']:
             ref_ds = list(ref_doc_lib_ids)
@@ -94,16 +99,51 @@ def bot_documents(user_id, bot, list_type, page_size=10, page_num=1, keyword=Non
             else:
                 ref_ds = []
 
-    all_c_docs = query_set.all()
     start = start_num - (public_count % page_size if not need_public_count and start_num else 0)
-    document_ids = [cd['document_id'] for cd in all_c_docs]
-    if ref_ds:
-        document_ids += ref_ds
-    filter_query = Q(id__in=document_ids)
+    # 专题文献按 (bot_id, title, document_id) 索引排序分页，个人上传文件关联的公共文献 union 合并
+    # list_type 的可见范围 (query_set) 作为子查询过滤
+    bot_doc_filter = Q(bot_id=bot_id, del_flag=False, document_id__in=query_set.values('document_id'))
+    ref_filter = Q(id__in=ref_ds) if ref_ds else None
     if keyword:
-        filter_query &= Q(title__icontains=keyword)
-    doc_query_set = Document.objects.filter(filter_query).order_by('title')
-    docs = doc_query_set[start:(page_size * page_num - need_public_count)]
+        bot_doc_filter &= Q(title__icontains=keyword)
+        if ref_filter:
+            ref_filter &= Q(title__icontains=keyword)
+
+    def _doc_query_set(cursor_values=None):
+        # union 按列位置合并，两边都是 (title, document_id)；keyset 条件在 union 前分别加到两边
+        bot_doc_query_set = BotDocument.objects.filter(bot_doc_filter)
+        if cursor_values:
+            bot_doc_query_set = bot_doc_query_set.filter(keyset_after(['title', 'document_id'], cursor_values))
+        bot_doc_query_set = bot_doc_query_set.values('title', 'document_id')
+        if not ref_filter:
+            return bot_doc_query_set
+        ref_query_set = Document.objects.filter(ref_filter)
+        if cursor_values:
+            ref_query_set = ref_query_set.filter(keyset_after(['title', 'id'], cursor_values))
+        return bot_doc_query_set.union(ref_query_set.annotate(document_id=F('id')).values('title', 'document_id'))
+
+    doc_query_set = _doc_query_set()
+    next_cursor = None
+    if cursor or page_num == 1:
+        # keyset 分页: (title, document_id) > cursor
+        cursor_values = decode_cursor(cursor) if cursor else None
+        limit = max(page_size - need_public_count, 0)
+        page_docs = list(_doc_query_set(cursor_values if cursor_values and len(cursor_values) == 2 else None)
+                         .order_by('title', 'document_id')[:limit + 1]) if limit else []
+        if len(page_docs) > limit:
+            page_docs = page_docs[:limit]
+            next_cursor = keyset_cursor(page_docs[-1], ['title', 'document_id'])
+        elif not limit and doc_query_set.exists():
+            # 第一页被公共库占满，下一页从头开始
+            next_cursor = encode_cursor([])
+    else:
+        # 兼容按页码翻页
+        page_docs = list(
+            doc_query_set.order_by('title', 'document_id')[start:(page_size * page_num - need_public_count)])
+        next_cursor = keyset_cursor(page_docs[-1], ['title', 'document_id']) if page_docs else None
+    page_document_ids = [d['document_id'] for d in page_docs]
+    page_documents = Document.objects.in_bulk(page_document_ids)
+    docs = [page_documents[d_id] for d_id in page_document_ids if d_id in page_documents]
     query_total = doc_query_set.count()
     total = query_total + public_count
     show_total = query_total
@@ -140,10 +180,8 @@ def bot_documents(user_id, bot, list_type, page_size=10, page_num=1, keyword=Non
             full_text_ref_documents = Document.objects.filter(
                 id__in=ref_ds, full_text_accessible=True, del_flag=False).values_list('id', flat=True).all()
             if (bot.type == Bot.TypeChoices.PERSONAL and not bot.advance_share) or not bot_is_subscribed:
-                full_text_ref_documents = DocumentLibrary.objects.filter(
-                    user_id=user_id, document_id__in=list(full_text_ref_documents), del_flag=False,
-                    task_status=DocumentLibrary.TaskStatusChoices.COMPLETED
-                ).values_list('document_id', flat=True).all()
+                full_text_ref_documents = DocumentLibraryCache(user_id).intersection(
+                    full_text_ref_documents, DocumentLibraryCache.COMPLETED)
             all_full_text_docs += list(full_text_ref_documents)
         for doc in docs:
             has_full_text = (
@@ -191,57 +229,190 @@ def bot_documents(user_id, bot, list_type, page_size=10, page_num=1, keyword=Non
         'is_all_in_document_library': True if list_type == 'personal' else False,
         'total': total,
         'show_total': show_total,
+        'next_cursor': next_cursor,
     }
 
 
-def recreate_bot(bot: Bot, collections):
+AGENT_SPEC_FIELDS = ['prompt', 'preset_questions', 'tools', 'paper_ids', 'public_collection_ids']
+
+
+def agent_spec(bot: Bot, collections):
+    """
+    推送给 RAG agent 的配置
+    """
+    return {
+        'prompt': bot.prompt if bot.prompt and bot.prompt['spec']['system_prompt'] else None,
+        'preset_questions': bot.questions or None,
+        'tools': bot.tools or None,
+        'paper_ids': collections_doc_ids(collections) or None,
+        'public_collection_ids': [c.id for c in collections if c.type == c.TypeChoices.PUBLIC] or None,
+    }
+
+
+def agent_spec_fingerprint(spec):
+    """
+    按字段计算指纹 paper_ids/public_collection_ids 与顺序无关
+    """
+    fingerprint = {}
+    for field in AGENT_SPEC_FIELDS:
+        value = spec.get(field)
+        if field in ['paper_ids', 'public_collection_ids'] and value:
+            value = sorted(json.dumps(v, sort_keys=True) for v in value)
+        fingerprint[field] = hashlib.md5(
+            json.dumps(value, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return fingerprint
+
+
+def sync_bot(bot: Bot, collections):
+    """
+    增量同步 agent：只推送指纹有变化的字段，无法增量更新时才重建
+    """
+    spec = agent_spec(bot, collections)
+    fingerprint = agent_spec_fingerprint(spec)
+    old_fingerprint = (bot.extension or {}).get('spec_fingerprint')
+    if not bot.agent_id or not old_fingerprint:
+        return recreate_bot(bot, collections, spec=spec)
+    changed = [f for f in AGENT_SPEC_FIELDS if old_fingerprint.get(f) != fingerprint[f]]
+    if changed:
+        logger.info(f'sync_bot bot_id: {bot.id}, agent_id: {bot.agent_id}, changed: {changed}')
+        rag_ret = RagBot.update(bot.agent_id, **{f: spec[f] for f in changed})
+        if not rag_ret:
+            return recreate_bot(bot, collections, spec=spec)
+        extension = bot.extension
+        if rag_ret.get('id'):
+            extension = rag_ret
+        else:
+            for f in changed:
+                extension[f] = spec[f]
+        extension['spec_fingerprint'] = fingerprint
+        bot.extension = extension
+    _save_bot_collections(bot, collections)
+
+
+def recreate_bot(bot: Bot, collections, spec=None):
+    if spec is None:
+        spec = agent_spec(bot, collections)
     RagBot.delete(bot.agent_id)
-    public_collection_ids = [c.id for c in collections if c.type == c.TypeChoices.PUBLIC]
-    papers_info = ConversationCreateBaseSerializer.get_papers_info(
-        user_id=bot.user_id, bot_id=bot.id, collection_ids=[c.id for c in collections], document_ids=[]
-    )
-    paper_ids = []
-    for p in papers_info:
-        paper_ids.append({
-            'collection_id': p['collection_id'],
-            'collection_type': p['collection_type'],
-            'doc_id': p['doc_id'],
-            'full_text_accessible': p['full_text_accessible']
-        })
     rag_ret = RagBot.create(
         bot.user_id,
-        bot.prompt,
-        bot.questions,
-        tools=bot.tools,
-        paper_ids=collections_doc_ids(collections),
-        public_collection_ids=public_collection_ids,
+        spec['prompt'],
+        spec['preset_questions'],
+        tools=spec['tools'],
+        paper_ids=spec['paper_ids'],
+        public_collection_ids=spec['public_collection_ids'],
     )
     if rag_ret.get('id'):
+        rag_ret['spec_fingerprint'] = agent_spec_fingerprint(spec)
         bot.extension = rag_ret
         bot.agent_id = rag_ret['id']
-        BotCollection.objects.filter(bot_id=bot.id).update(del_flag=True)
-        # save BotCollection
-        for c in collections:
-            bc_data = {
-                'bot_id': bot.id,
-                'collection_id': c.id,
-                'collection_type': c.type,
-                'del_flag': False,
-            }
-            BotCollection.objects.update_or_create(
-                bc_data, bot_id=bc_data['bot_id'], collection_id=bc_data['collection_id'])
+        _save_bot_collections(bot, collections)
     else:
         raise InternalServerError('RAG create bot failed')
 
 
+def _save_bot_collections(bot: Bot, collections):
+    old_collection_ids = set(BotCollection.objects.filter(
+        bot_id=bot.id, del_flag=False).values_list('collection_id', flat=True))
+    new_collection_ids = set(c.id for c in collections)
+    # 收藏夹没有变化时不需要重新统计和刷新专题文献
+    if old_collection_ids == new_collection_ids:
+        return False
+    BotCollection.objects.filter(bot_id=bot.id).update(del_flag=True)
+    # save BotCollection
+    for c in collections:
+        bc_data = {
+            'bot_id': bot.id,
+            'collection_id': c.id,
+            'collection_type': c.type,
+            'del_flag': False,
+        }
+        BotCollection.objects.update_or_create(
+            bc_data, bot_id=bc_data['bot_id'], collection_id=bc_data['collection_id'])
+    CollectionStats.refresh(old_collection_ids | new_collection_ids)
+    bot_documents_refresh([bot.id])
+    return True
+
+
 def collections_doc_ids(collections: list[Collection]):
     _cids = [c.id for c in collections if c.type == c.TypeChoices.PERSONAL]
-    c_docs = CollectionDocument.objects.filter(collection_id__in=_cids).all()
+    c_docs = CollectionDocument.objects.filter(collection_id__in=_cids).values(
+        'document__collection_id', 'document__collection_type', 'document__doc_id').all()
     return [{
-        'collection_id': c_doc.document.collection_id,
-        'collection_type': c_doc.document.collection_type,
-        'doc_id': c_doc.document.doc_id} for c_doc in c_docs
+        'collection_id': c_doc['document__collection_id'],
+        'collection_type': c_doc['document__collection_type'],
+        'doc_id': c_doc['document__doc_id']} for c_doc in c_docs
+    ]
+
+
+def bot_documents_refresh(bot_ids):
+    """
+    按专题当前的收藏夹重新计算 BotDocument，只写入差异（新增/删除/标题变化）
+    """
+    bot_ids = list(set(b_id for b_id in bot_ids if b_id))
+    if not bot_ids:
+        return 0
+    bot_docs = BotCollection.objects.filter(
+        bot_id__in=bot_ids, del_flag=False, collection__collection_doc__del_flag=False,
+    ).values(
+        'bot_id',
+        document_id=F('collection__collection_doc__document_id'),
+        title=F('collection__collection_doc__document__title'),
+    ).distinct()
+    new_docs = {(d['bot_id'], d['document_id']): d['title'] for d in bot_docs}
+    old_docs = {
+        (d.bot_id, d.document_id): d for d in BotDocument.objects.filter(bot_id__in=bot_ids).only(
+            'id', 'bot_id', 'document_id', 'title', 'del_flag')
+    }
+    to_create = [
+        BotDocument(bot_id=key[0], document_id=key[1], title=title)
+        for key, title in new_docs.items() if key not in old_docs
     ]
+    to_update, now = [], datetime.datetime.now()
+    for key, bd in old_docs.items():
+        if key in new_docs and (bd.title != new_docs[key] or bd.del_flag):
+            bd.title, bd.del_flag, bd.updated_at = new_docs[key], False, now
+            to_update.append(bd)
+    to_delete = [bd.id for key, bd in old_docs.items() if key not in new_docs]
+    with transaction.atomic():
+        BotDocument.objects.bulk_create(to_create, batch_size=1000, ignore_conflicts=True)
+        BotDocument.objects.bulk_update(to_update, ['title', 'del_flag', 'updated_at'], batch_size=1000)
+        if to_delete:
+            BotDocument.objects.filter(id__in=to_delete).delete()
+    logger.info(f'bot_documents_refresh {bot_ids}, created: {len(to_create)}, updated: {len(to_update)}, '
+                f'deleted: {len(to_delete)}')
+    return len(to_create) + len(to_update) + len(to_delete)
+
+
+def bot_documents_refresh_by_collections(collection_ids):
+    """收藏夹文献变化后刷新引用这些收藏夹的专题文献"""
+    collection_ids = list(set(c_id for c_id in collection_ids if c_id))
+    if not collection_ids:
+        return 0
+    return bot_documents_refresh(BotCollection.objects.filter(
+        collection_id__in=collection_ids, del_flag=False).values_list('bot_id', flat=True))
+
+
+def bots_annotate_doc_total(query_set):
+    """专题列表 doc_total：专题收藏夹 total_public + total_personal 之和，一个子查询注解"""
+    coll_total = BotCollection.objects.filter(
+        bot_id=OuterRef('id'), del_flag=False
+    ).order_by().values('bot_id').annotate(
+        total=Sum(F('collection__total_public') + F('collection__total_personal'))
+    ).values('total')
+    return query_set.annotate(doc_total=Coalesce(Subquery(coll_total), Value(0)))
+
+
+def bots_annotate_mine_doc_total(query_set):
+    """我的专题 doc_total：公共库收藏夹 total_public 之和 + 专题去重后的文献数 (BotDocument)"""
+    public_total = BotCollection.objects.filter(
+        bot_id=OuterRef('id'), del_flag=False,
+        collection__type=Collection.TypeChoices.PUBLIC, collection__del_flag=False,
+    ).order_by().values('bot_id').annotate(total=Sum('collection__total_public')).values('total')
+    doc_count = BotDocument.objects.filter(
+        bot_id=OuterRef('id'), del_flag=False
+    ).order_by().values('bot_id').annotate(total=Count('id')).values('total')
+    return query_set.annotate(
+        doc_total=Coalesce(Subquery(public_total), Value(0)) + Coalesce(Subquery(doc_count), Value(0)))
 
 
 def mine_bot_document_ids(bot_id):
@@ -250,3 +421,309 @@ def mine_bot_document_ids(bot_id):
     c_docs = CollectionDocument.objects.filter(
         collection_id__in=collection_ids, del_flag=False).values_list('document_id', flat=True).all()
     return list(c_docs)
+
+
+def bot_log_snapshot_id(bot: Bot, documents_limit=2000):
+    """
+    专题详情操作日志快照：专题信息 + 专题文献 (document_id, title)，不渲染引用格式
+    专题状态 (bot.updated_at, 文献数, 文献最后修改时间) 未变化时直接复用缓存的快照 id
+    """
+    doc_state = BotDocument.objects.filter(bot_id=bot.id, del_flag=False).aggregate(
+        total=Count('id'), last_updated_at=Max('updated_at'), last_created_at=Max('created_at'))
+    state = hashlib.md5(json.dumps([
+        bot.updated_at, doc_state['total'], doc_state['last_updated_at'], doc_state['last_created_at']
+    ], default=str).encode('utf-8')).hexdigest()
+    state_key = f'bot_log_snapshot:{bot.id}:{state}'
+    if snapshot_id := cache.get(state_key):
+        return snapshot_id
+    content = {
+        'bot_detail': BotDetailSerializer(bot).data,
+        'documents': list(BotDocument.objects.filter(bot_id=bot.id, del_flag=False).order_by(
+            'title', 'document_id').values('document_id', 'title')[:documents_limit]),
+    }
+    content = json.loads(json.dumps(content, default=str))
+    snapshot_id = hashlib.sha256(
+        json.dumps(content, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    OperationLogSnapshot.objects.bulk_create(
+        [OperationLogSnapshot(id=snapshot_id, content=content)], ignore_conflicts=True)
+    cache.set(state_key, snapshot_id, 60 * 60 * 24)
+    return snapshot_id
+
+
+class BotListCache:
+    """
+    专题广场、热门专题、全部专题列表缓存，所有用户相同的部分，订阅状态由调用方合并
+    key: bot_list:{version}:{list_type}:{page}
+    发布/下架、排序、热门专题、专题修改后 invalidate 递增版本号，旧版本的 key 自然过期
+    文献数等非后台修改的字段依赖过期时间刷新
+    """
+    VERSION_KEY = 'bot_list:version'
+    EXPIRES = 60 * 5
+
+    @classmethod
+    def version(cls):
+        if (version := cache.get(cls.VERSION_KEY)) is None:
+            cache.add(cls.VERSION_KEY, int(time.time() * 1000), timeout=None)
+            version = cache.get(cls.VERSION_KEY)
+        return version
+
+    @classmethod
+    def get_or_set(cls, list_type, page, func):
+        key = f'bot_list:{cls.version()}:{list_type}:{page}'
+        if (data := cache.get(key)) is None:
+            data = func()
+            cache.set(key, data, cls.EXPIRES)
+        return data
+
+    @classmethod
+    def invalidate(cls):
+        def _incr():
+            try:
+                cache.incr(cls.VERSION_KEY)
+            except ValueError:
+                cache.set(cls.VERSION_KEY, int(time.time() * 1000), timeout=None)
+        transaction.on_commit(_incr)
+
+
+class BotPublishNotReady(Exception):
+    pass
+
+
+def bot_publish_outbox_add(bot: Bot):
+    """
+    在发布专题的事务中调用，同一次发布（bot_id + pub_date）只写入一条
+    """
+    outbox, _created = BotPublishOutbox.objects.get_or_create(
+        idempotency_key=f'{bot.id}:{bot.pub_date.isoformat() if bot.pub_date else ""}',
+        defaults={'bot_id': bot.id, 'next_retry_at': datetime.datetime.now()},
+    )
+    return outbox
+
+
+def bot_publish_outbox_wake():
+    """公共库文献入库完成后唤醒等待中的发布"""
+    return BotPublishOutbox.objects.filter(
+        status=BotPublishOutbox.StatusChoices.PENDING, next_retry_at__gt=datetime.datetime.now(), del_flag=False
+    ).update(next_retry_at=datetime.datetime.now())
+
+
+def _bot_publish_execute(outbox: BotPublishOutbox):
+    bot = Bot.objects.filter(pk=outbox.bot_id).first()
+    if not bot or bot.type != Bot.TypeChoices.IN_PROGRESS:
+        # 已发布或已取消
+        return False
+    personal_documents, ref_documents = bot_subscribe_personal_document_num(bot.user_id, bot=bot)
+    ref_result_count = DocumentLibrary.objects.filter(
+        user_id='0000', document_id__in=ref_documents,
+        task_status__in=[DocumentLibrary.TaskStatusChoices.ERROR, DocumentLibrary.TaskStatusChoices.COMPLETED],
+    ).count()
+    if ref_result_count < len(ref_documents):
+        raise BotPublishNotReady(f'ref documents {ref_result_count}/{len(ref_documents)}')
+    # 条件更新，重复执行只会发布一次
+    published = bool(Bot.objects.filter(pk=bot.id, type=Bot.TypeChoices.IN_PROGRESS).update(
+        type=Bot.TypeChoices.PUBLIC, pub_date=datetime.datetime.now(), updated_at=datetime.datetime.now()))
+    if published:
+        BotListCache.invalidate()
+    return published
+
+
+def bot_publish_outbox_process(batch_size=50, max_attempts=8, stale_minutes=10, wait_minutes=10):
+    """
+    执行专题发布 outbox
+    1. 领取到期的 pending 记录，以及 in_progress 超时（worker 中断）的记录
+    2. 文献未入库完成的继续等待（不计入重试次数），异常按指数退避重试，超过最大次数标记为 dead
+    :return: (published_bot_ids, waiting_num)
+    """
+    now = datetime.datetime.now()
+    claim_query = (
+        Q(status=BotPublishOutbox.StatusChoices.PENDING, next_retry_at__lte=now)
+        | Q(status=BotPublishOutbox.StatusChoices.IN_PROGRESS,
+            updated_at__lt=now - datetime.timedelta(minutes=stale_minutes))
+    )
+    with transaction.atomic():
+        outboxes = list(BotPublishOutbox.objects.select_for_update(skip_locked=True).filter(
+            claim_query, del_flag=False).order_by('next_retry_at')[:batch_size])
+        BotPublishOutbox.objects.filter(id__in=[o.id for o in outboxes]).update(
+            status=BotPublishOutbox.StatusChoices.IN_PROGRESS, updated_at=now)
+    published_bot_ids, waiting_num = [], 0
+    for outbox in outboxes:
+        try:
+            if _bot_publish_execute(outbox):
+                published_bot_ids.append(outbox.bot_id)
+            outbox.status = BotPublishOutbox.StatusChoices.COMPLETED
+            outbox.error = None
+        except BotPublishNotReady as e:
+            waiting_num += 1
+            outbox.status = BotPublishOutbox.StatusChoices.PENDING
+            outbox.error = str(e)
+            outbox.next_retry_at = datetime.datetime.now() + datetime.timedelta(minutes=wait_minutes)
+        except Exception as e:
+            logger.warning(f'bot publish outbox error: {outbox.id}, {outbox.bot_id}, {e}')
+            outbox.attempts += 1
+            outbox.error = str(e)[:2000]
+            if outbox.attempts >= max_attempts:
+                outbox.status = BotPublishOutbox.StatusChoices.DEAD
+            else:
+                outbox.status = BotPublishOutbox.StatusChoices.PENDING
+                outbox.next_retry_at = datetime.datetime.now() + datetime.timedelta(
+                    seconds=min(30 * 2 ** (outbox.attempts - 1), 3600))
+        outbox.updated_at = datetime.datetime.now()
+    if outboxes:
+        BotPublishOutbox.objects.bulk_update(outboxes, ['status', 'attempts', 'error', 'next_retry_at', 'updated_at'])
+    return published_bot_ids, waiting_num
+
+
+def bot_publish_sweep():
+    """兜底：发布中但没有待执行 outbox 的专题补写 outbox，dead 记录需人工处理"""
+    active_bot_ids = BotPublishOutbox.objects.filter(
+        status__in=[BotPublishOutbox.StatusChoices.PENDING, BotPublishOutbox.StatusChoices.IN_PROGRESS],
+        del_flag=False,
+    ).values('bot_id')
+    bots = Bot.objects.filter(type=Bot.TypeChoices.IN_PROGRESS, del_flag=False).exclude(id__in=active_bot_ids)
+    added_num = 0
+    for bot in bots:
+        outbox = bot_publish_outbox_add(bot)
+        if outbox.status == BotPublishOutbox.StatusChoices.DEAD:
+            logger.error(f'bot_publish_sweep dead outbox: {outbox.id}, bot_id: {bot.id}')
+        else:
+            added_num += 1
+    return added_num
+
+
+# 预置问题答案以未订阅用户（专题广场）视角生成
+PRESET_ANSWER_USER_ID = '0000'
+
+
+def bot_preset_papers_info(bot: Bot, user_id=PRESET_ANSWER_USER_ID):
+    collection_ids = list(BotCollection.objects.filter(
+        bot_id=bot.id, del_flag=False).values_list('collection_id', flat=True))
+    return ConversationCreateBaseSerializer.get_papers_info(user_id, bot.id, collection_ids, [])
+
+
+def bot_corpus_fingerprint(bot: Bot, papers_info):
+    """
+    问答文献 + 公共库 + agent 配置的指纹，任一变化预置问题答案失效
+    """
+    extension = bot.extension or {}
+    value = [
+        papers_fingerprint(papers_info),
+        sorted(extension.get('public_collection_ids') or []),
+        extension.get('spec_fingerprint'),
+    ]
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _question_hash(question):
+    return hashlib.md5(question.encode('utf-8')).hexdigest()
+
+
+def _bot_preset_answer_events(bot: Bot, paper_ids, question, model):
+    """
+    问答一次，记录 rag 返回的事件序列 [[距开始的毫秒数, 事件], ...]
+    出错返回 (None, None)
+    """
+    conv = RagConversation.create(
+        PRESET_ANSWER_USER_ID, None, agent_id=bot.agent_id, paper_ids=paper_ids,
+        public_collection_ids=(bot.extension or {}).get('public_collection_ids'), llm_name=model,
+    )
+    try:
+        resp = RagConversation.query_new(PRESET_ANSWER_USER_ID, conv['id'], question)
+        events, chunks, start = [], [], time.monotonic()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            line_data = json.loads(line.decode('utf-8').strip("data: "))
+            if not line_data or not line_data.get('event'):
+                continue
+            if line_data['event'] == 'on_error':
+                logger.warning(f'bot preset answer error, bot_id: {bot.id}, question: {question}, {line_data}')
+                return None, None
+            if line_data['event'] == 'model_stream':
+                chunks.append(line_data.get('chunk', ''))
+            events.append([int((time.monotonic() - start) * 1000), line_data])
+        return events, ''.join(chunks)
+    finally:
+        # 记录完成后删除生成用的 rag 会话
+        try:
+            RagConversation.delete(conv['id'])
+        except Exception as e:
+            logger.warning(f'bot preset answer delete rag conversation error, {conv["id"]}, {e}')
+
+
+def bot_preset_answers_refresh(bot: Bot, model=Conversation.LLMModel.BASIC):
+    """
+    预先问答专题的预置问题，文献集合指纹未变化的问题跳过，已删除的问题标记删除
+    :return: 本次生成的答案数量
+    """
+    questions = {_question_hash(q): q for q in (bot.questions or []) if q}
+    BotPresetAnswer.objects.filter(bot_id=bot.id, model=model, del_flag=False).exclude(
+        question_hash__in=questions.keys()).update(del_flag=True)
+    if bot.type != Bot.TypeChoices.PUBLIC or bot.del_flag or not bot.agent_id or not questions:
+        return 0
+    papers_info = bot_preset_papers_info(bot)
+    corpus_fingerprint = bot_corpus_fingerprint(bot, papers_info)
+    fresh_hashes = set(BotPresetAnswer.objects.filter(
+        bot_id=bot.id, model=model, corpus_fingerprint=corpus_fingerprint, del_flag=False,
+        question_hash__in=questions.keys(),
+    ).values_list('question_hash', flat=True))
+    paper_ids = [{
+        'collection_id': p['collection_id'],
+        'collection_type': p['collection_type'],
+        'doc_id': p['doc_id'],
+        'full_text_accessible': p['full_text_accessible']
+    } for p in papers_info]
+    refreshed_num = 0
+    for question_hash, question in questions.items():
+        if question_hash in fresh_hashes:
+            continue
+        try:
+            events, answer = _bot_preset_answer_events(bot, paper_ids, question, model)
+        except Exception as e:
+            logger.warning(f'bot preset answer exception, bot_id: {bot.id}, question: {question}, {e}')
+            continue
+        if not events:
+            continue
+        BotPresetAnswer.objects.update_or_create(
+            {
+                'question': question,
+                'corpus_fingerprint': corpus_fingerprint,
+                'events': events,
+                'answer': answer,
+                'del_flag': False,
+            },
+            bot_id=bot.id, question_hash=question_hash, model=model,
+        )
+        refreshed_num += 1
+    return refreshed_num
+
+
+def bot_preset_answer_match(bot_id, question, model):
+    """
+    新会话点击预置问题，返回已生成的答案；回放前还需 bot_preset_answer_is_fresh 检查文献集合
+    没有答案时直接返回，不计算文献集合
+    """
+    if not bot_id or not question:
+        return None
+    preset = BotPresetAnswer.objects.select_related('bot').filter(
+        bot_id=bot_id, bot__type=Bot.TypeChoices.PUBLIC, bot__del_flag=False,
+        question_hash=_question_hash(question), model=model or Conversation.LLMModel.BASIC, del_flag=False,
+    ).first()
+    if not preset or not preset.events or question not in (preset.bot.questions or []):
+        return None
+    return preset
+
+
+def bot_preset_answer_is_fresh(preset: BotPresetAnswer, papers_info):
+    """用户可见的文献集合与生成答案时一致才可回放"""
+    return preset.corpus_fingerprint == bot_corpus_fingerprint(preset.bot, papers_info)
+
+
+def bot_preset_answer_replay(preset: BotPresetAnswer, max_interval=0.1):
+    """
+    按生成时的节奏回放事件，单次间隔不超过 max_interval 秒，格式同 rag 返回的行
+    """
+    last_offset = 0
+    for offset, line_data in preset.events:
+        time.sleep(min(max(offset - last_offset, 0) / 1000, max_interval))
+        last_offset = offset
+        yield json.dumps(line_data).encode('utf-8')
@@ -0,0 +1,54 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:20
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_bot_advance_share'),
+        ('collection', '0006_collectionstats'),
+        ('document', '0016_ragoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotDocument',
+            fields=[
+                ('id', models.CharField(default=uuid.uuid4, max_length=36, primary_key=True, serialize=False)),
+                ('title', models.CharField(blank=True, db_default=None, default=None, max_length=512, null=True)),
+                ('del_flag', models.BooleanField(db_default=False, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('bot', models.ForeignKey(
+                    db_column='bot_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                    related_name='bot_document', to='bot.bot')),
+                ('document', models.ForeignKey(
+                    db_column='document_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                    related_name='bot_document', to='document.document')),
+            ],
+            options={
+                'verbose_name': 'bot_document',
+                'db_table': 'bot_document',
+                'unique_together': {('bot', 'document')},
+                'index_together': {('bot', 'title', 'document')},
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+            INSERT INTO bot_document (id, bot_id, document_id, title, del_flag, updated_at, created_at)
+            SELECT gen_random_uuid()::text, t.bot_id, t.document_id, t.title, false, now(), now()
+            FROM (
+                SELECT DISTINCT bc.bot_id, cd.document_id, d.title
+                FROM bot_collection bc
+                JOIN collection_document cd ON cd.collection_id = bc.collection_id AND NOT cd.del_flag
+                JOIN document d ON d.id = cd.document_id
+                WHERE NOT bc.del_flag
+            ) t
+            ON CONFLICT DO NOTHING
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:27
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_botdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotPublishOutbox',
+            fields=[
+                ('id', models.CharField(default=uuid.uuid4, max_length=36, primary_key=True, serialize=False)),
+                ('idempotency_key', models.CharField(max_length=128, unique=True)),
+                ('status', models.CharField(
+                    choices=[
+                        ('pending', 'pending'), ('in_progress', 'in_progress'), ('completed', 'completed'),
+                        ('dead', 'dead'),
+                    ],
+                    db_default='pending', default='pending', max_length=32)),
+                ('attempts', models.IntegerField(db_default=0, default=0)),
+                ('next_retry_at', models.DateTimeField(null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('del_flag', models.BooleanField(db_default=False, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('bot', models.ForeignKey(
+                    db_column='bot_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                    related_name='bot_publish_outbox', to='bot.bot')),
+            ],
+            options={
+                'verbose_name': 'bot_publish_outbox',
+                'db_table': 'bot_publish_outbox',
+                'index_together': {('status', 'next_retry_at')},
+            },
+        ),
+    ]
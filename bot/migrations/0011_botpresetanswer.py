@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:32
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_botpublishoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotPresetAnswer',
+            fields=[
+                ('id', models.CharField(default=uuid.uuid4, max_length=36, primary_key=True, serialize=False)),
+                ('question', models.TextField()),
+                ('question_hash', models.CharField(max_length=32)),
+                ('model', models.CharField(max_length=64)),
+                ('corpus_fingerprint', models.CharField(max_length=64)),
+                ('events', models.JSONField(null=True)),
+                ('answer', models.TextField(blank=True, null=True)),
+                ('del_flag', models.BooleanField(db_default=False, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('bot', models.ForeignKey(
+                    db_column='bot_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                    related_name='bot_preset_answer', to='bot.bot')),
+            ],
+            options={
+                'verbose_name': 'bot_preset_answer',
+                'db_table': 'bot_preset_answer',
+                'unique_together': {('bot', 'question_hash', 'model')},
+            },
+        ),
+    ]
@@ -1,3 +1,4 @@
+import datetime
 import logging
 import uuid
 
@@ -79,6 +80,97 @@ class BotCollection(models.Model):
         verbose_name = 'bot_collection'
 
 
+class BotDocument(models.Model):
+    """
+    专题文献（物化）：专题个人收藏夹中未删除的文献
+    BotCollection 或收藏夹文献变化后由 bot_documents_refresh 增量刷新
+    """
+    id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
+    bot = models.ForeignKey(
+        Bot, db_constraint=False, on_delete=models.DO_NOTHING, db_column='bot_id', related_name='bot_document')
+    document = models.ForeignKey(
+        'document.Document', db_constraint=False, on_delete=models.DO_NOTHING, db_column='document_id',
+        related_name='bot_document')
+    title = models.CharField(null=True, blank=True, max_length=512, default=None, db_default=None)
+    del_flag = models.BooleanField(default=False, db_default=False)
+    updated_at = models.DateTimeField(null=True, auto_now=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    class Meta:
+        db_table = 'bot_document'
+        verbose_name = 'bot_document'
+        unique_together = ['bot', 'document']
+        index_together = ['bot', 'title', 'document']
+
+    @classmethod
+    def sync_titles(cls, document_ids):
+        """文献标题更新后同步 BotDocument.title，一条 UPDATE"""
+        document_ids = list(set(d_id for d_id in document_ids if d_id))
+        if not document_ids:
+            return 0
+        document_model = cls._meta.get_field('document').related_model
+        return cls.objects.filter(document_id__in=document_ids).update(
+            title=models.Subquery(
+                document_model.objects.filter(id=models.OuterRef('document_id')).values('title')[:1]),
+            updated_at=datetime.datetime.now(),
+        )
+
+
+class BotPublishOutbox(models.Model):
+    """
+    专题发布 outbox：发布请求与专题状态在同一事务中写入，由 celery 立即执行
+    关联公共库文献未完成入库时等待，文献入库完成后唤醒；idempotency_key 保证同一次发布只写入一条
+    """
+    class StatusChoices(models.TextChoices):
+        PENDING = 'pending', _('pending')
+        IN_PROGRESS = 'in_progress', _('in_progress')
+        COMPLETED = 'completed', _('completed')
+        DEAD = 'dead', _('dead')
+
+    id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
+    bot = models.ForeignKey(
+        Bot, db_constraint=False, on_delete=models.DO_NOTHING, db_column='bot_id', related_name='bot_publish_outbox')
+    idempotency_key = models.CharField(max_length=128, unique=True)
+    status = models.CharField(
+        max_length=32, default=StatusChoices.PENDING, db_default=StatusChoices.PENDING, choices=StatusChoices)
+    attempts = models.IntegerField(default=0, db_default=0)
+    next_retry_at = models.DateTimeField(null=True)
+    error = models.TextField(null=True, blank=True)
+    del_flag = models.BooleanField(default=False, db_default=False)
+    updated_at = models.DateTimeField(null=True, auto_now=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    class Meta:
+        index_together = ['status', 'next_retry_at']
+        db_table = 'bot_publish_outbox'
+        verbose_name = 'bot_publish_outbox'
+
+
+class BotPresetAnswer(models.Model):
+    """
+    公开专题预置问题的答案：发布或专题语料变化后后台问答一次，保存完整的事件序列
+    点击预置问题且文献集合指纹 (corpus_fingerprint) 一致时回放，不再请求 rag
+    """
+    id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
+    bot = models.ForeignKey(
+        Bot, db_constraint=False, on_delete=models.DO_NOTHING, db_column='bot_id', related_name='bot_preset_answer')
+    question = models.TextField()
+    question_hash = models.CharField(max_length=32)
+    model = models.CharField(max_length=64)
+    corpus_fingerprint = models.CharField(max_length=64)
+    # [[距开始的毫秒数, rag 返回的事件], ...]
+    events = models.JSONField(null=True)
+    answer = models.TextField(null=True, blank=True)
+    del_flag = models.BooleanField(default=False, db_default=False)
+    updated_at = models.DateTimeField(null=True, auto_now=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    class Meta:
+        db_table = 'bot_preset_answer'
+        verbose_name = 'bot_preset_answer'
+        unique_together = ['bot', 'question_hash', 'model']
+
+
 class BotSubscribe(models.Model):
     id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
     user = models.ForeignKey(
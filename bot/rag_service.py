@@ -59,25 +59,47 @@ class Bot:
         if prompt and prompt['spec']['system_prompt']: post_data['prompt'] = prompt
         if paper_ids: post_data['paper_ids'] = paper_ids
         if public_collection_ids: post_data['public_collection_ids'] = public_collection_ids
-        if tools:
-            new_tools = []
-            for tool in tools:
-                tmp = {
-                    'type': 'OpenAPIToolset',
-                    'spec': {
-                        'name': tool['name'],
-                        'url': tool['url'],
-                        'openapi_json_path': tool['openapi_json_path'],
-                        'authentication': tool['endpoints'],
-                    }
-                }
-                new_tools.append(tmp)
-            post_data['tools'] = new_tools
+        if tools: post_data['tools'] = Bot.format_tools(tools)
         resp = rag_requests(url, json=post_data, method='POST')
         logger.info(f'url: {url}, response: {resp.text}')
         resp = resp.json()
         return resp
 
+    @staticmethod
+    def update(agent_id, **spec):
+        """
+        只提交有变化的字段 spec: prompt/preset_questions/tools/paper_ids/public_collection_ids
+        返回 None 表示无法增量更新（agent 不存在或接口不支持），由调用方重建
+        """
+        url = RAG_HOST + '/api/v1/agents/' + agent_id
+        put_data = dict(spec)
+        if 'tools' in put_data: put_data['tools'] = Bot.format_tools(put_data['tools'])
+        try:
+            resp = rag_requests(url, json=put_data, method='PUT', raise_for_status=False)
+        except RequestException as e:
+            logger.warning(f'update agent failed, agent_id: {agent_id}, error: {e}')
+            return None
+        logger.info(f'url: {url}, response: {resp.text}')
+        if resp.status_code != 200:
+            return None
+        return resp.json()
+
+    @staticmethod
+    def format_tools(tools):
+        new_tools = []
+        for tool in tools or []:
+            tmp = {
+                'type': 'OpenAPIToolset',
+                'spec': {
+                    'name': tool['name'],
+                    'url': tool['url'],
+                    'openapi_json_path': tool['openapi_json_path'],
+                    'authentication': tool['endpoints'],
+                }
+            }
+            new_tools.append(tmp)
+        return new_tools
+
     @staticmethod
     def delete(agent_id):
         url = RAG_HOST + '/api/v1/agents/' + agent_id
@@ -189,12 +211,14 @@ class Document:
         return resp
 
     @staticmethod
-    def ingest_personal_paper(user_id, object_path):
+    def ingest_personal_paper(user_id, object_path, checksum=None):
         url = RAG_HOST + '/api/v1/papers/ingest-task/personal'
         post_data = {
             'user_id': user_id,
             'object_path': object_path
         }
+        if checksum:
+            post_data['checksum'] = checksum
         resp = rag_requests(url, json=post_data, method='POST')
         logger.info(f'url: {url}, response: {resp.text}')
         resp = resp.json()
@@ -287,6 +311,13 @@ class Conversations:
         resp = resp.json()
         return resp
 
+    @staticmethod
+    def delete(conversation_id):
+        url = RAG_HOST + '/api/v1/conversations/' + conversation_id
+        resp = rag_requests(url, method='DELETE')
+        logger.info(f'url: {url}, response: {resp.text}')
+        return resp
+
     @staticmethod
     def generate_conversation_title(question, answer):
         url = RAG_HOST + '/api/v1/titles/conversation'
@@ -140,7 +140,10 @@ class BotListAllSerializer(BaseModelSerializer):
 
     @staticmethod
     def get_doc_total(obj):
-        bot_collections = BotCollection.objects.filter(bot_id=obj.id, del_flag=False).all()
+        # 列表查询已通过 bots_annotate_doc_total 注解
+        if (doc_total := getattr(obj, 'doc_total', None)) is not None:
+            return doc_total
+        bot_collections = BotCollection.objects.filter(bot_id=obj.id, del_flag=False).select_related('collection')
         return sum([bc.collection.total_public + bc.collection.total_personal for bc in bot_collections])
 
     class Meta:
@@ -161,7 +164,10 @@ class BotListMySerializer(BaseModelSerializer):
 
     @staticmethod
     def get_doc_total(obj):
-        bot_collections = BotCollection.objects.filter(bot_id=obj.id, del_flag=False).all()
+        # 列表查询已通过 bots_annotate_doc_total 注解
+        if (doc_total := getattr(obj, 'doc_total', None)) is not None:
+            return doc_total
+        bot_collections = BotCollection.objects.filter(bot_id=obj.id, del_flag=False).select_related('collection')
         return sum([bc.collection.total_public + bc.collection.total_personal for bc in bot_collections])
 
     class Meta:
@@ -188,6 +194,8 @@ class BotDocumentsQuerySerializer(serializers.Serializer):
     page_num = serializers.IntegerField(required=False, default=1)
     page_size = serializers.IntegerField(required=False, default=10)
     keyword = serializers.CharField(required=False, trim_whitespace=False, allow_blank=True, default=None)
+    # 上一页返回的 next_cursor，传入时按 keyset 翻页，忽略 page_num
+    cursor = serializers.CharField(required=False, allow_blank=True, allow_null=True, default=None)
 
     def validate(self, attrs):
         if attrs.get('list_type') in ['subscribe_full_text', 'all_documents'] and not attrs.get('bot_id'):
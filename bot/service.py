@@ -1,22 +1,25 @@
 import datetime
 import logging
 
+from django.db import transaction
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 
-from bot.base_service import recreate_bot, collections_doc_ids, mine_bot_document_ids
+from bot.base_service import sync_bot, agent_spec, agent_spec_fingerprint, mine_bot_document_ids, \
+    bot_documents_refresh, bots_annotate_doc_total, bots_annotate_mine_doc_total, bot_publish_outbox_add, \
+    BotListCache
 from bot.models import Bot, BotCollection, BotSubscribe, HotBot, BotTools
 from bot.rag_service import Bot as RagBot
 from bot.serializers import (BotDetailSerializer, BotListAllSerializer, HotBotListSerializer, BotListChatMenuSerializer,
                              MyBotListAllSerializer, BotToolsDetailSerializer, BotToolsUpdateQuerySerializer,
                              BotsPlazaResultsSerializer)
-from collection.models import Collection, CollectionDocument
+from collection.models import Collection, CollectionDocument, CollectionStats
 from collection.serializers import CollectionDocumentListSerializer, bot_subscribe_personal_document_num
 from core.utils.exceptions import InternalServerError, ValidationError
 from customadmin.models import GlobalConfig
 from document.base_service import update_document_lib
-from document.models import Document, DocumentLibrary
-from document.tasks import async_schedule_publish_bot_task, async_ref_document_to_document_library
+from document.models import Document, DocumentLibraryCache
+from document.tasks import async_bot_publish_dispatch, async_ref_document_to_document_library, async_bot_preset_answers
 from vip.base_service import tokens_award
 from vip.models import Member, TokensHistory
 from vip.serializers import MemberInfoSerializer
@@ -53,16 +56,17 @@ def bot_create(body):
     bot_subscribe_collections = [c for c in collections if c.bot_id]
     if bot_subscribe_collections:
         raise ValidationError(_('订阅专题收藏夹不能用于创建专题'))
-    public_collection_ids = [c.id for c in collections if c.type == c.TypeChoices.PUBLIC]
+    spec = agent_spec(Bot(**data), collections)
     rag_ret = RagBot.create(
         data['user_id'],
-        data['prompt'],
-        data['questions'],
-        tools=data['tools'],
-        paper_ids=collections_doc_ids(collections),
-        public_collection_ids=public_collection_ids,
+        spec['prompt'],
+        spec['preset_questions'],
+        tools=spec['tools'],
+        paper_ids=spec['paper_ids'],
+        public_collection_ids=spec['public_collection_ids'],
     )
     if rag_ret.get('id'):
+        rag_ret['spec_fingerprint'] = agent_spec_fingerprint(spec)
         data['extension'] = rag_ret
         data['agent_id'] = rag_ret['id']
         # data['prompt'] = rag_ret['spec']['prompt']
@@ -75,6 +79,8 @@ def bot_create(body):
                 'collection_type': c.type
             }
             BotCollection.objects.create(**bot_c_data)
+        CollectionStats.refresh([c.id for c in collections])
+        bot_documents_refresh([bot.id])
     else:
         raise InternalServerError('RAG create bot failed')
     return bot
@@ -86,9 +92,9 @@ def bot_update(bot, bot_collections, updated_attrs, validated_data):
     collections = Collection.objects.filter(id__in=validated_data['collections'], del_flag=False).all()
     c_dict = {c.id: c for c in collections}
     c_ids = [c.id for c in collections]
-    need_recreate_attrs = ['questions', 'prompt_spec', 'collections', 'tools']
-    if set(need_recreate_attrs) & set(updated_attrs):
-        recreate_bot(bot, collections)
+    need_sync_attrs = ['questions', 'prompt_spec', 'collections', 'tools']
+    if set(need_sync_attrs) & set(updated_attrs):
+        sync_bot(bot, collections)
     # update ref_document_to_document_library
     if bot.type == Bot.TypeChoices.PUBLIC or bot.advance_share:
         for collection_id in validated_data['collections']:
@@ -110,7 +116,12 @@ def bot_update(bot, bot_collections, updated_attrs, validated_data):
     if to_dell_c_ids := set(bc_ids) - set(c_ids):
         logger.debug(f'bot_update to_dell_c_ids: {to_dell_c_ids}')
         BotCollection.objects.filter(bot_id=bot.id, collection_id__in=to_dell_c_ids).update(del_flag=True)
+    CollectionStats.refresh(set(c_ids) | set(bc_ids))
+    bot_documents_refresh([bot.id])
     bot.save()
+    BotListCache.invalidate()
+    if bot.type == Bot.TypeChoices.PUBLIC and set(need_sync_attrs) & set(updated_attrs):
+        async_bot_preset_answers.apply_async(args=[bot.id])
     return BotDetailSerializer(bot).data
 
 
@@ -118,22 +129,32 @@ def bot_update(bot, bot_collections, updated_attrs, validated_data):
 def bot_delete(bot_id):
     bot = Bot.objects.get(pk=bot_id)
     RagBot.delete(bot.agent_id)
-    BotCollection.objects.filter(bot_id=bot.id).update(del_flag=True)
+    bot_collections = BotCollection.objects.filter(bot_id=bot.id)
+    collection_ids = list(bot_collections.values_list('collection_id', flat=True))
+    bot_collections.update(del_flag=True)
+    CollectionStats.refresh(collection_ids)
+    bot_documents_refresh([bot.id])
     bot.del_flag = True
     bot.save()
+    BotListCache.invalidate()
     return bot_id
 
 
 # 专题列表
 def hot_bots():
-    hot_order0 = HotBot.objects.filter(
-        del_flag=False, bot__del_flag=False, order_num=0).order_by('order_num', '-updated_at').all()
-    hot_order = HotBot.objects.filter(
-        del_flag=False, bot__del_flag=False, order_num__gt=0).order_by('order_num', '-updated_at').all()
-    hot_bot_list_data = (
-        list(HotBotListSerializer(hot_order, many=True).data) + list(HotBotListSerializer(hot_order0, many=True).data)
-    )
-    return hot_bot_list_data
+    def _hot_bots():
+        hot_order0 = HotBot.objects.filter(
+            del_flag=False, bot__del_flag=False, order_num=0
+        ).select_related('bot').order_by('order_num', '-updated_at').all()
+        hot_order = HotBot.objects.filter(
+            del_flag=False, bot__del_flag=False, order_num__gt=0
+        ).select_related('bot').order_by('order_num', '-updated_at').all()
+        return (
+            list(HotBotListSerializer(hot_order, many=True).data)
+            + list(HotBotListSerializer(hot_order0, many=True).data)
+        )
+
+    return BotListCache.get_or_set('hot', 0, _hot_bots)
 
 
 def add_hot_bot(bot_id, order=0):
@@ -143,6 +164,7 @@ def add_hot_bot(bot_id, order=0):
         'del_flag': False,
     }
     hot_bot, _ = HotBot.objects.update_or_create(hot_bot_data, bot_id=bot_id)
+    BotListCache.invalidate()
     return hot_bot
 
 
@@ -162,12 +184,20 @@ def get_bot_list(validated_data):
 
 
 def bot_list_all(user_id, page_size=10, page_num=1):
-    user_subscribe_bot = BotSubscribe.objects.filter(user_id=user_id, del_flag=False).all()
-    us_bot_ids = [us_b.bot_id for us_b in user_subscribe_bot]
-    order0_query_set = Bot.objects.filter(
-        type=Bot.TypeChoices.PUBLIC, del_flag=False, order=0).order_by('-updated_at')
-    order_query_set = Bot.objects.filter(
-        type=Bot.TypeChoices.PUBLIC, del_flag=False, order__gt=0).order_by('order', '-updated_at')
+    us_bot_ids = set(BotSubscribe.objects.filter(user_id=user_id, del_flag=False).values_list('bot_id', flat=True))
+    bot_list = BotListCache.get_or_set(
+        'all', f'{page_size}:{page_num}', lambda: _bot_list_all(page_size, page_num))
+    return {
+        'list': [{**b_data, 'subscribed': b_data['id'] in us_bot_ids} for b_data in bot_list['list']],
+        'total': bot_list['total']
+    }
+
+
+def _bot_list_all(page_size, page_num):
+    order0_query_set = bots_annotate_doc_total(Bot.objects.filter(
+        type=Bot.TypeChoices.PUBLIC, del_flag=False, order=0).order_by('-updated_at'))
+    order_query_set = bots_annotate_doc_total(Bot.objects.filter(
+        type=Bot.TypeChoices.PUBLIC, del_flag=False, order__gt=0).order_by('order', '-updated_at'))
     order_filter_count = order_query_set.count()
     order0_filter_count = order0_query_set.count()
     start_num = page_size * (page_num - 1)
@@ -182,33 +212,29 @@ def bot_list_all(user_id, page_size=10, page_num=1):
         order0_bots_end = order0_bots_start + remaining_slots
         order0_bots = list(order0_query_set[order0_bots_start:order0_bots_end])
     bots = order_bots + order0_bots
-
-    bot_list_data = BotListAllSerializer(bots, many=True).data
-    for index, b_data in enumerate(bot_list_data):
-        bot_list_data[index]['subscribed'] = False
-        if b_data['id'] in us_bot_ids:
-            bot_list_data[index]['subscribed'] = True
     return {
-        'list': bot_list_data,
+        'list': [dict(b_data) for b_data in BotListAllSerializer(bots, many=True).data],
         'total': order_filter_count + order0_filter_count
     }
 
 
 def bots_plaza():
-    order0_query_set = Bot.objects.filter(
-        type=Bot.TypeChoices.PUBLIC, del_flag=False, order=0).order_by('-updated_at')
-    order_query_set = Bot.objects.filter(
-        type=Bot.TypeChoices.PUBLIC, del_flag=False, order__gt=0).order_by('order', '-updated_at')
-    bots = list(order_query_set) + list(order0_query_set)
-    data = BotsPlazaResultsSerializer(bots, many= True).data
-    return data
+    def _bots_plaza():
+        order0_query_set = Bot.objects.filter(
+            type=Bot.TypeChoices.PUBLIC, del_flag=False, order=0).order_by('-updated_at')
+        order_query_set = Bot.objects.filter(
+            type=Bot.TypeChoices.PUBLIC, del_flag=False, order__gt=0).order_by('order', '-updated_at')
+        bots = list(order_query_set) + list(order0_query_set)
+        return [dict(b_data) for b_data in BotsPlazaResultsSerializer(bots, many=True).data]
+
+    return BotListCache.get_or_set('plaza', 0, _bots_plaza)
 
 
 def bot_list_subscribe(user_id, page_size=10, page_num=1):
     user_subscribe_bot = BotSubscribe.objects.filter(user_id=user_id, del_flag=False).all()
     bot_ids = [us_bot.bot_id for us_bot in user_subscribe_bot]
     filter_query = Q(del_flag=False) & (Q(id__in=bot_ids) | Q(user_id=user_id))
-    query_set = Bot.objects.filter(filter_query).order_by('-pub_date')
+    query_set = bots_annotate_doc_total(Bot.objects.filter(filter_query).order_by('-pub_date'))
     filter_count = query_set.count()
     start_num = page_size * (page_num - 1)
     logger.info(f"limit: [{start_num}: {page_size * page_num}]")
@@ -228,11 +254,11 @@ def bot_list_mine(user_id, page_size=10, page_num=1):
     filter_count = query_set.count()
     start_num = page_size * (page_num - 1)
     logger.info(f"limit: [{start_num}: {page_size * page_num}]")
-    bots = query_set[start_num:(page_size * page_num)]
+    bots = bots_annotate_mine_doc_total(query_set)[start_num:(page_size * page_num)]
     bot_dict = {b.id: b for b in bots}
     bot_list_data = MyBotListAllSerializer(bots, many=True).data
     for index, b_data in enumerate(bot_list_data):
-        bot_list_data[index]['doc_total'] = _mine_bot_documents_total(bot_dict[b_data['id']])
+        bot_list_data[index]['doc_total'] = bot_dict[b_data['id']].doc_total
         bot_list_data[index]['subscribed'] = True
 
     return {
@@ -241,19 +267,6 @@ def bot_list_mine(user_id, page_size=10, page_num=1):
     }
 
 
-def _mine_bot_documents_total(bot):
-    total = 0
-    collections = BotCollection.objects.filter(
-        bot_id=bot.id, del_flag=False).values_list('collection_id', flat=True).all()
-    public_collection_ids = Collection.objects.filter(
-        id__in=collections, type=Collection.TypeChoices.PUBLIC, del_flag=False).values('id', 'total_public').all()
-    if public_collection_ids:
-        total += sum([p_c['total_public'] for p_c in public_collection_ids])
-    total += CollectionDocument.objects.filter(
-        collection_id__in=collections, del_flag=False).values('document_id').distinct('document_id').count()
-    return total
-
-
 def bot_list_chat_menu(user_id, page_size=10, page_num=1):
     """
     my bot + public bot
@@ -298,13 +311,8 @@ def bot_user_full_text_document_ids(bot_id=None, bot: Bot = None):
         bot = Bot.objects.get(pk=bot_id)
     bot_id = bot.id
     bot_document_ids = mine_bot_document_ids(bot_id)
-    bot_document_lib_ids = DocumentLibrary.objects.filter(
-        user_id=bot.user_id,
-        del_flag=False,
-        document_id__in=set(bot_document_ids),
-        # task_type='public',
-        task_status=DocumentLibrary.TaskStatusChoices.COMPLETED
-        ).values_list('document_id', flat=True).all()
+    bot_document_lib_ids = DocumentLibraryCache(bot.user_id).intersection(
+        bot_document_ids, DocumentLibraryCache.COMPLETED)
     document_ids = Document.objects.filter(
         id__in=bot_document_lib_ids, full_text_accessible=True, del_flag=False).values_list('id', flat=True).all()
     return list(document_ids)
@@ -317,21 +325,27 @@ def bot_publish(bot_id, order, action=Bot.TypeChoices.PUBLIC):
     if bot.type == Bot.TypeChoices.IN_PROGRESS:
         return 110006, 'bot publish is in progress', {}
 
-    if action == Bot.TypeChoices.PUBLIC:
-        bot.order = order
-        if bot.type != Bot.TypeChoices.PUBLIC:
-            bot.type = Bot.TypeChoices.IN_PROGRESS
-            bot.pub_date = datetime.datetime.now()
-            # 个人文献 下载关联公共库文献
-            p_documents, ref_documents = bot_subscribe_personal_document_num(bot.user_id, bot=bot)
-            if ref_documents:
-                update_document_lib('0000', ref_documents)
-            elif action == Bot.TypeChoices.PUBLIC:
-                bot.type = Bot.TypeChoices.PUBLIC
-    else:
-        bot.type = Bot.TypeChoices.PERSONAL
-    bot.save()
-    async_schedule_publish_bot_task.apply_async()
+    with transaction.atomic():
+        if action == Bot.TypeChoices.PUBLIC:
+            bot.order = order
+            if bot.type != Bot.TypeChoices.PUBLIC:
+                bot.type = Bot.TypeChoices.IN_PROGRESS
+                bot.pub_date = datetime.datetime.now()
+                # 个人文献 下载关联公共库文献
+                p_documents, ref_documents = bot_subscribe_personal_document_num(bot.user_id, bot=bot)
+                if ref_documents:
+                    update_document_lib('0000', ref_documents)
+                elif action == Bot.TypeChoices.PUBLIC:
+                    bot.type = Bot.TypeChoices.PUBLIC
+        else:
+            bot.type = Bot.TypeChoices.PERSONAL
+        bot.save()
+        BotListCache.invalidate()
+        if bot.type == Bot.TypeChoices.IN_PROGRESS:
+            bot_publish_outbox_add(bot)
+            transaction.on_commit(lambda: async_bot_publish_dispatch.apply_async())
+        elif bot.type == Bot.TypeChoices.PUBLIC:
+            transaction.on_commit(lambda: async_bot_preset_answers.apply_async(args=[bot.id]))
     return 0, '', MyBotListAllSerializer(bot).data
 
 
@@ -7,7 +7,7 @@ from rest_framework.decorators import permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 
-from bot.base_service import bot_detail, bot_documents
+from bot.base_service import bot_detail, bot_documents, BotListCache
 from bot.models import Bot, HotBot, BotTools
 from bot.rag_service import Bot as RagBot
 from bot.serializers import BotCreateSerializer, BotListQuerySerializer, BotDocumentsQuerySerializer, \
@@ -17,9 +17,9 @@ from bot.service import (bot_create, bot_delete, bot_publish, bot_subscribe, bot
                          bot_tools_create, bot_tools_update, formate_bot_tools, del_invalid_bot_tools,
                          bot_tools_add_bot_id, bot_user_full_text_document_ids, bots_plaza, bots_advance_share_info,
                          add_hot_bot)
-from document.tasks import async_add_user_operation_log
 from core.utils.exceptions import ValidationError
 from core.utils.views import extract_json, my_json_response
+from user.service import UserOperationLogQueue
 
 logger = logging.getLogger(__name__)
 
@@ -62,6 +62,7 @@ class HotBots(APIView):
             return my_json_response(code=100002, msg=_('hot_bot not found'))
         hot_bot.del_flag = True
         hot_bot.save()
+        BotListCache.invalidate()
         return my_json_response({})
 
 
@@ -78,12 +79,13 @@ class Bots(APIView):
             if not bot:
                 return my_json_response(code=100002, msg=_('bot not found'))
             data = bot_detail(user_id, bot)
-            async_add_user_operation_log.apply_async(kwargs={
-                'user_id': user_id,
-                'operation_type': 'bot_detail',
-                'obj_id1': bot.id,
-                'obj_id2': query['from'][:32] if query.get('from') else None,
-            })
+            UserOperationLogQueue().push(
+                user_id=user_id,
+                operation_type='bot_detail',
+                obj_id1=bot.id,
+                obj_id2=query['from'][:32] if query.get('from') else None,
+                result={'subscribed': data['subscribed']},
+            )
         else:
             query_data = kwargs['request_data']['GET']
             query_data['user_id'] = user_id
@@ -254,7 +256,8 @@ class BotDocuments(APIView):
         if not serial.is_valid():
             return my_json_response(serial.errors, code=100001, msg=f'validate error, {list(serial.errors.keys())}')
         vd = serial.validated_data
-        docs = bot_documents(request.user.id, bot, vd['list_type'], vd['page_size'], vd['page_num'], vd['keyword'])
+        docs = bot_documents(
+            request.user.id, bot, vd['list_type'], vd['page_size'], vd['page_num'], vd['keyword'], vd['cursor'])
         return my_json_response(docs)
 
 
@@ -286,6 +289,7 @@ class BotUnPublish(APIView):
         bot.pub_date = None
         bot.order = 0
         bot.save()
+        BotListCache.invalidate()
         return my_json_response(MyBotListAllSerializer(bot).data)
 
 
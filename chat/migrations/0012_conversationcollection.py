@@ -0,0 +1,52 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:25
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_alter_question_model'),
+        ('collection', '0006_collectionstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationCollection',
+            fields=[
+                ('id', models.CharField(default=uuid.uuid4, max_length=36, primary_key=True, serialize=False)),
+                ('del_flag', models.BooleanField(db_default=False, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('collection', models.ForeignKey(
+                    db_column='collection_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                    related_name='conversation_collection', to='collection.collection')),
+                ('conversation', models.ForeignKey(
+                    db_column='conversation_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                    related_name='conversation_collection', to='chat.conversation')),
+            ],
+            options={
+                'verbose_name': 'conversation_collection',
+                'db_table': 'conversation_collection',
+                'unique_together': {('conversation', 'collection')},
+                'index_together': {('collection', 'conversation')},
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+            INSERT INTO conversation_collection (id, conversation_id, collection_id, del_flag, updated_at, created_at)
+            SELECT gen_random_uuid()::text, t.conversation_id, t.collection_id, false, now(), now()
+            FROM (
+                SELECT DISTINCT c.id AS conversation_id, e.collection_id
+                FROM conversation c
+                CROSS JOIN LATERAL jsonb_array_elements_text(
+                    CASE WHEN jsonb_typeof(c.collections) = 'array' THEN c.collections ELSE '[]'::jsonb END
+                ) AS e(collection_id)
+            ) t
+            ON CONFLICT DO NOTHING
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
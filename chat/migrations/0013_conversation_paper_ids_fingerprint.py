@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_conversationcollection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='paper_ids_fingerprint',
+            field=models.CharField(blank=True, db_default=None, default=None, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:35
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_conversation_paper_ids_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionReference',
+            fields=[
+                ('id', models.CharField(default=uuid.uuid4, max_length=36, primary_key=True, serialize=False)),
+                ('ordinal', models.IntegerField()),
+                ('collection_id', models.CharField(max_length=36, null=True)),
+                ('doc_id', models.CharField(max_length=36, null=True)),
+                ('content', models.JSONField(null=True)),
+                ('del_flag', models.BooleanField(db_default=False, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('question', models.ForeignKey(
+                    db_column='question_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                    related_name='question_reference', to='chat.question')),
+            ],
+            options={
+                'verbose_name': 'question_reference',
+                'db_table': 'question_reference',
+                'unique_together': {('question', 'ordinal')},
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+            INSERT INTO question_reference (
+                id, question_id, ordinal, collection_id, doc_id, content, del_flag, updated_at, created_at)
+            SELECT gen_random_uuid()::text, q.id, (r.ordinal - 1)::int,
+                left(r.elem->>'collection_id', 36), left(r.elem->>'doc_id', 36),
+                (
+                    SELECT jsonb_object_agg(e.key, e.value) FROM jsonb_each(r.elem) AS e(key, value)
+                    WHERE e.key IN (
+                        'bbox', 'doc_id', 'citation_id', 'content_type', 'collection_id', 'collection_type',
+                        'title', 'authors'
+                    )
+                ),
+                false, now(), now()
+            FROM question q
+            CROSS JOIN LATERAL jsonb_array_elements(
+                CASE WHEN jsonb_typeof(q.stream->'output') = 'array' THEN q.stream->'output' ELSE '[]'::jsonb END
+            ) WITH ORDINALITY AS r(elem, ordinal)
+            WHERE jsonb_typeof(r.elem) = 'object' AND r.elem ? 'bbox'
+            ON CONFLICT DO NOTHING
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -4,6 +4,8 @@ import uuid
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from core.utils.common import papers_fingerprint
+
 logger = logging.getLogger(__name__)
 
 
@@ -52,6 +54,7 @@ class Conversation(models.Model):
     agent_id = models.CharField(null=True, blank=True, max_length=36, default=None, db_default=None)
     public_collection_ids = models.JSONField(null=True, blank=True, db_default=None)
     paper_ids = models.JSONField(null=True, blank=True, db_default=None)
+    paper_ids_fingerprint = models.CharField(null=True, blank=True, max_length=64, default=None, db_default=None)
     type = models.CharField(null=True, blank=True, max_length=32, default=None, db_default=None, choices=TypeChoices)
     bot_id = models.CharField(null=True, blank=True, max_length=36, default=None, db_default=None)
     collections = models.JSONField(null=True)
@@ -69,6 +72,51 @@ class Conversation(models.Model):
         db_table = 'conversation'
         verbose_name = 'conversation'
 
+    def is_papers_changed(self, papers):
+        """旧数据没有指纹时按 paper_ids 计算"""
+        old_fingerprint = self.paper_ids_fingerprint or papers_fingerprint(self.paper_ids)
+        return old_fingerprint != papers_fingerprint(papers)
+
+    def set_papers(self, papers):
+        self.paper_ids = papers
+        self.paper_ids_fingerprint = papers_fingerprint(papers)
+
+
+class ConversationCollection(models.Model):
+    """
+    问答关联的个人收藏夹，与 Conversation.collections 保持一致，用于按收藏夹反查问答
+    """
+    id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
+    conversation = models.ForeignKey(
+        Conversation, db_constraint=False, on_delete=models.DO_NOTHING, db_column='conversation_id',
+        related_name='conversation_collection')
+    collection = models.ForeignKey(
+        'collection.Collection', db_constraint=False, on_delete=models.DO_NOTHING, db_column='collection_id',
+        related_name='conversation_collection')
+    del_flag = models.BooleanField(default=False, db_default=False)
+    updated_at = models.DateTimeField(null=True, auto_now=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    class Meta:
+        db_table = 'conversation_collection'
+        verbose_name = 'conversation_collection'
+        unique_together = ['conversation', 'collection']
+        index_together = ['collection', 'conversation']
+
+    @staticmethod
+    def sync(conversation: Conversation):
+        """按 conversation.collections 写入差异"""
+        collection_ids = set(c_id for c_id in (conversation.collections or []) if c_id)
+        old_ids = set(ConversationCollection.objects.filter(
+            conversation_id=conversation.id).values_list('collection_id', flat=True))
+        if to_del_ids := old_ids - collection_ids:
+            ConversationCollection.objects.filter(
+                conversation_id=conversation.id, collection_id__in=to_del_ids).delete()
+        if to_add_ids := collection_ids - old_ids:
+            ConversationCollection.objects.bulk_create([
+                ConversationCollection(conversation_id=conversation.id, collection_id=c_id) for c_id in to_add_ids
+            ], ignore_conflicts=True)
+
 
 class Question(models.Model):
 
@@ -94,6 +142,63 @@ class Question(models.Model):
         verbose_name = 'question'
 
 
+class QuestionReference(models.Model):
+    """
+    问题的参考文献，问答结束时从 Question.stream['output'] 写入，列表查询不再加载 stream
+    ordinal 为在 stream['output'] 中的位置
+    """
+    REFERENCE_FIELDS = [
+        'bbox', 'doc_id', 'citation_id', 'content_type', 'collection_id', 'collection_type', 'title', 'authors']
+
+    id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
+    question = models.ForeignKey(
+        Question, db_constraint=False, on_delete=models.DO_NOTHING, db_column='question_id',
+        related_name='question_reference')
+    ordinal = models.IntegerField()
+    collection_id = models.CharField(null=True, max_length=36)
+    doc_id = models.CharField(null=True, max_length=36)
+    content = models.JSONField(null=True)
+    del_flag = models.BooleanField(default=False, db_default=False)
+    updated_at = models.DateTimeField(null=True, auto_now=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    class Meta:
+        db_table = 'question_reference'
+        verbose_name = 'question_reference'
+        unique_together = ['question', 'ordinal']
+
+    @staticmethod
+    def sync(questions):
+        """按 question.stream['output'] 重写参考文献"""
+        objs = []
+        for question in questions:
+            output = question.stream.get('output') if question.stream else None
+            for ordinal, ref in enumerate(output or []):
+                if not isinstance(ref, dict) or 'bbox' not in ref:
+                    continue
+                objs.append(QuestionReference(
+                    question_id=question.id,
+                    ordinal=ordinal,
+                    collection_id=str(ref['collection_id'])[:36] if ref.get('collection_id') else None,
+                    doc_id=str(ref['doc_id'])[:36] if ref.get('doc_id') else None,
+                    content={k: v for k, v in ref.items() if k in QuestionReference.REFERENCE_FIELDS},
+                ))
+        QuestionReference.objects.filter(question_id__in=[q.id for q in questions]).delete()
+        if objs:
+            QuestionReference.objects.bulk_create(objs, ignore_conflicts=True)
+
+    @staticmethod
+    def references_map(question_ids):
+        """一次查询整页问题的参考文献 {question_id: [content, ...]}"""
+        references = {}
+        query_set = QuestionReference.objects.filter(
+            question_id__in=question_ids, del_flag=False).order_by('question_id', 'ordinal').values_list(
+            'question_id', 'content')
+        for question_id, content in query_set:
+            references.setdefault(question_id, []).append(content)
+        return references
+
+
 class ConversationShare(models.Model):
     id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
     user = models.ForeignKey(
@@ -215,8 +215,11 @@ class QuestionReferenceSerializer(serializers.Serializer):
 class QuestionListSerializer(serializers.ModelSerializer):
     references = serializers.SerializerMethodField()
 
-    @staticmethod
-    def get_references(obj: Question):
+    def get_references(self, obj: Question):
+        # 列表查询 defer stream，由 context['references'] (QuestionReference.references_map) 整页传入
+        references = self.context.get('references')
+        if references is not None:
+            return QuestionReferenceSerializer(references.get(obj.id, []), many=True).data
         data = []
         if obj.stream and obj.stream.get('output'):
             data = [QuestionReferenceSerializer(o).data for o in obj.stream['output'] if 'bbox' in o]
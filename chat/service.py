@@ -7,19 +7,19 @@ import requests
 from django.db.models import Q
 
 from dateutil.relativedelta import relativedelta
-from operator import itemgetter
 
+from bot.base_service import bot_preset_answer_match, bot_preset_answer_is_fresh, bot_preset_answer_replay
 from bot.models import Bot, BotCollection
 from bot.rag_service import Conversations as RagConversation
-from chat.models import Conversation, Question, ConversationShare
+from chat.models import Conversation, Question, ConversationShare, ConversationCollection, QuestionReference
 from chat.serializers import ConversationCreateSerializer, ConversationDetailSerializer, ConversationListSerializer, \
     QuestionListSerializer, ConversationShareCreateQuerySerializer
 from collection.base_service import update_conversation_by_collection
 from collection.models import Collection, CollectionDocument
 from collection.serializers import CollectionDocumentListSerializer
 from collection.service import create_collection_by_documents
-from core.utils.common import cmp_ignore_order
-from document.models import DocumentLibrary, Document
+from core.utils.common import papers_fingerprint
+from document.models import DocumentLibrary, Document, DocumentLibraryCache
 from document.service import document_update_from_rag
 from document.tasks import async_update_conversation_share_content
 from openapi.base_service import record_openapi_log
@@ -31,14 +31,15 @@ from vip.serializers import LimitCheckSerializer
 logger = logging.getLogger(__name__)
 
 
-def conversation_create(user_id, validated_data, openapi_kay_id=None):
+def conversation_create(user_id, validated_data, openapi_kay_id=None, papers_info=None, history_messages=None):
     vd = validated_data
     title = vd['content'][:128] if vd.get('content') else None
     # 判断 chat类型
     chat_type = ConversationCreateSerializer.get_chat_type(validated_data)
-    papers_info = ConversationCreateSerializer.get_papers_info(
-        user_id, vd.get('bot_id'), vd.get('collections'), vd['all_document_ids']
-    )
+    if papers_info is None:
+        papers_info = ConversationCreateSerializer.get_papers_info(
+            user_id, vd.get('bot_id'), vd.get('collections'), vd['all_document_ids']
+        )
     if chat_type == Conversation.TypeChoices.BOT_COV:
         bot_id = validated_data.get('bot_id')
         bot = Bot.objects.get(pk=bot_id, del_flag=False)
@@ -75,7 +76,7 @@ def conversation_create(user_id, validated_data, openapi_kay_id=None):
                     document_id=document_id,
                     full_text_accessible=document_id in d_lib,  # todo v1.0 默认都有全文 v2.0需要考虑策略
                 ))
-            CollectionDocument.objects.bulk_create(c_doc_objs)
+            CollectionDocument.objects.bulk_create(c_doc_objs, ignore_conflicts=True)
         agent_id = None
         # paper_ids = vd.get('paper_ids')
         public_collection_ids = vd.get('public_collection_ids')
@@ -105,6 +106,8 @@ def conversation_create(user_id, validated_data, openapi_kay_id=None):
         'public_collection_ids': public_collection_ids,
         'llm_name': vd['model'],
     }
+    if history_messages:
+        rag_conv_create_data['history_messages'] = history_messages
     conv = RagConversation.create(**rag_conv_create_data)
     conversation = Conversation.objects.create(
         id=conv['id'],
@@ -116,11 +119,13 @@ def conversation_create(user_id, validated_data, openapi_kay_id=None):
         collections=collections,
         public_collection_ids=conv['public_collection_ids'],
         paper_ids=papers_info,
+        paper_ids_fingerprint=papers_fingerprint(papers_info),
         type=chat_type,
         is_named=title is not None,
         bot_id=vd.get('bot_id'),
         is_api=True if openapi_kay_id else False,
     )
+    ConversationCollection.sync(conversation)
     # 返回 Conversation id
     return conversation
 
@@ -196,11 +201,13 @@ def conversation_create_by_share(user_id, conversation_share: ConversationShare,
         collections=collections,
         public_collection_ids=conv['public_collection_ids'],
         paper_ids=papers_info,
+        paper_ids_fingerprint=papers_fingerprint(papers_info),
         type=chat_type,
         is_named=title is not None,
         bot_id=vd.get('bot_id'),
         is_api=True if openapi_kay_id else False,
     )
+    ConversationCollection.sync(conversation)
     # add questions to conversation
     questions, times = conversation_share.content.get('questions'), 0
     while not questions and times < 3:
@@ -225,6 +232,7 @@ def conversation_create_by_share(user_id, conversation_share: ConversationShare,
                 source='share',
             ))
         question_objs = Question.objects.bulk_create(conv_questions)
+        QuestionReference.sync(question_objs)
         logger.debug(f'conversation {conversation.id} add {len(question_objs)} questions')
     # 返回 Conversation id
     return conversation
@@ -253,12 +261,8 @@ def update_simple_conversation(conversation: Conversation):
     if not conversation or (not conversation.documents and not conversation.bot_id and not conversation.collections):
         return conversation
     elif conversation.documents:
-        doc_libs = DocumentLibrary.objects.filter(
-            user_id=conversation.user_id,
-            document_id__in=conversation.documents,
-            del_flag=False,
-            task_status=DocumentLibrary.TaskStatusChoices.COMPLETED
-        ).values_list('document_id', flat=True).all()
+        doc_libs = DocumentLibraryCache(conversation.user_id).intersection(
+            conversation.documents, DocumentLibraryCache.COMPLETED)
         documents = Document.objects.filter(id__in=conversation.documents, del_flag=False).all()
         new_paper_ids = [{
             'collection_id': d.collection_id,
@@ -274,7 +278,7 @@ def update_simple_conversation(conversation: Conversation):
             'full_text_accessible': d.id in doc_libs,
         } for d in documents] if documents else []
 
-        if not cmp_ignore_order(conversation.paper_ids, new_papers_info, sort_fun=itemgetter('collection_id', 'doc_id')):
+        if conversation.is_papers_changed(new_papers_info):
             update_data = {
                 'conversation_id': conversation.id,
                 'agent_id': conversation.agent_id,
@@ -283,7 +287,7 @@ def update_simple_conversation(conversation: Conversation):
             }
             RagConversation.update(**update_data)
             conversation.documents = [d.id for d in documents] if documents else []
-            conversation.paper_ids = new_papers_info
+            conversation.set_papers(new_papers_info)
             conversation.save()
     elif conversation.bot_id or conversation.collections:
         if conversation.bot_id:
@@ -322,21 +326,22 @@ def question_list(conversation, page_num, page_size):
         Q(conversation_id=conversation_id, del_flag=False)
         & (((~Q(answer='')) & Q(answer__isnull=False)) | Q(source='share'))
     )
-    query_set = Question.objects.filter(filter_query).order_by('-updated_at')
+    query_set = Question.objects.filter(filter_query).defer('stream').order_by('-updated_at')
     total = query_set.count()
-    questions = query_set[(page_num - 1) * page_size: page_num * page_size]
-    questions_data = QuestionListSerializer(questions, many=True).data[::-1]
+    questions = list(query_set[(page_num - 1) * page_size: page_num * page_size])
+    references = QuestionReference.references_map([q.id for q in questions])
+    questions_data = QuestionListSerializer(questions, many=True, context={'references': references}).data[::-1]
+    papers = {f"{p['collection_id']}--{p['doc_id']}" for p in (conversation.paper_ids or [])}
     for i,q in enumerate(questions_data):
         if q['references']:
-            questions_data[i]['references'] = _update_chat_references(conversation, q['references'])
+            questions_data[i]['references'] = _update_chat_references(papers, q['references'])
     return {
         'list': questions_data,
         'total': total,
     }
 
 
-def _update_chat_references(conversation, references):
-    papers = {f"{p['collection_id']}--{p['doc_id']}": p for p in conversation.paper_ids}
+def _update_chat_references(papers, references):
     for i,r in enumerate(references):
         if r.get('collection_id') and r.get('doc_id') and (
             f"{r['collection_id']}--{r['doc_id']}" in papers or r['collection_id'] == 'arxiv'
@@ -426,8 +431,9 @@ def conversation_share_create(user_id,
             q['id']: {'has_answer': q['has_answer'], 'has_question': q['has_question']}
             for q in vd['selected_questions']
         }
-        questions = Question.objects.filter(id__in=question_ids).all()
-        questions_data = QuestionListSerializer(questions, many=True).data
+        questions = list(Question.objects.filter(id__in=question_ids).defer('stream').all())
+        references = QuestionReference.references_map([q.id for q in questions])
+        questions_data = QuestionListSerializer(questions, many=True, context={'references': references}).data
         for index,v in enumerate(questions_data):
             selected_question = selected_questions_dict[v['id']]
             questions_data[index].update(selected_question)
@@ -525,9 +531,26 @@ def update_share_chat_references(user_id, references):
 
 
 def chat_query(user_id, validated_data, openapi_key_id=None):
-
-    if not validated_data.get('has_conversation'):
-        conversation_id = conversation_create(user_id, validated_data, openapi_key_id)
+    vd = validated_data
+    preset_answer = None
+    if not vd.get('has_conversation'):
+        papers_info, history_messages = None, None
+        # 新会话点击专题预置问题：有预先生成的答案且文献集合一致时回放
+        if not vd.get('question_id'):
+            preset_answer = bot_preset_answer_match(vd.get('bot_id'), vd.get('content'), vd.get('model'))
+        if preset_answer:
+            papers_info = ConversationCreateSerializer.get_papers_info(
+                user_id, vd.get('bot_id'), vd.get('collections'), vd['all_document_ids']
+            )
+            if not bot_preset_answer_is_fresh(preset_answer, papers_info):
+                preset_answer = None
+            else:
+                history_messages = [
+                    {'role': 'user', 'content': preset_answer.question},
+                    {'role': 'assistant', 'content': preset_answer.answer},
+                ]
+        conversation_id = conversation_create(
+            user_id, validated_data, openapi_key_id, papers_info=papers_info, history_messages=history_messages)
     else:
         conversation_id = validated_data['conversation_id']
 
@@ -573,7 +596,10 @@ def chat_query(user_id, validated_data, openapi_key_id=None):
         question.save()
 
     try:
-        resp = RagConversation.query_new(user_id, conversation_id, content)
+        if preset_answer:
+            lines = bot_preset_answer_replay(preset_answer)
+        else:
+            lines = RagConversation.query_new(user_id, conversation_id, content).iter_lines()
     except requests.exceptions.RequestException as e:
         logger.error(f'Request error: {e}')
         yield json.dumps({'event': 'on_error', 'error_code': 120001, 'error': error_msg, "detail": str(e)}) + "\n"
@@ -604,7 +630,7 @@ def chat_query(user_id, validated_data, openapi_key_id=None):
             )
             question.save()
 
-        for line in resp.iter_lines():
+        for line in lines:
             if line:
                 line = line.decode('utf-8')
                 logger.debug(f'query line: {line}')
@@ -630,6 +656,7 @@ def chat_query(user_id, validated_data, openapi_key_id=None):
         question.output_tokens = stream.get('statistics', {}).get('output_tokens', 0)
         if not question.is_stop: question.answer = ''.join(stream['chunk'])
         question.save()
+        QuestionReference.sync([question])
         model = question.model
         if not model: model = 'basic'
         if openapi_key_id:
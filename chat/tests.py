@@ -1,3 +1,47 @@
-# from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from chat.models import Conversation
+from core.utils.common import papers_fingerprint
+
+
+def _paper(doc_id, collection_id='arxiv', full_text_accessible=True, **extra):
+    return {
+        'collection_id': collection_id, 'collection_type': 'public', 'doc_id': doc_id,
+        'full_text_accessible': full_text_accessible, **extra,
+    }
+
+
+class PapersFingerprintTest(SimpleTestCase):
+
+    def test_order_and_duplicates_are_ignored(self):
+        papers = [_paper(1), _paper(2), _paper(3)]
+        fingerprint = papers_fingerprint(papers)
+        self.assertEqual(papers_fingerprint(list(reversed(papers))), fingerprint)
+        self.assertEqual(papers_fingerprint(papers + [_paper(2), _paper(1)]), fingerprint)
+
+    def test_only_rag_fields_are_used(self):
+        self.assertEqual(
+            papers_fingerprint([_paper(1, title='a')]), papers_fingerprint([_paper(1, title='b')]))
+
+    def test_paper_set_changes_are_detected(self):
+        fingerprint = papers_fingerprint([_paper(1), _paper(2)])
+        self.assertNotEqual(papers_fingerprint([_paper(1)]), fingerprint)
+        self.assertNotEqual(papers_fingerprint([_paper(1), _paper(2, collection_id='s2')]), fingerprint)
+        self.assertNotEqual(papers_fingerprint([_paper(1), _paper(2, full_text_accessible=False)]), fingerprint)
+
+    def test_empty_papers(self):
+        self.assertEqual(papers_fingerprint(None), papers_fingerprint([]))
+
+
+class ConversationPapersChangedTest(SimpleTestCase):
+
+    def test_uses_stored_fingerprint(self):
+        conversation = Conversation()
+        conversation.set_papers([_paper(1), _paper(2)])
+        self.assertFalse(conversation.is_papers_changed([_paper(2), _paper(1), _paper(1)]))
+        self.assertTrue(conversation.is_papers_changed([_paper(1)]))
+
+    def test_falls_back_to_paper_ids_without_fingerprint(self):
+        conversation = Conversation(paper_ids=[_paper(1), _paper(2)], paper_ids_fingerprint=None)
+        self.assertFalse(conversation.is_papers_changed([_paper(2), _paper(1)]))
+        self.assertTrue(conversation.is_papers_changed([_paper(3)]))
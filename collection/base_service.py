@@ -1,11 +1,15 @@
 import logging
-from operator import itemgetter
+import time
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery, Count, Value
+from django.db.models.functions import Coalesce
+from django_redis import get_redis_connection
 
 from bot.rag_service import Conversations as RagConversations
-from chat.models import Conversation
+from chat.models import Conversation, ConversationCollection
 from chat.serializers import chat_paper_ids
-from collection.models import Collection, CollectionDocument
-from core.utils.common import cmp_ignore_order
+from collection.models import Collection, CollectionDocument, CollectionStats
 from document.base_service import search_result_from_cache
 from document.models import Document
 
@@ -54,13 +58,13 @@ def update_conversation_by_collection(user_id, conversation, collection_ids, mod
             })
 
         if (
-            not cmp_ignore_order(conversation.paper_ids, papers_info, sort_fun=itemgetter('collection_id', 'doc_id'))
+            conversation.is_papers_changed(papers_info)
             or conversation.public_collection_ids != public_collection_ids
             or conversation.collections != personal_collection_ids
         ):
             update_data['paper_ids'] = paper_ids
             update_data['public_collection_ids'] = public_collection_ids
-            conversation.paper_ids = papers_info
+            conversation.set_papers(papers_info)
             conversation.public_collection_ids = public_collection_ids
             conversation.collections = personal_collection_ids
             if collection_ids and not conversation.bot_id:
@@ -69,6 +73,7 @@ def update_conversation_by_collection(user_id, conversation, collection_ids, mod
                     if len(collection_ids) == 1 else Conversation.TypeChoices.COLLECTIONS_COV
                 )
             conversation.save()
+            ConversationCollection.sync(conversation)
             if not update_data['agent_id'].startswith('default-scinav'):
                 RagConversations.update(**update_data)
                 is_updated = True
@@ -77,11 +82,12 @@ def update_conversation_by_collection(user_id, conversation, collection_ids, mod
         paper_ids = []
         update_data['paper_ids'] = paper_ids
         update_data['public_collection_ids'] = []
-        conversation.paper_ids = paper_ids
+        conversation.set_papers(paper_ids)
         conversation.public_collection_ids = []
         conversation.collections = []
         conversation.type = None
         conversation.save()
+        ConversationCollection.sync(conversation)
         RagConversations.update(**update_data)
         is_updated = True
 
@@ -99,4 +105,117 @@ def generate_collection_title(content=None, document_titles=None):
     else:
         titles = document_titles
     title = RagConversations.generate_favorite_title(titles)
-    return title[:255]
\ No newline at end of file
+    return title[:255]
+
+
+def collections_update_total_personal(collection_ids):
+    """一条 UPDATE 重新统计多个收藏夹的 total_personal"""
+    if not collection_ids:
+        return 0
+    doc_total = CollectionDocument.objects.filter(
+        collection_id=OuterRef('id'), del_flag=False
+    ).order_by().values('collection_id').annotate(total=Count('id')).values('total')
+    return Collection.objects.filter(id__in=collection_ids).update(
+        total_personal=Coalesce(Subquery(doc_total), Value(0)))
+
+
+def collection_stats_reconcile(batch_size=500):
+    """
+    按 id 游标分批校对收藏夹统计：与精确统计不一致（含缺失记录）或 total_personal 不一致的收藏夹重新写入
+    返回 (校对数, 偏差数)
+    """
+    cursor, checked_num, drift_num = '', 0, 0
+    while True:
+        total_personals = dict(Collection.objects.filter(
+            id__gt=cursor, type=Collection.TypeChoices.PERSONAL, del_flag=False
+        ).order_by('id').values_list('id', 'total_personal')[:batch_size])
+        if not total_personals:
+            break
+        collection_ids = list(total_personals)
+        cursor = collection_ids[-1]
+        checked_num += len(collection_ids)
+        exact_stats = CollectionStats.exact(collection_ids)
+        saved_stats = {
+            s['collection_id']: s
+            for s in CollectionStats.objects.filter(collection_id__in=collection_ids).values(
+                'collection_id', *CollectionStats.STAT_FIELDS)
+        }
+        drift_ids = [
+            c_id for c_id, stats in exact_stats.items()
+            if c_id not in saved_stats
+            or any(saved_stats[c_id][f] != stats[f] for f in CollectionStats.STAT_FIELDS)
+            or total_personals[c_id] != stats['doc_total']
+        ]
+        if drift_ids:
+            logger.warning(f'collection_stats_reconcile drift: {drift_ids}')
+            drift_num += len(drift_ids)
+            CollectionStats.refresh(drift_ids)
+            collections_update_total_personal(drift_ids)
+    return checked_num, drift_num
+
+
+class CollectionResyncScheduler:
+    """
+    收藏夹变更后同步相关问答和专题，合并短时间内的多次变更
+    1. dirty: 有序集合 member 为 collection_id，score 为可执行时间；每次变更推迟到 now + debounce
+    2. first: 首次变更时间，可执行时间最多推迟到 first + max_wait，持续编辑也会被同步
+    3. inflight: 已取出正在同步的收藏夹，score 为租约到期时间；同步完成后 ack 删除，
+       worker 中断导致租约过期的重新放回 dirty
+    """
+    DIRTY_KEY = 'scinav:collection_resync:dirty'
+    FIRST_KEY = 'scinav:collection_resync:first'
+    INFLIGHT_KEY = 'scinav:collection_resync:inflight'
+    LUA_CLAIM = """
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+    for _, c_id in ipairs(expired) do
+        redis.call('ZADD', KEYS[1], 'NX', ARGV[1], c_id)
+        redis.call('ZREM', KEYS[3], c_id)
+    end
+    local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+    for _, c_id in ipairs(due) do
+        redis.call('ZREM', KEYS[1], c_id)
+        redis.call('HDEL', KEYS[2], c_id)
+        redis.call('ZADD', KEYS[3], ARGV[3], c_id)
+    end
+    return due
+    """
+
+    def __init__(self, debounce=None, max_wait=None, lease=None):
+        self.conn = get_redis_connection('default')
+        self.debounce = settings.COLLECTION_RESYNC_DEBOUNCE if debounce is None else debounce
+        self.max_wait = settings.COLLECTION_RESYNC_MAX_WAIT if max_wait is None else max_wait
+        self.lease = settings.COLLECTION_RESYNC_LEASE if lease is None else lease
+
+    def mark(self, *collection_ids):
+        if not (collection_ids := [c_id for c_id in set(collection_ids) if c_id]):
+            return 0
+        now = time.time()
+        pipe = self.conn.pipeline()
+        for c_id in collection_ids:
+            pipe.hsetnx(self.FIRST_KEY, c_id, now)
+        pipe.hmget(self.FIRST_KEY, collection_ids)
+        firsts = pipe.execute()[-1]
+        self.conn.zadd(self.DIRTY_KEY, {
+            c_id: min(now + self.debounce, float(first or now) + self.max_wait)
+            for c_id, first in zip(collection_ids, firsts)
+        })
+        return len(collection_ids)
+
+    def claim_due(self, limit=100):
+        """
+        先把租约过期的收藏夹放回 dirty，再把已到期的收藏夹移到 inflight 并设置租约
+        lua 原子执行，多个 worker 同时执行时每个收藏夹只会被一个 worker 取出
+        """
+        now = time.time()
+        due_ids = self.conn.register_script(self.LUA_CLAIM)(
+            keys=[self.DIRTY_KEY, self.FIRST_KEY, self.INFLIGHT_KEY], args=[now, limit, now + self.lease])
+        return [c_id.decode() if isinstance(c_id, bytes) else c_id for c_id in due_ids]
+
+    def ack(self, *collection_ids):
+        """同步完成后删除租约"""
+        if not (collection_ids := [c_id for c_id in set(collection_ids) if c_id]):
+            return 0
+        return self.conn.zrem(self.INFLIGHT_KEY, *collection_ids)
+
+    def size(self):
+        return self.conn.zcard(self.DIRTY_KEY)
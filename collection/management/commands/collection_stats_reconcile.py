@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from collection.base_service import collection_stats_reconcile
+
+
+class Command(BaseCommand):
+    help = '校对收藏夹统计（total_personal、CollectionStats），修正偏差'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        checked_num, drift_num = collection_stats_reconcile(batch_size=options['batch_size'])
+        self.stdout.write(f'checked: {checked_num}, drift: {drift_num}')
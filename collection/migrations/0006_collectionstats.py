@@ -0,0 +1,32 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection', '0005_collectiondocument_doc_collection_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionStats',
+            fields=[
+                ('collection', models.OneToOneField(
+                    db_column='collection_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                    primary_key=True, related_name='stats', serialize=False, to='collection.collection')),
+                ('doc_total', models.IntegerField(db_default=0, default=0)),
+                ('in_library_total', models.IntegerField(db_default=0, default=0)),
+                ('ref_bot_total', models.IntegerField(db_default=0, default=0)),
+                ('del_flag', models.BooleanField(db_default=False, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'collection_stats',
+                'db_table': 'collection_stats',
+            },
+        ),
+    ]
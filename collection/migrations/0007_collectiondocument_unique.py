@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:47
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection', '0006_collectionstats'),
+        ('document', '0016_ragoutbox'),
+    ]
+
+    operations = [
+        # 去除重复的 (collection_id, document_id)，优先保留未删除、最早创建的记录
+        migrations.RunSQL(
+            sql="""
+            DELETE FROM collection_document cd
+            USING (
+                SELECT id, row_number() OVER (
+                    PARTITION BY collection_id, document_id ORDER BY del_flag, created_at NULLS LAST, id
+                ) AS rn
+                FROM collection_document
+                WHERE collection_id IS NOT NULL
+            ) d
+            WHERE cd.id = d.id AND d.rn > 1
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='collectiondocument',
+            unique_together={('collection', 'document')},
+        ),
+    ]
@@ -1,9 +1,14 @@
 import logging
 import uuid
 
-from django.db import models
+from django.db import models, connection
+from django.db.models import Count, Exists, F, OuterRef, Q
 from django.utils.translation import gettext_lazy as _
 
+from bot.models import BotCollection
+from core.utils.model import raw_by_composite_keys
+from document.models import Document, DocumentLibrary, DocumentLibraryCache
+
 logger = logging.getLogger(__name__)
 
 
@@ -47,19 +52,147 @@ class CollectionDocument(models.Model):
 
     @staticmethod
     def raw_by_docs(collection_document_ids, fileds='*', where=None):
-        if fileds != '*' and isinstance(fileds, list):
-            fileds = ','.join(fileds)
-        doc_ids_str = ','.join([f"('{d['collection_id']}', '{d['document_id']}')" for d in collection_document_ids])
-        sql = f"SELECT {fileds} FROM collection_document WHERE (collection_id, document_id) IN ({doc_ids_str})"
-        if where:
-            sql += f"and {where}"
-        return CollectionDocument.objects.raw(sql)
+        if not collection_document_ids:
+            return []
+        return raw_by_composite_keys(
+            CollectionDocument, [('collection_id', 'text'), ('document_id', 'text')],
+            [(d['collection_id'], d['document_id']) for d in collection_document_ids], fields=fileds, where=where)
 
     @staticmethod
     def raw_sql(sql):
         return CollectionDocument.objects.raw(sql)
 
+    @staticmethod
+    def insert_ignore_conflicts(collection_id, documents):
+        """
+        批量写入，(collection_id, document_id) 已存在的跳过
+        :param documents: {document_id: full_text_accessible}
+        :return: 本次实际写入的 document_id 列表
+        """
+        if not documents:
+            return []
+        sql = (
+            'INSERT INTO "collection_document" '
+            '(id, collection_id, document_id, full_text_accessible, del_flag, updated_at, created_at) '
+            'SELECT gen_random_uuid()::text, %s, k.document_id, k.full_text_accessible, false, now(), now() '
+            'FROM unnest(%s::text[], %s::boolean[]) AS k(document_id, full_text_accessible) '
+            'ON CONFLICT (collection_id, document_id) DO NOTHING RETURNING document_id'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [collection_id, list(documents.keys()), list(documents.values())])
+            return [row[0] for row in cursor.fetchall()]
+
     class Meta:
         db_table = 'collection_document'
         verbose_name = 'collection_document'
         index_together = ['doc_collection_id', 'doc_id']
+        unique_together = ['collection', 'document']
+
+
+class CollectionStats(models.Model):
+    """
+    收藏夹统计（物化）
+    doc_total: 收藏夹文献数
+    in_library_total: 已在收藏夹所有者个人库中的文献数（含本人上传文献）
+    ref_bot_total: 引用该收藏夹的专题数
+    写入时增量维护，async_collection_stats_reconcile 定时校对
+    """
+    collection = models.OneToOneField(
+        Collection, db_constraint=False, on_delete=models.DO_NOTHING, primary_key=True,
+        db_column='collection_id', related_name='stats')
+    doc_total = models.IntegerField(default=0, db_default=0)
+    in_library_total = models.IntegerField(default=0, db_default=0)
+    ref_bot_total = models.IntegerField(default=0, db_default=0)
+    del_flag = models.BooleanField(default=False, db_default=False)
+    updated_at = models.DateTimeField(null=True, auto_now=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    IN_LIBRARY_STATUS = [
+        DocumentLibrary.TaskStatusChoices.COMPLETED,
+        DocumentLibrary.TaskStatusChoices.IN_PROGRESS,
+        DocumentLibrary.TaskStatusChoices.PENDING,
+        DocumentLibrary.TaskStatusChoices.QUEUEING,
+    ]
+    STAT_FIELDS = ['doc_total', 'in_library_total', 'ref_bot_total']
+
+    @property
+    def is_all_in_document_library(self):
+        return self.in_library_total >= self.doc_total
+
+    @staticmethod
+    def in_library_document_ids(user_id, document_ids):
+        """document_ids 中已在用户个人库的文献（个人库记录未删除且未失败，或本人上传的文献）"""
+        if not document_ids:
+            return set()
+        lib_doc_ids = DocumentLibraryCache(user_id).intersection(document_ids, DocumentLibraryCache.SELF)
+        own_doc_ids = Document.objects.filter(
+            id__in=document_ids, collection_id=user_id).values_list('id', flat=True)
+        return set(lib_doc_ids) | set(own_doc_ids)
+
+    @staticmethod
+    def exact(collection_ids):
+        """按收藏夹分组精确统计，返回 {collection_id: {doc_total, in_library_total, ref_bot_total}}"""
+        stats = {c_id: {'doc_total': 0, 'in_library_total': 0, 'ref_bot_total': 0} for c_id in collection_ids}
+        if not collection_ids:
+            return stats
+        in_lib = DocumentLibrary.objects.filter(
+            user_id=OuterRef('collection__user_id'), document_id=OuterRef('document_id'), del_flag=False,
+            task_status__in=CollectionStats.IN_LIBRARY_STATUS,
+        )
+        own_doc = Document.objects.filter(id=OuterRef('document_id'), collection_id=OuterRef('collection__user_id'))
+        doc_counts = CollectionDocument.objects.filter(
+            collection_id__in=collection_ids, del_flag=False
+        ).order_by().values('collection_id').annotate(
+            doc_total=Count('id'),
+            in_library_total=Count('id', filter=Q(Exists(in_lib)) | Q(Exists(own_doc))),
+        )
+        for c in doc_counts:
+            stats[c['collection_id']]['doc_total'] = c['doc_total']
+            stats[c['collection_id']]['in_library_total'] = c['in_library_total']
+        bot_counts = BotCollection.objects.filter(
+            collection_id__in=collection_ids, del_flag=False
+        ).order_by().values('collection_id').annotate(ref_bot_total=Count('bot_id', distinct=True))
+        for c in bot_counts:
+            stats[c['collection_id']]['ref_bot_total'] = c['ref_bot_total']
+        return stats
+
+    @staticmethod
+    def refresh(collection_ids):
+        """精确重算并写入（不存在则创建）"""
+        collection_ids = list(set(c_id for c_id in collection_ids if c_id))
+        if not collection_ids:
+            return []
+        stats = CollectionStats.exact(collection_ids)
+        CollectionStats.objects.bulk_create(
+            [CollectionStats(collection_id=c_id, **s) for c_id, s in stats.items()],
+            update_conflicts=True, unique_fields=['collection'],
+            update_fields=CollectionStats.STAT_FIELDS + ['updated_at'],
+        )
+        return collection_ids
+
+    @staticmethod
+    def refresh_by_documents(user_id, document_ids):
+        """用户个人库变化后，重算该用户包含这些文献的收藏夹"""
+        if not document_ids:
+            return []
+        collection_ids = CollectionDocument.objects.filter(
+            collection__user_id=user_id, collection__del_flag=False, document_id__in=document_ids, del_flag=False,
+        ).values_list('collection_id', flat=True).distinct()
+        return CollectionStats.refresh(list(collection_ids))
+
+    @staticmethod
+    def incr(collection_id, doc_total=0, in_library_total=0, ref_bot_total=0):
+        """增量更新，记录不存在时精确重算"""
+        if not (doc_total or in_library_total or ref_bot_total):
+            return
+        updated = CollectionStats.objects.filter(collection_id=collection_id).update(
+            doc_total=F('doc_total') + doc_total,
+            in_library_total=F('in_library_total') + in_library_total,
+            ref_bot_total=F('ref_bot_total') + ref_bot_total,
+        )
+        if not updated:
+            CollectionStats.refresh([collection_id])
+
+    class Meta:
+        db_table = 'collection_stats'
+        verbose_name = 'collection_stats'
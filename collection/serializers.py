@@ -1,13 +1,13 @@
 import logging
 
-from django.db.models import F
+from django.db.models import Exists, OuterRef
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from bot.models import BotCollection, Bot
 from collection.models import Collection, CollectionDocument
-from document.models import Document, DocumentLibrary
+from document.models import Document, DocumentLibrary, DocumentLibraryCache
 from document.serializers import SearchDocuments4AddQuerySerializer
 
 logger = logging.getLogger(__name__)
@@ -223,6 +223,8 @@ class CollectionDocumentListQuerySerializer(serializers.Serializer):
     bot_id = serializers.CharField(required=False, max_length=36)
     page_size = serializers.IntegerField(required=False, default=10)
     page_num = serializers.IntegerField(required=False, default=1)
+    # 上一页返回的 next_cursor，传入时按 keyset 翻页，忽略 page_num
+    cursor = serializers.CharField(required=False, allow_blank=True, allow_null=True, default=None)
 
 
 class CollectionDocumentSelectedQuerySerializer(serializers.Serializer):
@@ -258,115 +260,103 @@ class CollectionDocumentSelectedQuerySerializer(serializers.Serializer):
 class CollectionDocumentListSerializer(serializers.Serializer):
     @staticmethod
     def get_collection_documents(user_id, collection_ids, list_type, bot=None):
+        """
+        收藏夹文献集合，每种 list_type 只生成一条 SQL：个人库、订阅专题个人库、非本人收藏夹个人文献等集合
+        作为子查询拼接在同一条语句中，不再取出 id 列表在 python 中做集合运算
+        :return: (query_set 按 document_id 排序去重, doc_lib_document_ids, sub_bot_document_ids, ref_documents)
+            doc_lib_document_ids, sub_bot_document_ids 仅 personal&subscribe_full_text 返回 id 列表
+        """
         p_documents, ref_documents = [], []
         if bot and user_id != bot.user_id:
             p_documents, ref_documents = bot_subscribe_personal_document_num(bot.user_id, bot=bot)
         elif collection_ids:
             p_documents = collection_sub_personal_documents(user_id, collection_ids)
-            if p_documents:
-                ref_documents = get_ref_document_ids(p_documents)
+            ref_documents = get_ref_document_ids(p_documents)
+        exclude_p_documents = ~Q(document_id__in=p_documents)
+        my_doc_libs = CollectionDocumentListSerializer._my_doc_lib_documents(user_id)
         doc_lib_document_ids, sub_bot_document_ids = None, None
         if list_type in ['all', 'all_documents']:
-            filter_query = Q(collection_id__in=collection_ids, del_flag=False)
             # 非本人专题，过滤个人没有关联文献的文件
-            if p_documents:
-                filter_query &= ~Q(document_id__in=p_documents)
-            query_set = CollectionDocument.objects.filter(filter_query).values('document_id') \
-                .order_by('document_id').distinct()
+            filter_query = Q(collection_id__in=collection_ids, del_flag=False) & exclude_p_documents
         elif list_type == 'publish':
-            query_set = CollectionDocument.objects.filter(
-                collection_id__in=collection_ids, del_flag=False, document__collection_type=Document.TypeChoices.PUBLIC
-            ).values('document_id').order_by('document_id').distinct()
-        elif list_type == 'arxiv':
-            document_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(user_id)
-            sub_bot_document_ids = []
+            filter_query = Q(
+                collection_id__in=collection_ids, del_flag=False, document__collection_type=Document.TypeChoices.PUBLIC)
+        elif list_type in ['arxiv', 's2']:
+            exclude_query = Q(document_id__in=my_doc_libs)
             if bot and (bot.type == Bot.TypeChoices.PUBLIC or bot.advance_share):
-                sub_bot_document_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(
-                    bot.user_id, is_self=False
-                )
-            document_ids = list(set(document_ids) | set(sub_bot_document_ids))
+                exclude_query |= Q(document_id__in=CollectionDocumentListSerializer._my_doc_lib_documents(
+                    bot.user_id, is_self=False))
             if bot and user_id != bot.user_id and p_documents:
-                document_ids = list(set(document_ids) | set(p_documents))
-            filter_query = ~Q(document_id__in=document_ids) \
-                           & Q(collection_id__in=collection_ids, del_flag=False, document__collection_id='arxiv')
-            query_set = CollectionDocument.objects.filter(
-                filter_query).values('document_id').order_by('document_id').distinct()
-        elif list_type == 's2':
-            document_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(user_id)
-            sub_bot_document_ids = []
-            if bot and (bot.type == Bot.TypeChoices.PUBLIC or bot.advance_share):
-                sub_bot_document_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(
-                    bot.user_id, is_self=False
-                )
-            document_ids = list(set(document_ids) | set(sub_bot_document_ids))
-            if bot and user_id != bot.user_id and p_documents:
-                document_ids = list(set(document_ids) | set(p_documents))
-            filter_query = ~Q(document_id__in=document_ids) \
-                           & Q(collection_id__in=collection_ids, del_flag=False, document__collection_id='s2')
-            query_set = CollectionDocument.objects.filter(
-                filter_query).values('document_id').order_by('document_id').distinct()
+                exclude_query |= Q(document_id__in=p_documents)
+            filter_query = ~exclude_query & Q(
+                collection_id__in=collection_ids, del_flag=False, document__collection_id=list_type)
         elif list_type == 'subscribe_full_text':
-            document_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(user_id)
             if bot.user_id == user_id or (
                 bot.user_id != user_id and bot and bot.type == Bot.TypeChoices.PERSONAL and not bot.advance_share
             ):
-                bot_document_ids = document_ids
+                bot_doc_query = Q(document_id__in=my_doc_libs)
             else:
-                bot_document_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(bot.user_id, is_self=False)
-                if p_documents:
-                    bot_document_ids = list(set(bot_document_ids) - set(p_documents))
+                bot_doc_query = Q(document_id__in=CollectionDocumentListSerializer._my_doc_lib_documents(
+                    bot.user_id, is_self=False)) & exclude_p_documents
             filter_query = (
-                (~Q(document_id__in=document_ids) & Q(document_id__in=bot_document_ids))
+                (~Q(document_id__in=my_doc_libs) & bot_doc_query)
                 & Q(collection_id__in=collection_ids, del_flag=False)
             )
-            query_set = CollectionDocument.objects.filter(
-                filter_query).values('document_id').order_by('document_id').distinct()
         elif list_type == 'personal&subscribe_full_text':
             doc_lib_document_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(user_id)
             if not bot or bot.user_id == user_id or (
                 bot.user_id != user_id and bot and bot.type == Bot.TypeChoices.PERSONAL and not bot.advance_share):
                 sub_bot_document_ids = doc_lib_document_ids
+                filter_query = Q(document_id__in=my_doc_libs, del_flag=False)
             else:
+                sub_bot_doc_libs = CollectionDocumentListSerializer._my_doc_lib_documents(bot.user_id, False)
                 sub_bot_document_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(bot.user_id, False)
                 if p_documents:
+                    sub_bot_doc_libs = sub_bot_doc_libs.exclude(document_id__in=p_documents)
                     sub_bot_document_ids = list(set(sub_bot_document_ids) - set(p_documents))
-            all_document_ids = doc_lib_document_ids + sub_bot_document_ids
-            filter_query = Q(document_id__in=all_document_ids, del_flag=False)
+                filter_query = (
+                    (Q(document_id__in=my_doc_libs) | Q(document_id__in=sub_bot_doc_libs)) & Q(del_flag=False))
             if collection_ids:
                 filter_query &= Q(collection_id__in=collection_ids)
-            query_set = CollectionDocument.objects.filter(
-                filter_query).values('document_id').order_by('document_id').distinct()
-
         else:  # document_library personal
             # todo 订阅个人文件库处理
-            document_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(user_id)
-            filter_query = Q(document_id__in=document_ids, collection_id__in=collection_ids, del_flag=False)
-            if p_documents:
-                filter_query &= ~Q(document_id__in=p_documents)
+            filter_query = (
+                Q(document_id__in=my_doc_libs, collection_id__in=collection_ids, del_flag=False) & exclude_p_documents)
             # if bot and bot.type == Bot.TypeChoices.PERSONAL:
             #     filter_query &= Q(document_id__in=p_documents)
-            query_set = CollectionDocument.objects.filter(
-                filter_query).values('document_id').order_by('document_id').distinct()
+        query_set = CollectionDocument.objects.filter(filter_query).values('document_id') \
+            .order_by('document_id').distinct()
         return query_set, doc_lib_document_ids, sub_bot_document_ids, ref_documents
 
     @staticmethod
-    def _my_doc_lib_document_ids(user_id, is_self=True):
+    def _my_doc_lib_documents(user_id, is_self=True):
         """
-        个人文件库  本人：排队中 入库中 入库完成
+        个人文件库文献 document_id 查询（可作为子查询）
+            本人：排队中 入库中 入库完成
             非本人： 入库完成
         """
         if not is_self:
-            doc_libs = DocumentLibrary.objects.filter(
-                user_id=user_id, del_flag=False, task_status=DocumentLibrary.TaskStatusChoices.COMPLETED
-            ).values('document_id').all()
+            task_status = [DocumentLibrary.TaskStatusChoices.COMPLETED]
         else:
-            doc_libs = DocumentLibrary.objects.filter(user_id=user_id, del_flag=False, task_status__in=[
+            task_status = [
                 DocumentLibrary.TaskStatusChoices.COMPLETED,
                 DocumentLibrary.TaskStatusChoices.PENDING,
                 DocumentLibrary.TaskStatusChoices.IN_PROGRESS,
                 DocumentLibrary.TaskStatusChoices.QUEUEING,
-            ]).values('document_id').all()
-        return [d['document_id'] for d in doc_libs if d['document_id']]
+            ]
+        # document_id 为空的记录会让 NOT IN 子查询结果为空，需排除
+        return DocumentLibrary.objects.filter(
+            user_id=user_id, del_flag=False, task_status__in=task_status, document_id__isnull=False
+        ).values_list('document_id', flat=True)
+
+    @staticmethod
+    def _my_doc_lib_document_ids(user_id, is_self=True):
+        """
+        个人文件库  本人：排队中 入库中 入库完成
+            非本人： 入库完成
+        """
+        kind = DocumentLibraryCache.SELF if is_self else DocumentLibraryCache.COMPLETED
+        return DocumentLibraryCache(user_id).members(kind)
 
 
 class CollectionCheckQuerySerializer(serializers.Serializer):
@@ -403,15 +393,13 @@ def bot_subscribe_personal_document_num(bot_user_id, bot_collections=None, bot=N
     coll_documents = CollectionDocument.objects.filter(
         collection_id__in=collection_ids, del_flag=False).values('document_id').all()
 
-    personal_doc_libs = DocumentLibrary.objects.filter(
-        user_id=bot_user_id, del_flag=False, task_status=DocumentLibrary.TaskStatusChoices.COMPLETED,
-        filename__isnull=False, document__id__in=[d['document_id'] for d in coll_documents]
-    ).values('document_id').distinct('document_id')
+    personal_doc_libs = DocumentLibraryCache(bot_user_id).intersection(
+        [d['document_id'] for d in coll_documents], DocumentLibraryCache.PERSONAL)
 
     # 个人上传文献关联的公共文献列表
     ref_document_ids = []
     personal_documents = Document.objects.filter(
-        id__in=[pd['document_id'] for pd in personal_doc_libs]
+        id__in=personal_doc_libs
     ).values('id', 'ref_collection_id', 'ref_doc_id').all()
 
     ref_docs = [{'id': None, 'collection_id': d['ref_collection_id'], 'doc_id': d['ref_doc_id']}
@@ -420,37 +408,24 @@ def bot_subscribe_personal_document_num(bot_user_id, bot_collections=None, bot=N
         ref_documents = Document.raw_by_docs(ref_docs, fileds='id')
         ref_document_ids = [d.id for d in ref_documents]
     # 个人文献列表
-    document_set = (
-        set([cd['document_id'] for cd in coll_documents])
-        & set([pd['document_id'] for pd in personal_doc_libs])
-    )
-    return list(document_set), ref_document_ids
+    return personal_doc_libs, ref_document_ids
 
 
-def collection_sub_personal_documents(user_id, collection_ids) -> list:
+def collection_sub_personal_documents(user_id, collection_ids):
     """
-    非本人收藏夹列表中包括的个人文献id列表
+    非本人收藏夹列表中包括的个人文献id
     :param user_id:
     :param collection_ids:
-    :return:
+    :return: document_id 查询（可作为子查询）
     """
-    collection_ids = '\'' + '\', \''.join(collection_ids) + '\''
-    sql = ("select d.id from collection_document cd "
-           "left join document d on d.id = cd.document_id "
-           "left join collection c on cd.collection_id=c.id "
-           f"where cd.collection_id in ({collection_ids}) and cd.del_flag=false "
-           f"and c.user_id != '{user_id}' and c.del_flag=false "
-           f"and d.collection_type='personal'")
-    result = Document.raw_sql(sql)
-    document_ids = [d.id for d in result]
-    return document_ids
+    return CollectionDocument.objects.filter(
+        collection_id__in=collection_ids, del_flag=False, collection__del_flag=False,
+        collection__user_id__isnull=False, document__collection_type=Document.TypeChoices.PERSONAL,
+    ).exclude(collection__user_id=user_id).values_list('document_id', flat=True)
 
 
 def get_ref_document_ids(document_ids) -> list:
-    document_ids = '\'' + '\', \''.join(document_ids) + '\''
-    sql = ("select dr.id from document d "
-           "left join document dr on d.ref_collection_id=dr.collection_id and d.ref_doc_id=dr.doc_id "
-           f"where d.id in ({document_ids})")
-    result = Document.raw_sql(sql)
-    ref_document_ids = [d.id for d in result]
-    return ref_document_ids
+    """个人文献关联的公共文献id列表，document_ids 可以是列表或子查询"""
+    personal_documents = Document.objects.filter(
+        id__in=document_ids, ref_collection_id=OuterRef('collection_id'), ref_doc_id=OuterRef('doc_id'))
+    return list(Document.objects.filter(Exists(personal_documents)).values_list('id', flat=True))
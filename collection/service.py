@@ -1,22 +1,23 @@
-import copy
 import datetime
 import logging
 
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, F, Case, When, Value, BooleanField
 from django.utils.translation import gettext_lazy as _
 
+from bot.base_service import bot_documents_refresh, bot_documents_refresh_by_collections
 from bot.models import BotCollection, BotSubscribe, Bot
 from bot.rag_service import Collection as RagCollection
-from collection.base_service import generate_collection_title
-from collection.models import Collection, CollectionDocument
+from collection.base_service import generate_collection_title, CollectionResyncScheduler
+from collection.models import Collection, CollectionDocument, CollectionStats
 from collection.serializers import CollectionPublicSerializer, CollectionListSerializer, \
     CollectionRagPublicListSerializer, \
-    CollectionSubscribeSerializer, CollectionDocumentListSerializer, bot_subscribe_personal_document_num
-from document.models import Document, DocumentLibrary
+    CollectionSubscribeSerializer, CollectionDocumentListSerializer
+from core.utils.pagination import keyset_page, keyset_cursor, encode_cursor
+from document.models import Document, DocumentLibrary, DocumentLibraryCache
 from document.serializers import DocumentApaListSerializer, CollectionDocumentListCollectionSerializer
 from document.service import search, author_documents
-from document.tasks import async_update_conversation_by_collection, async_ref_document_to_document_library, \
-    async_complete_abstract
+from document.tasks import async_ref_document_to_document_library, async_complete_abstract
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +26,7 @@ def collection_list(user_id, list_type, page_size, page_num, keyword=None):
     coll_list = []
     start_num = page_size * (page_num - 1)
     # 1 public collections
-    public_total, subscribe_total, sub_add_list, my_total = 0, 0, [], 0
+    public_total, subscribe_total, sub_add_list, my_total, my_stats = 0, 0, [], 0, {}
     if 'public' in list_type:
         public_collections = RagCollection.list()
         public_collections = [pc | {'updated_at': pc['update_time']} for pc in public_collections]
@@ -59,9 +60,14 @@ def collection_list(user_id, list_type, page_size, page_num, keyword=None):
         if len(coll_list) < page_size:
             my_start_num = 0 if coll_list else max(start_num - subscribe_total - public_total, 0)
             my_end_num = my_start_num + page_size - len(coll_list)
-            query_set = collections[my_start_num:my_end_num]
+            query_set = collections.select_related('stats')[my_start_num:my_end_num]
+            my_stats = _collections_stats(query_set)
             coll_list += list(CollectionListSerializer(query_set, many=True).data)
     if set(list_type) == {'public', 'subscribe', 'my'}:
+        ref_bot_titles = _collections_ref_bots(user_id, [
+            coll['id'] for coll in coll_list
+            if coll['id'] and (coll['id'] not in my_stats or my_stats[coll['id']].ref_bot_total)
+        ])
         for coll in coll_list:
             sub_bot_info = sub_bot_infos.get(coll['bot_id'], {}) if coll.get('bot_id') else {}
             if coll['type'] == Collection.TypeChoices.PUBLIC:
@@ -72,9 +78,12 @@ def collection_list(user_id, list_type, page_size, page_num, keyword=None):
                 # todo 未发布专题 分享出去 没有全文
                 if bot and bot.type == Bot.TypeChoices.PERSONAL and not bot.advance_share:
                     coll['is_all_in_document_library'] = sub_bot_info.get('is_all_in_document_library', False)
+            elif coll['id'] in my_stats:
+                coll['is_all_in_document_library'] = my_stats[coll['id']].is_all_in_document_library
             else:
                 coll['is_all_in_document_library'] = _is_collection_docs_all_in_document_library(coll['id'], user_id)
-            coll['has_ref_bots'], coll['bot_titles'] = _collection_ref_bots(user_id, [coll['id']])
+            bot_titles = ref_bot_titles.get(coll['id'])
+            coll['has_ref_bots'], coll['bot_titles'] = bool(bot_titles), bot_titles or None
             coll['is_in_published_bot'] = coll['has_ref_bots']
     return {
         'list': coll_list,
@@ -83,6 +92,36 @@ def collection_list(user_id, list_type, page_size, page_num, keyword=None):
     }
 
 
+def _collections_stats(collections):
+    """读取收藏夹统计，缺失的记录精确补算"""
+    stats, missing_ids = {}, []
+    for c in collections:
+        if hasattr(c, 'stats'):
+            stats[c.id] = c.stats
+        else:
+            missing_ids.append(c.id)
+    if missing_ids:
+        CollectionStats.refresh(missing_ids)
+        stats |= {s.collection_id: s for s in CollectionStats.objects.filter(collection_id__in=missing_ids).all()}
+    return stats
+
+
+def _collections_ref_bots(user_id, collection_ids):
+    """按收藏夹分组的引用专题名称 {collection_id: [bot_title]}，过滤条件同 _collection_ref_bots"""
+    if not collection_ids:
+        return {}
+    filter_query = (
+        Q(collection_id__in=collection_ids, del_flag=False, bot__type=Bot.TypeChoices.PUBLIC)
+        | Q(collection_id__in=collection_ids, del_flag=False, collection__user_id=user_id)
+    )
+    bot_colls = BotCollection.objects.filter(filter_query).values(
+        'collection_id', 'bot__title').order_by('collection_id', 'bot__title').distinct()
+    ref_bot_titles = {}
+    for bc in bot_colls:
+        ref_bot_titles.setdefault(bc['collection_id'], []).append(bc['bot__title'])
+    return ref_bot_titles
+
+
 def _collection_ref_bots(user_id, collection_ids):
     filter_query = (
         Q(collection_id__in=collection_ids, del_flag=False, bot__type=Bot.TypeChoices.PUBLIC)
@@ -141,7 +180,7 @@ def _bot_subscribe_collection_list(user_id, keyword=None):
     bot_ids = [b.id for b in bots]
     bots_dict = {b.id: b for b in bots}
     bot_collections = BotCollection.objects.filter(
-        bot_id__in=bot_ids, del_flag=False).order_by('bot_id', '-updated_at').all()
+        bot_id__in=bot_ids, del_flag=False).select_related('collection').order_by('bot_id', '-updated_at').all()
     bot_sub_collect = {}
     for bc in bot_collections:
         bot = bots_dict[bc.bot_id]
@@ -162,93 +201,167 @@ def _bot_subscribe_collection_list(user_id, keyword=None):
             bot_sub_collect[bc.bot_id]['updated_at'], bc.collection.updated_at)
         bot_sub_collect[bc.bot_id]['collection_ids'].append(bc.collection_id)
     sub_bot_infos = {}
-    for bot_id, coll in bot_sub_collect.items():
+    other_bot_ids = [bot_id for bot_id, coll in bot_sub_collect.items() if user_id != coll['bot_user_id']]
+    bots_documents = _bot_subscribe_documents({b_id: bots_dict[b_id] for b_id in other_bot_ids}, bot_collections)
+    for bot_id in other_bot_ids:
         bot = bots_dict[bot_id]
-        if user_id != coll['bot_user_id']:
-            personal_documents, ref_documents = bot_subscribe_personal_document_num(coll['bot_user_id'], bot=bot)
-            bot_sub_collect[bot_id]['total'] -= len(personal_documents)
-            # if bot.type == Bot.TypeChoices.PUBLIC:
-            bot_sub_collect[bot_id]['total'] += len(ref_documents)
-            ref_d_repeat_num = CollectionDocument.objects.filter(
-                collection_id__in=bot_sub_collect[bot_id]['collection_ids'],
-                document_id__in=ref_documents, del_flag=False
-            ).count()
-            bot_sub_collect[bot_id]['total'] -= ref_d_repeat_num
-            if bot.type == Bot.TypeChoices.PERSONAL and not bot.advance_share:
-                # 关联
-                # 标签的个人文献应该在文献列表中显示，但是它会作为全量文献库文献存在。 排除其他影响文献数量颜色的因素，外面文献列表显示绿色
-                # 关联 & 获取全文
-                # 标签的个人文献应该在文献列表中显示，作为个人库存在。 需要用户添加个人库，如果未添加个人库则显示黄色，已经添加个人库显示绿色
-                new_bot = copy.deepcopy(bot)
-                new_bot.type = Bot.TypeChoices.PUBLIC
-                my_doc_lib_doc_ids = CollectionDocumentListSerializer._my_doc_lib_document_ids(user_id)
-                query_set2, d1, d2, d3 = CollectionDocumentListSerializer.get_collection_documents(
-                    bot.user_id, bot_sub_collect[bot_id]['collection_ids'], 'personal', new_bot)
-                sub_full_ref_docs = []
-                if ref_documents:
-                    sub_full_ref_docs = Document.objects.filter(
-                        id__in=ref_documents, full_text_accessible=True).values_list('id', flat=True).all()
-                public_documents = set(
-                    [d['document_id'] for d in query_set2.all()] + list(sub_full_ref_docs)
-                ) - set(personal_documents)
-
-                diff_set = (
-                    public_documents - set(my_doc_lib_doc_ids)
-                )
-                sub_bot_infos[bot_id] = {'is_all_in_document_library': False if diff_set else True}
-            # elif ref_documents and Document.objects.filter(id__in=ref_documents, full_text_accessible=False).exists():
-            #     sub_bot_infos[bot_id] = {'is_all_in_document_library': False}
-            else:
-                sub_bot_infos[bot_id] = {'is_all_in_document_library': True}
+        bot_docs = bots_documents[bot_id]
+        bot_sub_collect[bot_id]['total'] -= len(bot_docs['personal_documents'])
+        # if bot.type == Bot.TypeChoices.PUBLIC:
+        bot_sub_collect[bot_id]['total'] += len(bot_docs['ref_documents'])
+        bot_sub_collect[bot_id]['total'] -= bot_docs['ref_repeat_num']
+        if bot.type == Bot.TypeChoices.PERSONAL and not bot.advance_share:
+            # 关联
+            # 标签的个人文献应该在文献列表中显示，但是它会作为全量文献库文献存在。 排除其他影响文献数量颜色的因素，外面文献列表显示绿色
+            # 关联 & 获取全文
+            # 标签的个人文献应该在文献列表中显示，作为个人库存在。 需要用户添加个人库，如果未添加个人库则显示黄色，已经添加个人库显示绿色
+            public_documents = (
+                bot_docs['owner_library_documents'] | bot_docs['full_text_ref_documents']
+            ) - bot_docs['personal_documents']
+            # 个人库作为子查询，只查专题文献中在个人库的部分
+            diff_set = public_documents - set(CollectionDocumentListSerializer._my_doc_lib_documents(
+                user_id).filter(document_id__in=public_documents)) if public_documents else set()
+            sub_bot_infos[bot_id] = {'is_all_in_document_library': False if diff_set else True}
+        # elif ref_documents and Document.objects.filter(id__in=ref_documents, full_text_accessible=False).exists():
+        #     sub_bot_infos[bot_id] = {'is_all_in_document_library': False}
+        else:
+            sub_bot_infos[bot_id] = {'is_all_in_document_library': True}
     # 排序 updated_at 倒序
     list_data = sorted(bot_sub_collect.values(), key=lambda x: x['updated_at'], reverse=True)
     return list_data, bots_dict, sub_bot_infos
 
 
+def _bot_subscribe_documents(bots, bot_collections):
+    """
+    批量计算订阅专题的文献集合，查询数与专题数量无关
+    personal_documents: 专题作者的个人文献 (同 bot_subscribe_personal_document_num)
+    ref_documents: 个人文献关联的公共文献
+    ref_repeat_num: 关联的公共文献已在专题收藏夹中的记录数
+    owner_library_documents: 专题作者个人库中的收藏夹文献，排除非作者收藏夹中的个人文献
+        (同 get_collection_documents(bot.user_id, collection_ids, 'personal'))
+    full_text_ref_documents: 有全文的关联公共文献
+    """
+    bot_colls = {bot_id: [] for bot_id in bots}
+    for bc in bot_collections:
+        if bc.bot_id in bot_colls:
+            bot_colls[bc.bot_id].append(bc.collection)
+    collection_ids = {c.id for colls in bot_colls.values() for c in colls}
+    coll_docs = {}
+    for cd in CollectionDocument.objects.filter(
+        collection_id__in=collection_ids, del_flag=False
+    ).values('collection_id', 'document_id'):
+        coll_docs.setdefault(cd['collection_id'], []).append(cd['document_id'])
+    all_doc_ids = {d_id for d_ids in coll_docs.values() for d_id in d_ids}
+    # 专题作者个人库
+    owner_personal_libs, owner_libs = {}, {}
+    for dl in DocumentLibrary.objects.filter(
+        user_id__in={b.user_id for b in bots.values()}, document_id__in=all_doc_ids, del_flag=False,
+        task_status__in=[
+            DocumentLibrary.TaskStatusChoices.COMPLETED,
+            DocumentLibrary.TaskStatusChoices.PENDING,
+            DocumentLibrary.TaskStatusChoices.IN_PROGRESS,
+            DocumentLibrary.TaskStatusChoices.QUEUEING,
+        ]
+    ).values('user_id', 'document_id', 'task_status', 'filename'):
+        owner_libs.setdefault(dl['user_id'], set()).add(dl['document_id'])
+        if dl['task_status'] == DocumentLibrary.TaskStatusChoices.COMPLETED and dl['filename'] is not None:
+            owner_personal_libs.setdefault(dl['user_id'], set()).add(dl['document_id'])
+    documents = {
+        d['id']: d for d in Document.objects.filter(id__in=all_doc_ids).values(
+            'id', 'collection_type', 'ref_collection_id', 'ref_doc_id')
+    }
+    ref_keys = {
+        (documents[d_id]['ref_collection_id'], documents[d_id]['ref_doc_id'])
+        for d_ids in owner_personal_libs.values() for d_id in d_ids
+        if d_id in documents and documents[d_id]['ref_doc_id'] and documents[d_id]['ref_collection_id']
+    }
+    ref_docs = {}
+    if ref_keys:
+        for rd in Document.raw_by_docs(
+            [{'collection_id': k[0], 'doc_id': k[1]} for k in ref_keys],
+            fileds=['id', 'collection_id', 'doc_id', 'full_text_accessible']
+        ):
+            ref_docs.setdefault((rd.collection_id, rd.doc_id), []).append(rd)
+
+    bots_documents = {}
+    for bot_id, bot in bots.items():
+        rows = [(c, d_id) for c in bot_colls[bot_id] for d_id in coll_docs.get(c.id, [])]
+        doc_ids = {d_id for c, d_id in rows}
+        personal_documents = doc_ids & owner_personal_libs.get(bot.user_id, set())
+        bot_ref_docs = {
+            rd.id: rd for d_id in personal_documents if d_id in documents
+            for rd in ref_docs.get((documents[d_id]['ref_collection_id'], documents[d_id]['ref_doc_id']), [])
+        }
+        sub_personal_documents = {
+            d_id for c, d_id in rows
+            if c.user_id != bot.user_id and not c.del_flag
+            and documents.get(d_id, {}).get('collection_type') == Document.TypeChoices.PERSONAL
+        }
+        bots_documents[bot_id] = {
+            'personal_documents': personal_documents,
+            'ref_documents': list(bot_ref_docs.keys()),
+            'ref_repeat_num': len([d_id for c, d_id in rows if d_id in bot_ref_docs]),
+            'owner_library_documents': (
+                (doc_ids & owner_libs.get(bot.user_id, set())) - sub_personal_documents),
+            'full_text_ref_documents': {rd.id for rd in bot_ref_docs.values() if rd.full_text_accessible},
+        }
+    return bots_documents
+
+
 def collection_detail(user_id, collection_id):
     pass
 
 
 def collection_document_add(validated_data):
     vd = validated_data
-    document_ids = vd.get('document_ids', [])
-    created_num, updated_num = 0, 0
-    updated_num = CollectionDocument.objects.filter(
-        collection_id=vd['collection_id'], document_id__in=document_ids, del_flag=True).update(del_flag=False)
-    d_lib = DocumentLibrary.objects.filter(
-        user_id=vd['user_id'], del_flag=False, document_id__in=vd['document_ids']
-    ).values_list('document_id', flat=True)
-    collection_document_ids = [{'collection_id': vd['collection_id'], 'document_id': d_id} for d_id in document_ids]
-    exist_coll_docs = []
-    if collection_document_ids:
-        exist_coll_docs = CollectionDocument.raw_by_docs(
-            collection_document_ids, ['id', 'collection_id', 'document_id', 'full_text_accessible'])
-    exist_coll_docs_dict = {cd.document_id: cd for cd in exist_coll_docs}
-    non_exist_coll_docs = []
-    for d_id in document_ids:
-        cd_data = {
-            'collection_id': vd['collection_id'],
-            'document_id': d_id,
-            'full_text_accessible': d_id in d_lib,  # todo v1.0 默认都有全文 v2.0需要考虑策略
-        }
-        if d_id not in exist_coll_docs_dict:
-            non_exist_coll_docs.append(CollectionDocument(**cd_data))
-            created_num += 1
-        elif exist_coll_docs_dict[d_id].full_text_accessible != cd_data['full_text_accessible']:
-            exist_coll_docs_dict[d_id].full_text_accessible = cd_data['full_text_accessible']
-            exist_coll_docs_dict[d_id].save()
-    # bulk_insert
-    CollectionDocument.objects.bulk_create(non_exist_coll_docs)
-    if created_num + updated_num:
-        coll_documents_total = CollectionDocument.objects.filter(
-            collection_id=vd['collection_id'], del_flag=False).count()
-        Collection.objects.filter(id=vd['collection_id']).update(total_personal=coll_documents_total)
+    document_ids = list(dict.fromkeys(vd.get('document_ids', [])))
+    d_lib = set(DocumentLibrary.objects.filter(
+        user_id=vd['user_id'], del_flag=False, document_id__in=document_ids
+    ).values_list('document_id', flat=True))
+    # 一次查询把文献分为 已存在 / 已删除需恢复 / 新增
+    exist_coll_docs, revive_coll_docs = {}, {}
+    for cd in CollectionDocument.objects.filter(
+        collection_id=vd['collection_id'], document_id__in=document_ids
+    ).values('id', 'document_id', 'del_flag', 'full_text_accessible'):
+        if not cd['del_flag']:
+            exist_coll_docs[cd['document_id']] = cd
+        else:
+            revive_coll_docs[cd['document_id']] = cd
+    revive_coll_docs = {d_id: cd for d_id, cd in revive_coll_docs.items() if d_id not in exist_coll_docs}
+    revive_ids = [cd['id'] for cd in revive_coll_docs.values()]
+    update_ids = [
+        cd['id'] for d_id, cd in exist_coll_docs.items() if cd['full_text_accessible'] != (d_id in d_lib)]
+    new_documents = {
+        d_id: d_id in d_lib  # todo v1.0 默认都有全文 v2.0需要考虑策略
+        for d_id in document_ids if d_id not in exist_coll_docs and d_id not in revive_coll_docs
+    }
+    full_text_accessible = Case(
+        When(document_id__in=d_lib, then=Value(True)), default=Value(False), output_field=BooleanField())
+    with transaction.atomic():
+        # 计数只按本事务实际写入的记录，并发添加同一文献只计一次
+        revived_doc_ids = []
+        if revive_ids:
+            revived_doc_ids = list(CollectionDocument.objects.select_for_update().filter(
+                id__in=revive_ids, del_flag=True).values_list('document_id', flat=True))
+            CollectionDocument.objects.filter(id__in=revive_ids, del_flag=True).update(
+                del_flag=False, full_text_accessible=full_text_accessible)
+        if update_ids:
+            CollectionDocument.objects.filter(id__in=update_ids).update(full_text_accessible=full_text_accessible)
+        inserted_doc_ids = CollectionDocument.insert_ignore_conflicts(vd['collection_id'], new_documents)
+        added_doc_ids = revived_doc_ids + inserted_doc_ids
+        if added_num := len(added_doc_ids):
+            Collection.objects.filter(id=vd['collection_id']).update(total_personal=F('total_personal') + added_num)
+            CollectionStats.incr(
+                vd['collection_id'], doc_total=added_num,
+                in_library_total=len(CollectionStats.in_library_document_ids(vd['user_id'], added_doc_ids)))
     if (
         document_ids and
         Collection.objects.filter(id=vd['collection_id'], type=Collection.TypeChoices.PUBLIC).exists()
     ):
         async_ref_document_to_document_library.apply_async(args=[document_ids])
-    async_update_conversation_by_collection.apply_async(args=[vd['collection_id']])
+    if added_doc_ids:
+        bot_documents_refresh_by_collections([vd['collection_id']])
+    CollectionResyncScheduler().mark(vd['collection_id'])
     async_complete_abstract.apply_async(args=[vd['user_id'], document_ids])
     return True
 
@@ -319,13 +432,19 @@ def collection_document_delete(validated_data):
             document_ids = list(set(document_ids) - set(vd['document_ids']))
     else:
         document_ids = vd['document_ids']
-    CollectionDocument.objects.filter(
-        collection_id=vd['collection_id'], document_id__in=document_ids, del_flag=False
-    ).delete()
-    coll_documents_total = CollectionDocument.objects.filter(
-        collection_id=vd['collection_id'], del_flag=False).count()
-    Collection.objects.filter(id=vd['collection_id']).update(total_personal=coll_documents_total)
-    async_update_conversation_by_collection.apply_async(args=[vd['collection_id']])
+    del_coll_docs = CollectionDocument.objects.filter(
+        collection_id=vd['collection_id'], document_id__in=document_ids, del_flag=False)
+    del_doc_ids = list(del_coll_docs.values_list('document_id', flat=True))
+    with transaction.atomic():
+        del_num, _del_rows = del_coll_docs.delete()
+        if del_num:
+            Collection.objects.filter(id=vd['collection_id']).update(total_personal=F('total_personal') - del_num)
+            CollectionStats.incr(
+                vd['collection_id'], doc_total=-del_num,
+                in_library_total=-len(CollectionStats.in_library_document_ids(vd['user_id'], del_doc_ids)))
+    if del_doc_ids:
+        bot_documents_refresh_by_collections([vd['collection_id']])
+    CollectionResyncScheduler().mark(vd['collection_id'])
     return validated_data
 
 
@@ -344,8 +463,13 @@ def collections_delete(validated_data):
         collections = Collection.objects.filter(
             id__in=vd['ids'], del_flag=False, type=Collection.TypeChoices.PERSONAL)
     collections_dict = collections.values('id', 'total_public', 'total_personal').all()
-    BotCollection.objects.filter(
-        collection_id__in=[c['id'] for c in collections_dict], del_flag=False).update(del_flag=True)
+    del_bot_colls = BotCollection.objects.filter(
+        collection_id__in=[c['id'] for c in collections_dict], del_flag=False)
+    del_bot_coll_ids = list(del_bot_colls.values_list('collection_id', flat=True).distinct())
+    del_bot_ids = list(del_bot_colls.values_list('bot_id', flat=True).distinct())
+    del_bot_colls.update(del_flag=True)
+    CollectionStats.refresh(del_bot_coll_ids)
+    bot_documents_refresh(del_bot_ids)
     effect_num = collections.update(del_flag=True)
     logger.debug(f"collections_delete effect_num: {effect_num}")
     return effect_num
@@ -396,7 +520,8 @@ def collections_docs(user_id, validated_data):
     public_count, need_public_count = 0, 0
     public_collections = Collection.objects.filter(id__in=collection_ids, type=Collection.TypeChoices.PUBLIC).all()
     public_count = len(public_collections)
-    if page_num == 1 and vd['list_type'] == 'all':
+    # 公共库只在第一页返回，带 cursor 的后续页不再返回
+    if page_num == 1 and not vd.get('cursor') and vd['list_type'] == 'all':
         need_public_count = public_count
         for c in public_collections:
             if keyword and c.title.find(keyword) == -1:
@@ -413,20 +538,25 @@ def collections_docs(user_id, validated_data):
         vd['user_id'], collection_ids, vd['list_type'])
     start_num = page_size * (page_num - 1)
     logger.info(f"limit: [{start_num}: {page_size * page_num}]")
-    # 没有按照titles名称升序排序
-    # c_docs = query_set[start_num:(page_size * page_num - need_public_count)]
-    # docs = Document.objects.filter(id__in=[cd['document_id'] for cd in c_docs]).all()
-    # 按照名称升序排序
-    all_c_docs = query_set.all()
-    start = start_num - (public_count % page_size if not need_public_count and start_num else 0)
-    document_ids = [cd['document_id'] for cd in all_c_docs]
+    # 按照名称升序排序，收藏夹文献集合作为子查询
+    filter_query = Q(id__in=query_set.values('document_id'))
     if ref_ds:
-        document_ids += ref_ds
-    filter_query = Q(id__in=document_ids)
+        filter_query |= Q(id__in=ref_ds)
     if vd.get('keyword'):
         filter_query &= Q(title__icontains=vd['keyword'])
-    doc_query_set = Document.objects.filter(filter_query).order_by('title')
-    docs = doc_query_set[start:(page_size * page_num - need_public_count)]
+    doc_query_set = Document.objects.filter(filter_query)
+    if vd.get('cursor') or page_num == 1:
+        # keyset 分页: (title, id) > cursor
+        docs, next_cursor = keyset_page(
+            doc_query_set, ['title', 'id'], page_size - need_public_count, vd.get('cursor'))
+        if page_size - need_public_count <= 0 and doc_query_set.exists():
+            # 第一页被公共库占满，下一页从头开始
+            next_cursor = encode_cursor([])
+    else:
+        # 兼容按页码翻页
+        start = start_num - (public_count % page_size if not need_public_count and start_num else 0)
+        docs = list(doc_query_set.order_by('title', 'id')[start:(page_size * page_num - need_public_count)])
+        next_cursor = keyset_cursor(docs[-1], ['title', 'id']) if docs else None
 
     query_total = doc_query_set.count()
     total = query_total + public_count
@@ -435,10 +565,8 @@ def collections_docs(user_id, validated_data):
         docs_data = DocumentApaListSerializer(docs, many=True).data
         data_dict = {d['id']: d for d in docs_data}
         document_ids = [d['id'] for d in docs_data]
-        doc_lib_document_ids = DocumentLibrary.objects.filter(
-            document_id__in=document_ids, del_flag=False, user_id=user_id,
-            task_status=DocumentLibrary.TaskStatusChoices.COMPLETED
-        ).values_list('document_id', flat=True).all()
+        doc_lib_document_ids = DocumentLibraryCache(user_id).intersection(
+            document_ids, DocumentLibraryCache.COMPLETED)
         temp_res_data = []
         for d in docs:
             temp = {
@@ -462,7 +590,8 @@ def collections_docs(user_id, validated_data):
         if vd['list_type'] == 'all_documents':
             query_set, doc_lib_document_ids, sub_bot_document_ids, ref_documents = \
                 CollectionDocumentListSerializer.get_collection_documents(vd['user_id'], collection_ids, 'personal')
-            document_ids = [cd['document_id'] for cd in query_set.all()]
+            document_ids = set(query_set.filter(
+                document_id__in=[d['id'] for d in res_data]).values_list('document_id', flat=True))
             for index, d_id in enumerate(res_data):
                 if d_id['id'] in document_ids:
                     res_data[index]['type'] = 'personal'
@@ -475,6 +604,7 @@ def collections_docs(user_id, validated_data):
         'is_all_in_document_library': True if vd['list_type'] == 'personal' else False,
         'total': total,
         'show_total': query_total,
+        'next_cursor': next_cursor,
     }
 
 
@@ -488,9 +618,9 @@ def collection_documents_select_list(user_id, validated_data):
         bot = Bot.objects.filter(id=vd['bot_id'], del_flag=False).first()
     query_set, d1, d2, ref_ds = CollectionDocumentListSerializer.get_collection_documents(
         user_id, collection_ids, list_type, bot=bot)
-    ref_doc_lib_ids = (
-        list(set(ref_ds) & set(CollectionDocumentListSerializer._my_doc_lib_document_ids(user_id)))
-    )
+    # 个人库作为子查询，只取关联文献中在个人库的部分
+    ref_doc_lib_ids = list(set(CollectionDocumentListSerializer._my_doc_lib_documents(user_id).filter(
+        document_id__in=ref_ds))) if ref_ds else []
 
     if ref_ds and (
         list_type in ['all', 'all_documents']
@@ -579,7 +709,7 @@ def collections_create_bot_check(user_id, collection_ids=None, bot_id=None):
     if not collection_ids:
         return 0, ''
     query_set, d1, d2, d3 = CollectionDocumentListSerializer.get_collection_documents(user_id, collection_ids, 'all')
-    document_ids = [cd['document_id'] for cd in query_set.all()]
+    document_ids = query_set.values('document_id')
     # 是否有关联文献
     filter_query = Q(document_id__in=document_ids, del_flag=False, user_id=user_id,
                      task_status=DocumentLibrary.TaskStatusChoices.COMPLETED,
@@ -1,3 +1,177 @@
-# from django.test import TestCase
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from collection.base_service import CollectionResyncScheduler
+from collection.models import Collection, CollectionDocument
+from collection.service import collection_document_add, collections_docs
+from document.models import Document
+
+
+@mock.patch('collection.service.async_complete_abstract')
+@mock.patch('collection.service.async_ref_document_to_document_library')
+@mock.patch('collection.service.CollectionResyncScheduler')
+class CollectionDocumentAddTest(TestCase):
+    user_id = 'test-user'
+
+    def setUp(self):
+        self.collection = Collection.objects.create(title='c', user_id=self.user_id)
+        self.documents = [
+            Document.objects.create(
+                doc_id=i, collection_id='arxiv', collection_type=Document.TypeChoices.PUBLIC, title=f'doc {i}')
+            for i in range(3)
+        ]
+
+    def _add(self, document_ids):
+        return collection_document_add({
+            'user_id': self.user_id,
+            'collection_id': self.collection.id,
+            'document_ids': document_ids,
+        })
+
+    def _total_personal(self):
+        return Collection.objects.get(pk=self.collection.id).total_personal
+
+    def test_insert_ignore_conflicts_returns_only_inserted(self, *mocks):
+        doc0, doc1, doc2 = [d.id for d in self.documents]
+        inserted = CollectionDocument.insert_ignore_conflicts(self.collection.id, {doc0: True, doc1: False})
+        self.assertCountEqual(inserted, [doc0, doc1])
+        inserted = CollectionDocument.insert_ignore_conflicts(self.collection.id, {doc1: True, doc2: True})
+        self.assertEqual(inserted, [doc2])
+        self.assertEqual(CollectionDocument.objects.filter(collection_id=self.collection.id).count(), 3)
+        # 冲突时不覆盖已有记录
+        self.assertFalse(CollectionDocument.objects.get(
+            collection_id=self.collection.id, document_id=doc1).full_text_accessible)
+
+    def test_add_revives_deleted_and_inserts_new(self, *mocks):
+        doc0, doc1, doc2 = [d.id for d in self.documents]
+        self._add([doc0, doc1])
+        self.assertEqual(self._total_personal(), 2)
+        CollectionDocument.objects.filter(collection_id=self.collection.id, document_id=doc0).update(del_flag=True)
+        Collection.objects.filter(pk=self.collection.id).update(total_personal=1)
+
+        # 恢复 doc0、新增 doc2、doc1 已存在，与逐条 update_or_create 的结果一致
+        self._add([doc0, doc1, doc2])
+        coll_docs = CollectionDocument.objects.filter(collection_id=self.collection.id)
+        self.assertEqual(coll_docs.count(), 3)
+        self.assertFalse(coll_docs.filter(del_flag=True).exists())
+        self.assertEqual(self._total_personal(), 3)
+
+    def test_add_same_documents_twice_counts_once(self, *mocks):
+        document_ids = [d.id for d in self.documents]
+        self._add(document_ids + document_ids)
+        self._add(document_ids)
+        self.assertEqual(CollectionDocument.objects.filter(collection_id=self.collection.id).count(), 3)
+        self.assertEqual(self._total_personal(), 3)
+
+
+class _TestResyncScheduler(CollectionResyncScheduler):
+    DIRTY_KEY = 'test:scinav:collection_resync:dirty'
+    FIRST_KEY = 'test:scinav:collection_resync:first'
+    INFLIGHT_KEY = 'test:scinav:collection_resync:inflight'
+
+
+class CollectionResyncSchedulerTest(SimpleTestCase):
+
+    def setUp(self):
+        self.scheduler = _TestResyncScheduler(debounce=0, max_wait=60, lease=600)
+        self.addCleanup(self.scheduler.conn.delete, *[
+            _TestResyncScheduler.DIRTY_KEY, _TestResyncScheduler.FIRST_KEY, _TestResyncScheduler.INFLIGHT_KEY])
+
+    def test_repeated_marks_are_claimed_once(self):
+        for _ in range(3):
+            self.scheduler.mark('c1', 'c2', 'c1')
+        time.sleep(0.01)
+        self.assertCountEqual(self.scheduler.claim_due(), ['c1', 'c2'])
+        self.assertEqual(self.scheduler.claim_due(), [])
+
+    def test_debounce_delays_claim(self):
+        scheduler = _TestResyncScheduler(debounce=60, max_wait=120, lease=600)
+        scheduler.mark('c1')
+        self.assertEqual(scheduler.claim_due(), [])
+        self.assertEqual(scheduler.size(), 1)
+
+    def test_max_wait_bounds_debounce(self):
+        scheduler = _TestResyncScheduler(debounce=60, max_wait=0, lease=600)
+        scheduler.mark('c1')
+        time.sleep(0.01)
+        scheduler.mark('c1')
+        self.assertEqual(scheduler.claim_due(), ['c1'])
+
+    def test_unacked_claim_is_kept_until_lease_expires(self):
+        self.scheduler.mark('c1')
+        time.sleep(0.01)
+        self.assertEqual(self.scheduler.claim_due(), ['c1'])
+        # worker 中断未 ack，租约未过期时不会被其他 worker 取出
+        self.assertEqual(self.scheduler.claim_due(), [])
+        self.assertIsNotNone(self.scheduler.conn.zscore(_TestResyncScheduler.INFLIGHT_KEY, 'c1'))
+
+    def test_expired_lease_is_reclaimed(self):
+        scheduler = _TestResyncScheduler(debounce=0, max_wait=60, lease=-1)
+        scheduler.mark('c1')
+        time.sleep(0.01)
+        self.assertEqual(scheduler.claim_due(), ['c1'])
+        self.assertEqual(scheduler.claim_due(), ['c1'])
+
+    def test_ack_removes_lease(self):
+        scheduler = _TestResyncScheduler(debounce=0, max_wait=60, lease=-1)
+        scheduler.mark('c1')
+        time.sleep(0.01)
+        self.assertEqual(scheduler.claim_due(), ['c1'])
+        scheduler.ack('c1')
+        self.assertEqual(scheduler.claim_due(), [])
+        self.assertIsNone(scheduler.conn.zscore(_TestResyncScheduler.INFLIGHT_KEY, 'c1'))
+
+
+class CollectionsDocsCursorTest(TestCase):
+    user_id = 'test-user'
+
+    def setUp(self):
+        self.public_collection = Collection.objects.create(
+            id='arxiv', title='arxiv', type=Collection.TypeChoices.PUBLIC)
+        self.collection = Collection.objects.create(title='c', user_id=self.user_id)
+        self.titles = ['a', 'b', 'b', 'c']
+        for i, title in enumerate(self.titles):
+            document = Document.objects.create(
+                doc_id=i, collection_id='arxiv', collection_type=Document.TypeChoices.PUBLIC, title=title,
+                authors=['Alice Smith'], year=2020)
+            CollectionDocument.objects.create(collection_id=self.collection.id, document_id=document.id)
+
+    def _pages(self, page_size):
+        pages, cursor = [], None
+        while True:
+            data = collections_docs(self.user_id, {
+                'user_id': self.user_id,
+                'collection_ids': [self.public_collection.id, self.collection.id],
+                'list_type': 'all',
+                'page_size': page_size,
+                'page_num': 1,
+                'keyword': None,
+                'cursor': cursor,
+            })
+            pages.append(data['list'])
+            if not (cursor := data['next_cursor']):
+                return pages
+            self.assertLess(len(pages), 10)
+
+    def _assert_all_documents_once(self, pages):
+        rows = [row for page in pages for row in page]
+        public_rows = [row for row in rows if row['id'] is None]
+        document_rows = [row for row in rows if row['id'] is not None]
+        self.assertEqual(len(public_rows), 1)
+        self.assertIs(rows[0], public_rows[0])
+        self.assertEqual(len(document_rows), len(self.titles))
+        self.assertEqual(len(set(row['id'] for row in document_rows)), len(self.titles))
+        self.assertEqual([row['title'] for row in document_rows], sorted(self.titles))
+
+    def test_cursor_continues_after_public_rows(self):
+        pages = self._pages(page_size=2)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self._assert_all_documents_once(pages)
+
+    def test_public_rows_fill_first_page(self):
+        pages = self._pages(page_size=1)
+        self.assertEqual([len(page) for page in pages], [1, 1, 1, 1, 1])
+        self.assertIsNone(pages[0][0]['id'])
+        self._assert_all_documents_once(pages)
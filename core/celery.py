@@ -32,10 +32,30 @@ app.conf.beat_schedule = {
         'task': 'document.tasks.async_document_library_task',
         'schedule': timedelta(seconds=10),
     },
-    'async-publish-bot-every-minute': {
+    'async-publish-bot-every-10minutes': {
         'task': 'document.tasks.async_schedule_publish_bot_task',
+        'schedule': crontab(minute='*/10'),
+    },
+    'async-complete-abstract-batch-every-minute': {
+        'task': 'document.tasks.async_complete_abstract_batch',
+        'schedule': crontab(minute='*'),
+    },
+    'async-rag-outbox-every-minute': {
+        'task': 'document.tasks.async_rag_outbox_task',
         'schedule': crontab(minute='*'),
     },
+    'async-collection-resync-sweep-every-5seconds': {
+        'task': 'document.tasks.async_collection_resync_sweep',
+        'schedule': timedelta(seconds=5),
+    },
+    'async-flush-user-operation-log-every-10seconds': {
+        'task': 'document.tasks.async_flush_user_operation_log',
+        'schedule': timedelta(seconds=10),
+    },
+    'async-collection-stats-reconcile-every-day': {
+        'task': 'document.tasks.async_collection_stats_reconcile',
+        'schedule': crontab(minute=30, hour=3),
+    },
     # 'async-daily-member-status-every-day': {
     #     'task': 'document.tasks.async_daily_member_status',
     #     'schedule': crontab(minute=1, hour=0),
@@ -345,6 +345,15 @@ OSS_PUBLIC_KEY = os.environ.get('OSS_PUBLIC_KEY', 'public_key')
 # rag api
 RAG_HOST = os.environ.get('RAG_HOST', 'https://api.scinav.myscale.cloud')
 RAG_API_KEY = os.environ.get('RAG_API_KEY', 'api_key')
+# rag 补全摘要：每秒请求数、并发数、最大重试次数
+RAG_ABSTRACT_COMPLETION_RATE = float(os.environ.get('RAG_ABSTRACT_COMPLETION_RATE', 5))
+RAG_ABSTRACT_COMPLETION_CONCURRENCY = int(os.environ.get('RAG_ABSTRACT_COMPLETION_CONCURRENCY', 4))
+RAG_ABSTRACT_COMPLETION_MAX_ATTEMPTS = int(os.environ.get('RAG_ABSTRACT_COMPLETION_MAX_ATTEMPTS', 3))
+# 收藏夹变更同步问答：防抖秒数、最长等待秒数、并发数、取出后的租约秒数（需大于 sweep 任务的 time_limit）
+COLLECTION_RESYNC_DEBOUNCE = float(os.environ.get('COLLECTION_RESYNC_DEBOUNCE', 5))
+COLLECTION_RESYNC_MAX_WAIT = float(os.environ.get('COLLECTION_RESYNC_MAX_WAIT', 60))
+COLLECTION_RESYNC_CONCURRENCY = int(os.environ.get('COLLECTION_RESYNC_CONCURRENCY', 4))
+COLLECTION_RESYNC_LEASE = float(os.environ.get('COLLECTION_RESYNC_LEASE', 600))
 
 # object path url host
 OBJECT_PATH_URL_HOST = os.environ.get('OBJECT_PATH_URL_HOST', 'object_path_url_host')
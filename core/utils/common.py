@@ -189,6 +189,18 @@ def cmp_ignore_order(src=None, dst=None, sort_fun=None):
         return src == dst
 
 
+def papers_fingerprint(papers):
+    """
+    问答文献列表指纹，与顺序、重复无关
+    只取推送给 rag 的字段 (collection_id, collection_type, doc_id, full_text_accessible)
+    """
+    keys = sorted(set(
+        f"{p.get('collection_id')}|{p.get('collection_type')}|{p.get('doc_id')}|{bool(p.get('full_text_accessible'))}"
+        for p in papers or []
+    ))
+    return hashlib.sha256('\n'.join(keys).encode('utf-8')).hexdigest()
+
+
 def send_email(subject, content, to_emails, from_email=None):
     from django.core.mail import send_mail
     res = send_mail(subject, content, from_email, to_emails)
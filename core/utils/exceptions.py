@@ -13,7 +13,7 @@ from django.http import StreamingHttpResponse
 from django.utils.encoding import force_str
 from rest_framework import status as rfd_status
 from rest_framework.exceptions import APIException
-from rest_framework.views import Response, exception_handler
+from rest_framework.response import Response
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +38,9 @@ def custom_exception_handler(exc, context):
         'request_id': exception_id,
     }
 
+    # rest_framework.views 加载时会导入 DEFAULT_PARSER_CLASSES (core.utils.views)，在函数内导入避免循环导入
+    from rest_framework.views import exception_handler
+
     # try rest framework handler
     response = exception_handler(exc, context)
     if response is not None:
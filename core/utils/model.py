@@ -7,3 +7,32 @@ def model_import_by_name(module_from, module_name):
     except ImportError:
         return None
     return vars(module)[module_name]
+
+
+def raw_by_composite_keys(model, key_columns, keys, fields='*', where=None):
+    """
+    按组合键批量查询，键值作为数组参数绑定，不拼接到 sql 中
+        SELECT <fields> FROM <table> JOIN unnest(%s::text[], %s::bigint[]) AS k(k0, k1)
+        ON <table>.collection_id = k.k0 AND <table>.doc_id = k.k1
+    不同数量的键生成相同的 sql 文本，可以复用执行计划
+    :param model: django model
+    :param key_columns: [(column, pg_type)] 如 [('collection_id', 'text'), ('doc_id', 'bigint')]
+    :param keys: [(value0, value1)]
+    :param fields: '*' 或字段名列表/逗号分隔的字段名
+    :param where: 附加过滤条件（固定的 sql 片段，不能包含外部输入）
+    :return: RawQuerySet
+    """
+    table = model._meta.db_table
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(',')]
+    fields_str = ', '.join(f'"{table}".*' if f == '*' else f'"{table}"."{f}"' for f in fields)
+    keys = list(dict.fromkeys(tuple(k) for k in keys))
+    unnest_args = ', '.join(f'%s::{pg_type}[]' for column, pg_type in key_columns)
+    key_alias = ', '.join(f'k{i}' for i in range(len(key_columns)))
+    on_str = ' AND '.join(f'"{table}"."{column}" = k.k{i}' for i, (column, pg_type) in enumerate(key_columns))
+    sql = (f'SELECT {fields_str} FROM "{table}" '
+           f'JOIN unnest({unnest_args}) AS k({key_alias}) ON {on_str}')
+    if where:
+        sql += f' WHERE {where}'
+    params = [[k[i] for k in keys] for i in range(len(key_columns))]
+    return model.objects.raw(sql, params)
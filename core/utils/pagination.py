@@ -0,0 +1,56 @@
+import base64
+import json
+import logging
+
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """无效的游标返回 None"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception as e:
+        logger.warning(f'decode_cursor error: {cursor}, {e}')
+        return None
+    return values if isinstance(values, list) else None
+
+
+def keyset_after(fields, values):
+    """
+    (fields) > (values) 的过滤条件，与 order_by(*fields) 升序一致（postgres 升序 NULL 排在最后）
+    """
+    query, equal_query = Q(pk__in=[]), Q()
+    for field, value in zip(fields, values):
+        if value is None:
+            # NULL 之后只有同为 NULL 的后续字段更大的记录
+            equal_query &= Q(**{f'{field}__isnull': True})
+            continue
+        query |= equal_query & (Q(**{f'{field}__gt': value}) | Q(**{f'{field}__isnull': True}))
+        equal_query &= Q(**{field: value})
+    return query
+
+
+def keyset_page(query_set, fields, page_size, cursor=None):
+    """
+    按 fields 升序 keyset 分页，fields 最后一个字段需唯一（如 id）
+    :return: (本页记录, 下一页游标 没有下一页为 None)
+    """
+    if page_size <= 0:
+        return [], cursor
+    if cursor and (values := decode_cursor(cursor)) and len(values) == len(fields):
+        query_set = query_set.filter(keyset_after(fields, values))
+    items = list(query_set.order_by(*fields)[:page_size + 1])
+    if len(items) <= page_size:
+        return items, None
+    items = items[:page_size]
+    return items, keyset_cursor(items[-1], fields)
+
+
+def keyset_cursor(item, fields):
+    return encode_cursor([item[f] if isinstance(item, dict) else getattr(item, f) for f in fields])
@@ -0,0 +1,35 @@
+import hashlib
+import logging
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+logger = logging.getLogger(__name__)
+
+
+class ChecksumUploadHandler(TemporaryFileUploadHandler):
+    """
+    上传文件时边接收边计算 sha256
+    1. 数据块直接写入临时文件，不在内存中缓存整个文件
+    2. 接收完成后 file.checksum 即为文件的 sha256，无需再次读取文件计算
+    使用：在读取 request.data/request.FILES 之前
+        request.upload_handlers.insert(0, ChecksumUploadHandler(request))
+    """
+    hash_name = 'sha256'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.hasher = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.new(self.hash_name)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.checksum = self.hasher.hexdigest()
+        logger.debug(f'upload file complete, name: {file.name}, size: {file_size}, checksum: {file.checksum}')
+        return file
@@ -9,6 +9,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
 from django.db import transaction, DatabaseError
 
+from bot.base_service import BotListCache
 from bot.models import Bot, HotBot
 from core.utils.common import check_uuid4_str, check_email_str
 from customadmin.models import GlobalConfig, Notification
@@ -41,6 +42,7 @@ def update_bots_publish_order(validated_data):
         bot.order = vd_dict[bot.id]['order']
         bot.updated_at = datetime.datetime.now()
     Bot.objects.bulk_update(bots, ['order', 'updated_at'])
+    BotListCache.invalidate()
     return True
 
 
@@ -64,6 +66,7 @@ def update_bots_hot_order(validated_data):
         hot_bot.order_num = vd_dict[hot_bot.bot_id]['order']
         hot_bot.updated_at = datetime.datetime.now()
     HotBot.objects.bulk_update(hot_bots, ['order_num', 'updated_at'])
+    BotListCache.invalidate()
     return True
 
 
@@ -6,6 +6,7 @@ from rest_framework.decorators import permission_classes
 from rest_framework.permissions import AllowAny, BasePermission, IsAuthenticated
 from rest_framework.views import APIView
 
+from bot.base_service import BotListCache
 from bot.models import Bot, HotBot
 from bot.serializers import HotBotListSerializer
 from bot.service import bot_publish, add_hot_bot
@@ -130,6 +131,7 @@ class BotsHot(APIView):
             return my_json_response(code=100002, msg='hot_bot not found')
         hot_bot.del_flag = True
         hot_bot.save()
+        BotListCache.invalidate()
         return my_json_response({})
 
 
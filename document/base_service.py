@@ -2,13 +2,18 @@ import copy
 import datetime
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Count
 from django.core.cache import cache
 
-from collection.models import Collection, CollectionDocument
+from bot.models import BotDocument
+from collection.models import Collection, CollectionStats
 from core.utils.common import str_hash
-from document.models import Document, DocumentLibrary
+from document.models import Document, DocumentLibrary, RagOutbox, DocumentLibraryCache
 from document.serializers import DocumentRagCreateSerializer
 from bot.rag_service import Document as RagDocument
 from django_redis import get_redis_connection
@@ -58,6 +63,9 @@ def update_document_lib(user_id, document_ids, keyword=None):
         document_library, _ = DocumentLibrary.objects.update_or_create(
             defaults=update_defaults, create_defaults=data, user_id=user_id, document_id=doc_id)
         document_libraries.append(document_library)
+    DocumentLibraryCache.invalidate(user_id)
+    if user_id != '0000':
+        CollectionStats.refresh_by_documents(user_id, [doc_lib.document_id for doc_lib in document_libraries])
     return 0, 'success', document_libraries
 
 
@@ -66,16 +74,106 @@ def document_update_from_rag_ret(rag_ret):
     if not serial.is_valid():
         logger.error(f'document_update_from_rag_ret failed, serial.errors: {serial.errors}')
         raise Exception(serial.errors)
-    vd = serial.validated_data
+    vd = dict(serial.validated_data)
+    vd['metadata_hash'] = document_metadata_hash(vd)
     document, _ = Document.objects.update_or_create(
         vd,
         doc_id=vd['doc_id'],
         collection_type=vd['collection_type'],
         collection_id=vd['collection_id']
     )
+    BotDocument.sync_titles([document.id])
     return document
 
 
+def rag_documents_fetch(collection_type, collection_id, doc_ids, max_workers=8):
+    """
+    并发获取同一收藏夹的 rag 文献信息
+    :return: (rag_rets, skip_ids)
+    """
+    docs = [{'collection_type': collection_type, 'collection_id': collection_id, 'doc_id': d} for d in doc_ids]
+    rag_rets, skip_docs = rag_documents_get_many(docs, max_workers)
+    return rag_rets, [d['doc_id'] for d in skip_docs]
+
+
+def rag_documents_get_many(docs, max_workers=8):
+    """
+    并发获取 rag 文献信息
+    :param docs: [{'collection_type', 'collection_id', 'doc_id'}]
+    :return: (rag_rets, skip_docs)
+    """
+    rag_rets, skip_docs = [], []
+    if not docs:
+        return rag_rets, skip_docs
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(RagDocument.get, doc): doc for doc in docs}
+        for future in as_completed(futures):
+            try:
+                rag_rets.append(future.result())
+            except Exception as e:
+                logger.error(f'rag_documents_get_many error: {futures[future]}, {e}')
+                skip_docs.append(futures[future])
+    return rag_rets, skip_docs
+
+
+# 不经过 rag 在本地单独修改的字段，metadata_hash 不会随之变化
+DOCUMENT_DRIFT_FIELDS = ['state']
+
+
+def document_metadata_hash(validated_data):
+    return str_hash(json.dumps(validated_data, sort_keys=True, default=str))
+
+
+def documents_bulk_upsert_from_rag_rets(rag_rets, only_changed=False):
+    """
+    批量 update_or_create document，按 (collection_id, doc_id) 冲突更新
+    :param only_changed: 只写入 metadata_hash 有变化的记录；本地会单独修改的字段（DRIFT_FIELDS）逐个比较
+    :return: ({doc_id: document_id}, skip_doc_ids, upsert_num)
+    """
+    validated_data, skip_ids = [], []
+    for rag_ret in rag_rets:
+        serial = DocumentRagCreateSerializer(data=rag_ret)
+        if not serial.is_valid():
+            logger.error(f'documents_bulk_upsert_from_rag_rets failed, serial.errors: {serial.errors}')
+            skip_ids.append(rag_ret.get('doc_id'))
+            continue
+        vd = dict(serial.validated_data)
+        vd['metadata_hash'] = document_metadata_hash(vd)
+        validated_data.append(vd)
+    if not validated_data:
+        return {}, skip_ids, 0
+    filter_query = Q()
+    for vd in validated_data:
+        filter_query |= Q(collection_id=vd['collection_id'], doc_id=vd['doc_id'])
+    upsert_data = validated_data
+    if only_changed:
+        exist_docs = {
+            f"{d['collection_id']}-{d['doc_id']}": d
+            for d in Document.objects.filter(filter_query).values(
+                'collection_id', 'doc_id', 'metadata_hash', *DOCUMENT_DRIFT_FIELDS)
+        }
+
+        def _changed(vd):
+            if not (exist := exist_docs.get(f"{vd['collection_id']}-{vd['doc_id']}")):
+                return True
+            return exist['metadata_hash'] != vd['metadata_hash'] or any(
+                f in vd and exist[f] != vd[f] for f in DOCUMENT_DRIFT_FIELDS)
+
+        upsert_data = [vd for vd in validated_data if _changed(vd)]
+    if upsert_data:
+        # 只更新所有记录都有的字段，与 update_or_create 只更新传入字段一致
+        update_fields = set.intersection(*[set(vd.keys()) for vd in upsert_data]) - {'collection_id', 'doc_id'}
+        update_fields = list(update_fields) + ['updated_at']
+        Document.objects.bulk_create(
+            [Document(**vd) for vd in upsert_data],
+            update_conflicts=True, unique_fields=['collection', 'doc_id'], update_fields=update_fields,
+        )
+    documents = Document.objects.filter(filter_query).values('id', 'doc_id').all()
+    doc_id_map = {d['doc_id']: d['id'] for d in documents}
+    BotDocument.sync_titles([doc_id_map.get(vd['doc_id']) for vd in upsert_data])
+    return doc_id_map, skip_ids, len(upsert_data)
+
+
 def reference_doc_to_document(document: Document):
     """
     需注意个人上传文件情况，关联&全文获取标签的文献，自动帮助订阅者下载公共库该文献全文，仅关联标签或无标签个人上传文献，则订阅者无法获取该文献
@@ -108,14 +206,124 @@ def reference_doc_to_document_library(document):
             update_document_lib('0000', [ref_document.id])
 
 
+def personal_upload_lock(user_id, checksum, timeout=60):
+    """同一用户同一文件内容的上传串行处理，避免并发重复入库"""
+    return cache.lock(f'scinav:upload:checksum:{user_id}:{checksum}', timeout=timeout, blocking_timeout=timeout)
+
+
+def personal_upload_duplicate(user_id, checksum):
+    """
+    根据文件 checksum 查找用户已上传的相同文件
+    只查本人文献库：其他用户的个人文献不可共享；公共库文献加入文献库是公共文献（task_type public），
+    与个人上传的文件名、删除语义不同，因此公共库的相同内容不做关联，仍按个人文献入库
+    :return: 已存在的 DocumentLibrary（入库中或已完成），没有返回 None
+    """
+    if not checksum:
+        return None
+    return DocumentLibrary.objects.filter(
+        user_id=user_id, checksum=checksum, task_type=Document.TypeChoices.PERSONAL, del_flag=False,
+        task_status__in=[
+            DocumentLibrary.TaskStatusChoices.PENDING, DocumentLibrary.TaskStatusChoices.QUEUEING,
+            DocumentLibrary.TaskStatusChoices.IN_PROGRESS, DocumentLibrary.TaskStatusChoices.COMPLETED,
+        ],
+    ).exclude(task_id__isnull=True).exclude(task_id='').order_by('created_at').first()
+
+
+def doc_lib_ref_counts(field, values, exclude_ids=None):
+    """
+    个人文件去重后多条 DocumentLibrary 共用同一 document/task，统计仍在使用的引用数
+    :param field: document_id 或 task_id
+    :param values: document_ids 或 task_ids
+    :param exclude_ids: 本次要删除的 DocumentLibrary ids
+    :return: {value: count}
+    """
+    values = [v for v in values if v]
+    if not values:
+        return {}
+    query_set = DocumentLibrary.objects.filter(**{f'{field}__in': values}, del_flag=False)
+    if exclude_ids:
+        query_set = query_set.exclude(id__in=exclude_ids)
+    ref_counts = query_set.values(field).annotate(count=Count('id')).all()
+    return {r[field]: r['count'] for r in ref_counts}
+
+
 def search_result_delete_cache(user_id):
     doc_search_redis_key_prefix = f'scinav:paper:search:{user_id}'
-    keys = cache.keys(f"{doc_search_redis_key_prefix}:*")
-    if keys:
-        return cache.delete_many(keys)
+    # delete_pattern 使用 SCAN 迭代，不会像 KEYS 一样阻塞 redis
+    cache.delete_pattern(f"{doc_search_redis_key_prefix}:*")
     return True
 
 
+def rag_outbox_add(action, payloads):
+    """写入 rag outbox，由 async_rag_outbox_task 执行"""
+    if not payloads:
+        return []
+    return RagOutbox.objects.bulk_create([
+        RagOutbox(action=action, payload=payload, next_retry_at=datetime.datetime.now()) for payload in payloads
+    ])
+
+
+def _rag_outbox_execute(outbox: RagOutbox):
+    payload = outbox.payload
+    if outbox.action == RagOutbox.ActionChoices.DELETE_PERSONAL_PAPER:
+        RagDocument.delete_personal_paper(payload['collection_id'], payload['doc_id'])
+    elif outbox.action == RagOutbox.ActionChoices.CANCEL_INGEST_TASK:
+        rag_ret = RagDocument.get_ingest_task(payload['task_id'])
+        if rag_ret['task_status'] == DocumentLibrary.TaskStatusChoices.COMPLETED:
+            # 取消前任务已完成，删除已入库的个人文献；公共库任务入库的是公共文献，不能删除
+            if payload.get('task_type') == 'personal' and rag_ret.get('paper'):
+                RagDocument.delete_personal_paper(rag_ret['paper']['collection_id'], rag_ret['paper']['doc_id'])
+        elif rag_ret['task_status'] not in [
+            DocumentLibrary.TaskStatusChoices.CANCELLED, DocumentLibrary.TaskStatusChoices.ERROR
+        ]:
+            RagDocument.cancel_ingest_task(payload['task_id'])
+    else:
+        raise ValueError(f'unknown rag outbox action: {outbox.action}')
+
+
+def rag_outbox_process(batch_size=100, max_workers=8, max_attempts=8, stale_minutes=10):
+    """
+    执行 rag outbox
+    1. 领取到期的 pending 记录，以及 in_progress 超时（worker 中断）的记录
+    2. 并发调用 rag，失败按指数退避重试，超过最大次数标记为 dead
+    :return: (success_num, failed_num)
+    """
+    now = datetime.datetime.now()
+    claim_query = (
+        Q(status=RagOutbox.StatusChoices.PENDING, next_retry_at__lte=now)
+        | Q(status=RagOutbox.StatusChoices.IN_PROGRESS, updated_at__lt=now - datetime.timedelta(minutes=stale_minutes))
+    )
+    with transaction.atomic():
+        outboxes = list(RagOutbox.objects.select_for_update(skip_locked=True).filter(
+            claim_query, del_flag=False).order_by('next_retry_at')[:batch_size])
+        RagOutbox.objects.filter(id__in=[o.id for o in outboxes]).update(
+            status=RagOutbox.StatusChoices.IN_PROGRESS, updated_at=now)
+    if not outboxes:
+        return 0, 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_rag_outbox_execute, o): o for o in outboxes}
+        for future in as_completed(futures):
+            outbox = futures[future]
+            outbox.attempts += 1
+            try:
+                future.result()
+                outbox.status = RagOutbox.StatusChoices.COMPLETED
+                outbox.error = None
+            except Exception as e:
+                logger.warning(f'rag outbox error: {outbox.id}, {outbox.action}, {outbox.payload}, {e}')
+                outbox.error = str(e)[:2000]
+                if outbox.attempts >= max_attempts:
+                    outbox.status = RagOutbox.StatusChoices.DEAD
+                else:
+                    outbox.status = RagOutbox.StatusChoices.PENDING
+                    outbox.next_retry_at = datetime.datetime.now() + datetime.timedelta(
+                        seconds=min(30 * 2 ** (outbox.attempts - 1), 3600))
+            outbox.updated_at = datetime.datetime.now()
+    RagOutbox.objects.bulk_update(outboxes, ['status', 'attempts', 'error', 'next_retry_at', 'updated_at'])
+    failed_num = len([o for o in outboxes if o.status != RagOutbox.StatusChoices.COMPLETED])
+    return len(outboxes) - failed_num, failed_num
+
+
 def search_result_from_cache(user_id, content, page_size=10, page_num=1, search_type='paper', limit=100):
     if search_type == 'paper':
         doc_search_redis_key_prefix = f'scinav:{search_type}:search:{user_id}:{limit}'
@@ -151,3 +359,173 @@ def search_result_cache_data(user_id, content, search_type='paper', limit=100):
         all_cache = json.loads(search_cache)
         return all_cache
     return None
+
+
+class TokenBucket:
+    """redis 令牌桶，多个 worker 共享限流"""
+    LUA_TAKE = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], 60)
+    return allowed
+    """
+
+    def __init__(self, key, rate, capacity=None):
+        self.conn = get_redis_connection('default')
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.script = self.conn.register_script(self.LUA_TAKE)
+
+    def take(self, timeout=30):
+        """获取一个令牌，超时返回 False"""
+        deadline = time.time() + timeout
+        while True:
+            if self.script(keys=[self.key], args=[self.rate, self.capacity, time.time()]):
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(1 / self.rate)
+
+
+class AbstractCompletionRateLimited(Exception):
+    pass
+
+
+class AbstractCompletionQueue:
+    """
+    rag 补全摘要队列
+    1. queue: 待补全的 {user_id, document_id}
+    2. processing: 正在处理的一批，bulk_update 写入后确认删除；worker 中断后下次先重新处理这一批
+    3. retry: 失败的记录按 now + backoff(attempts) 排序，到期后移回 queue
+    4. attempts: 每个 document 的失败次数，超过最大重试次数进入 dead 集合，不再重试；限流等待超时不计入
+    """
+    QUEUE_KEY = 'scinav:abstract_completion:queue'
+    PROCESSING_KEY = 'scinav:abstract_completion:processing'
+    RETRY_KEY = 'scinav:abstract_completion:retry'
+    ATTEMPTS_KEY = 'scinav:abstract_completion:attempts'
+    DEAD_KEY = 'scinav:abstract_completion:dead'
+    BUCKET_KEY = 'scinav:abstract_completion:bucket'
+    LOCK_KEY = 'scinav:abstract_completion:lock'
+    RATE_LIMITED_DELAY = 10
+    LUA_CLAIM = """
+    if redis.call('LLEN', KEYS[2]) > 0 then
+        return redis.call('LRANGE', KEYS[2], 0, -1)
+    end
+    local due = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[2], 'LIMIT', 0, 1000)
+    if #due > 0 then
+        redis.call('RPUSH', KEYS[1], unpack(due))
+        redis.call('ZREM', KEYS[3], unpack(due))
+    end
+    local items = {}
+    for i = 1, tonumber(ARGV[1]) do
+        local item = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+        if not item then
+            break
+        end
+        items[#items + 1] = item
+    end
+    return items
+    """
+
+    def __init__(self):
+        self.conn = get_redis_connection('default')
+        self.max_attempts = settings.RAG_ABSTRACT_COMPLETION_MAX_ATTEMPTS
+        self.concurrency = settings.RAG_ABSTRACT_COMPLETION_CONCURRENCY
+        self.bucket = TokenBucket(self.BUCKET_KEY, settings.RAG_ABSTRACT_COMPLETION_RATE)
+
+    def push(self, user_id, document_ids):
+        if items := [json.dumps({'user_id': user_id, 'document_id': d}) for d in document_ids]:
+            self.conn.rpush(self.QUEUE_KEY, *items)
+        return len(items)
+
+    def claim(self, count):
+        """未确认的一批优先返回，否则把到期的重试移回 queue，再从 queue 移动一批到 processing"""
+        items = self.conn.register_script(self.LUA_CLAIM)(
+            keys=[self.QUEUE_KEY, self.PROCESSING_KEY, self.RETRY_KEY], args=[count, time.time()])
+        return [json.loads(i) for i in items]
+
+    def lock(self, timeout=300):
+        return self.conn.lock(self.LOCK_KEY, timeout=timeout, blocking=False)
+
+    def size(self):
+        return self.conn.llen(self.QUEUE_KEY) + self.conn.zcard(self.RETRY_KEY)
+
+    def dead_items(self):
+        return [json.loads(i) for i in self.conn.smembers(self.DEAD_KEY)]
+
+    @staticmethod
+    def backoff(attempts):
+        return min(30 * 2 ** (attempts - 1), 3600)
+
+    def _complete(self, item, document):
+        if not self.bucket.take():
+            raise AbstractCompletionRateLimited('abstract completion rate limit wait timeout')
+        return RagDocument.complete_abstract(item['user_id'], document.collection_id, document.doc_id)
+
+    def process(self, batch_size=50):
+        """
+        处理一批：令牌桶限流 + 有限并发请求 rag，成功的摘要 bulk_update 写入
+        重试、dead 与确认在 bulk_update 之后一次提交
+        :return: (success_num, failed_num)
+        """
+        items = self.claim(batch_size)
+        if not items:
+            return 0, 0
+        documents = Document.objects.filter(pk__in=[i['document_id'] for i in items]).only(
+            'id', 'collection_id', 'doc_id', 'abstract').in_bulk()
+        items = [i for i in items if i['document_id'] in documents]
+        attempts = dict(zip(
+            [i['document_id'] for i in items],
+            self.conn.hmget(self.ATTEMPTS_KEY, [i['document_id'] for i in items]) if items else []
+        ))
+        updated_documents, success_ids, retries, dead_items, new_attempts = [], [], {}, [], {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self._complete, i, documents[i['document_id']]): i for i in items}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    ret = future.result()
+                except AbstractCompletionRateLimited:
+                    retries[json.dumps(item)] = time.time() + self.RATE_LIMITED_DELAY
+                    continue
+                except Exception as e:
+                    logger.warning(f'abstract completion error: {item}, {e}')
+                    item_attempts = int(attempts[item['document_id']] or 0) + 1
+                    if item_attempts >= self.max_attempts:
+                        dead_items.append(item)
+                        logger.error(f'abstract completion dead: {item}, attempts: {item_attempts}')
+                    else:
+                        new_attempts[item['document_id']] = item_attempts
+                        retries[json.dumps(item)] = time.time() + self.backoff(item_attempts)
+                    continue
+                success_ids.append(item['document_id'])
+                if ret and ret.get('abstract'):
+                    document = documents[item['document_id']]
+                    document.abstract = ret['abstract']
+                    updated_documents.append(document)
+        if updated_documents:
+            Document.objects.bulk_update(updated_documents, ['abstract'])
+        pipe = self.conn.pipeline()
+        if retries:
+            pipe.zadd(self.RETRY_KEY, retries)
+        if dead_items:
+            pipe.sadd(self.DEAD_KEY, *[json.dumps(i) for i in dead_items])
+        if new_attempts:
+            pipe.hset(self.ATTEMPTS_KEY, mapping=new_attempts)
+        if done_ids := success_ids + [i['document_id'] for i in dead_items]:
+            pipe.hdel(self.ATTEMPTS_KEY, *done_ids)
+        pipe.delete(self.PROCESSING_KEY)
+        pipe.execute()
+        return len(success_ids), len(new_attempts) + len(dead_items)
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0012_document_author_names_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentlibrary',
+            name='checksum',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
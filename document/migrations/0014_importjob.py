@@ -0,0 +1,48 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:08
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection', '0005_collectiondocument_doc_collection_id_and_more'),
+        ('document', '0013_documentlibrary_checksum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.CharField(default=uuid.uuid4, max_length=36, primary_key=True, serialize=False)),
+                ('source_collection_id', models.CharField(max_length=36, null=True)),
+                ('source_collection_type', models.CharField(max_length=32, null=True)),
+                ('doc_ids', models.JSONField(null=True)),
+                ('chunk_size', models.IntegerField(db_default=20, default=20)),
+                ('finished_chunks', models.JSONField(default=list)),
+                ('total', models.IntegerField(db_default=0, default=0)),
+                ('processed', models.IntegerField(db_default=0, default=0)),
+                ('add_num', models.IntegerField(db_default=0, default=0)),
+                ('skip_ids', models.JSONField(default=list)),
+                ('status', models.CharField(
+                    choices=[
+                        ('pending', 'pending'), ('in_progress', 'in_progress'), ('completed', 'completed'),
+                        ('error', 'error'),
+                    ],
+                    db_default='pending', db_index=True, default='pending', max_length=32)),
+                ('error', models.JSONField(null=True)),
+                ('del_flag', models.BooleanField(db_default=False, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('collection', models.ForeignKey(
+                    db_column='collection_id', db_constraint=False, null=True,
+                    on_delete=django.db.models.deletion.DO_NOTHING, to='collection.collection')),
+            ],
+            options={
+                'verbose_name': 'import_job',
+                'db_table': 'import_job',
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:09
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0014_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentRefreshJob',
+            fields=[
+                ('id', models.CharField(default=uuid.uuid4, max_length=36, primary_key=True, serialize=False)),
+                ('begin_doc_id', models.BigIntegerField(null=True)),
+                ('end_doc_id', models.BigIntegerField(null=True)),
+                ('cursor', models.CharField(max_length=36, null=True)),
+                ('batch_size', models.IntegerField(db_default=100, default=100)),
+                ('processed', models.IntegerField(db_default=0, default=0)),
+                ('updated_num', models.IntegerField(db_default=0, default=0)),
+                ('skip_num', models.IntegerField(db_default=0, default=0)),
+                ('status', models.CharField(
+                    choices=[('in_progress', 'in_progress'), ('completed', 'completed'), ('error', 'error')],
+                    db_default='in_progress', db_index=True, default='in_progress', max_length=32)),
+                ('error', models.JSONField(null=True)),
+                ('del_flag', models.BooleanField(db_default=False, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'document_refresh_job',
+                'db_table': 'document_refresh_job',
+            },
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='metadata_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:11
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0015_documentrefreshjob_document_metadata_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RagOutbox',
+            fields=[
+                ('id', models.CharField(default=uuid.uuid4, max_length=36, primary_key=True, serialize=False)),
+                ('action', models.CharField(
+                    choices=[
+                        ('delete_personal_paper', 'delete_personal_paper'),
+                        ('cancel_ingest_task', 'cancel_ingest_task'),
+                    ],
+                    max_length=64)),
+                ('payload', models.JSONField(null=True)),
+                ('status', models.CharField(
+                    choices=[
+                        ('pending', 'pending'), ('in_progress', 'in_progress'), ('completed', 'completed'),
+                        ('dead', 'dead'),
+                    ],
+                    db_default='pending', default='pending', max_length=32)),
+                ('attempts', models.IntegerField(db_default=0, default=0)),
+                ('next_retry_at', models.DateTimeField(null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('del_flag', models.BooleanField(db_default=False, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'rag_outbox',
+                'db_table': 'rag_outbox',
+                'index_together': {('status', 'next_retry_at')},
+            },
+        ),
+    ]
@@ -8,10 +8,11 @@ import uuid
 
 from citeproc import CitationStylesStyle, CitationStylesBibliography, formatter, Citation, CitationItem
 from citeproc.source.json import CiteProcJSON
-from django.db import models, connection
+from django.db import models, connection, transaction
 from django.utils.translation import gettext_lazy as _
 # from pybtex.database import BibliographyData, Entry
 
+from core.utils.model import raw_by_composite_keys
 from core.utils.statics import EN_FIRST_NAMES
 from django_redis import get_redis_connection
 
@@ -78,6 +79,8 @@ class Document(models.Model):
     object_path = models.CharField(null=True, blank=True, max_length=256)
     source_url = models.CharField(null=True, blank=True, max_length=256)
     checksum = models.CharField(null=True, blank=True, db_index=True, max_length=64)
+    # rag 文献信息的 hash，刷新时只更新有变化的记录
+    metadata_hash = models.CharField(null=True, blank=True, max_length=64)
     ref_collection_id = models.CharField(null=True, blank=True, db_index=True, max_length=36)
     ref_doc_id = models.BigIntegerField(null=True)
     del_flag = models.BooleanField(default=False, db_default=False)
@@ -88,13 +91,9 @@ class Document(models.Model):
     def raw_by_docs(docs, fileds='*', where=None):
         if not docs:
             return []
-        if fileds != '*' and isinstance(fileds, list):
-            fileds = ','.join(fileds)
-        doc_ids_str = ','.join([f"('{d['collection_id']}', {d['doc_id']})" for d in docs])
-        sql = f"SELECT {fileds} FROM document WHERE (collection_id, doc_id) IN ({doc_ids_str})"
-        if where:
-            sql += f"and {where}"
-        return Document.objects.raw(sql)
+        return raw_by_composite_keys(
+            Document, [('collection_id', 'text'), ('doc_id', 'bigint')],
+            [(d['collection_id'], d['doc_id']) for d in docs], fields=fileds, where=where)
 
     @staticmethod
     def raw_sql(sql):
@@ -501,6 +500,7 @@ class DocumentLibrary(models.Model):
     error = models.JSONField(null=True)
     filename = models.CharField(null=True, blank=True, max_length=512)
     object_path = models.CharField(null=True, blank=True, max_length=512)
+    checksum = models.CharField(null=True, blank=True, db_index=True, max_length=64)
     folder = models.ForeignKey(
         'DocumentLibraryFolder', db_constraint=False, on_delete=models.DO_NOTHING, db_column='folder_id',
         related_name='doc_lib_folder', null=True, default=None
@@ -533,6 +533,113 @@ class DocumentLibraryFolder(models.Model):
         verbose_name = 'document_library_folder'
 
 
+class ImportJob(models.Model):
+    """rag 文献批量导入收藏夹任务，按 chunk 并行执行"""
+    class StatusChoices(models.TextChoices):
+        PENDING = 'pending', _('pending')
+        IN_PROGRESS = 'in_progress', _('in_progress')
+        COMPLETED = 'completed', _('completed')
+        ERROR = 'error', _('error')
+
+    id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
+    collection = models.ForeignKey(
+        'collection.Collection', db_constraint=False, on_delete=models.DO_NOTHING, null=True, db_column='collection_id')
+    source_collection_id = models.CharField(null=True, max_length=36)
+    source_collection_type = models.CharField(null=True, max_length=32)
+    doc_ids = models.JSONField(null=True)
+    chunk_size = models.IntegerField(default=20, db_default=20)
+    # 已完成的 chunk 序号，任务中断后只重新执行未完成的 chunk
+    finished_chunks = models.JSONField(default=list)
+    total = models.IntegerField(default=0, db_default=0)
+    processed = models.IntegerField(default=0, db_default=0)
+    add_num = models.IntegerField(default=0, db_default=0)
+    skip_ids = models.JSONField(default=list)
+    status = models.CharField(
+        max_length=32, db_index=True, default=StatusChoices.PENDING, db_default=StatusChoices.PENDING,
+        choices=StatusChoices)
+    error = models.JSONField(null=True)
+    del_flag = models.BooleanField(default=False, db_default=False)
+    updated_at = models.DateTimeField(null=True, auto_now=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    @property
+    def chunks(self):
+        return [
+            (index, self.doc_ids[start:start + self.chunk_size])
+            for index, start in enumerate(range(0, len(self.doc_ids), self.chunk_size))
+        ]
+
+    class Meta:
+        db_table = 'import_job'
+        verbose_name = 'import_job'
+
+
+class DocumentRefreshJob(models.Model):
+    """从 rag 刷新 document 信息，按主键 keyset 分批执行，cursor 记录进度，中断后可继续"""
+    class StatusChoices(models.TextChoices):
+        IN_PROGRESS = 'in_progress', _('in_progress')
+        COMPLETED = 'completed', _('completed')
+        ERROR = 'error', _('error')
+
+    # in_progress 超过该时间未更新视为 worker 中断，可以 resume
+    STALE_SECONDS = 600
+
+    id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
+    # doc_id 范围，为空表示全部
+    begin_doc_id = models.BigIntegerField(null=True)
+    end_doc_id = models.BigIntegerField(null=True)
+    # 已处理的最大 document.id
+    cursor = models.CharField(null=True, max_length=36)
+    batch_size = models.IntegerField(default=100, db_default=100)
+    processed = models.IntegerField(default=0, db_default=0)
+    updated_num = models.IntegerField(default=0, db_default=0)
+    skip_num = models.IntegerField(default=0, db_default=0)
+    status = models.CharField(
+        max_length=32, db_index=True, default=StatusChoices.IN_PROGRESS, db_default=StatusChoices.IN_PROGRESS,
+        choices=StatusChoices)
+    error = models.JSONField(null=True)
+    del_flag = models.BooleanField(default=False, db_default=False)
+    updated_at = models.DateTimeField(null=True, auto_now=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    class Meta:
+        db_table = 'document_refresh_job'
+        verbose_name = 'document_refresh_job'
+
+
+class RagOutbox(models.Model):
+    """
+    需要调用 rag 的删除操作先写入 outbox，由 celery 定时任务并发执行，失败后按退避时间重试
+    """
+    class ActionChoices(models.TextChoices):
+        DELETE_PERSONAL_PAPER = 'delete_personal_paper', _('delete_personal_paper')
+        CANCEL_INGEST_TASK = 'cancel_ingest_task', _('cancel_ingest_task')
+
+    class StatusChoices(models.TextChoices):
+        PENDING = 'pending', _('pending')
+        IN_PROGRESS = 'in_progress', _('in_progress')
+        COMPLETED = 'completed', _('completed')
+        DEAD = 'dead', _('dead')
+
+    id = models.CharField(max_length=36, primary_key=True, default=uuid.uuid4)
+    action = models.CharField(max_length=64, choices=ActionChoices)
+    # delete_personal_paper: {collection_id, doc_id}; cancel_ingest_task: {task_id}
+    payload = models.JSONField(null=True)
+    status = models.CharField(
+        max_length=32, default=StatusChoices.PENDING, db_default=StatusChoices.PENDING, choices=StatusChoices)
+    attempts = models.IntegerField(default=0, db_default=0)
+    next_retry_at = models.DateTimeField(null=True)
+    error = models.TextField(null=True, blank=True)
+    del_flag = models.BooleanField(default=False, db_default=False)
+    updated_at = models.DateTimeField(null=True, auto_now=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    class Meta:
+        index_together = ['status', 'next_retry_at']
+        db_table = 'rag_outbox'
+        verbose_name = 'rag_outbox'
+
+
 def bulk_insert_ignore_duplicates(model: models.Model, data):
     table_name = model._meta.db_table
     columns = data[0].keys()
@@ -577,3 +684,92 @@ class SearchHistoryCache:
     def delete(self, content):
         self.conn.zrem(self.key, content)
         return True
+
+
+class DocumentLibraryCache:
+    """
+    用户个人库文献 document_id 集合缓存 (redis set)
+    key 带个人库版本号，个人库每次写入后 invalidate 版本号加 1，旧版本的集合不再被读取，等待过期
+    读取时先取版本号再查库，查库期间有写入时写入的集合落在旧版本上，不会读到过期数据
+    kind:
+        self: 本人可用 排队中 入库中 入库完成
+        completed: 入库完成 (非本人可用)
+        personal: 入库完成的个人上传文件
+    """
+    SELF = 'self'
+    COMPLETED = 'completed'
+    PERSONAL = 'personal'
+    KEY_PREFIX = 'doc_lib_ids'
+    EMPTY_MEMBER = '-'  # redis 不能保存空集合，用占位成员标记已加载
+    EXPIRES = 60 * 60
+
+    def __init__(self, user_id):
+        self.conn = get_redis_connection('default')
+        self.user_id = user_id
+
+    @classmethod
+    def _version_key(cls, user_id):
+        return f'{cls.KEY_PREFIX}:{user_id}:version'
+
+    @classmethod
+    def invalidate(cls, *user_ids):
+        """个人库写入后调用，在事务提交后更新版本号"""
+        user_ids = set(u_id for u_id in user_ids if u_id)
+        if not user_ids:
+            return
+
+        def _incr():
+            conn = get_redis_connection('default')
+            pipe = conn.pipeline()
+            for u_id in user_ids:
+                pipe.incr(cls._version_key(u_id))
+            pipe.execute()
+        transaction.on_commit(_incr)
+
+    def _kind_filter(self, kind):
+        if kind == self.SELF:
+            return {'task_status__in': [
+                DocumentLibrary.TaskStatusChoices.COMPLETED,
+                DocumentLibrary.TaskStatusChoices.PENDING,
+                DocumentLibrary.TaskStatusChoices.IN_PROGRESS,
+                DocumentLibrary.TaskStatusChoices.QUEUEING,
+            ]}
+        elif kind == self.COMPLETED:
+            return {'task_status': DocumentLibrary.TaskStatusChoices.COMPLETED}
+        else:
+            return {'task_status': DocumentLibrary.TaskStatusChoices.COMPLETED, 'filename__isnull': False}
+
+    def _load(self, kind):
+        """返回当前版本的集合 key，不存在时查库写入"""
+        version = int(self.conn.get(self._version_key(self.user_id)) or 0)
+        key = f'{self.KEY_PREFIX}:{self.user_id}:{version}:{kind}'
+        if self.conn.expire(key, self.EXPIRES):
+            return key
+        document_ids = DocumentLibrary.objects.filter(
+            user_id=self.user_id, del_flag=False, document_id__isnull=False, **self._kind_filter(kind)
+        ).values_list('document_id', flat=True).distinct()
+        pipe = self.conn.pipeline()
+        pipe.delete(key)
+        pipe.sadd(key, self.EMPTY_MEMBER)
+        document_ids = list(document_ids)
+        for i in range(0, len(document_ids), 1000):
+            pipe.sadd(key, *document_ids[i:i + 1000])
+        pipe.expire(key, self.EXPIRES)
+        pipe.execute()
+        return key
+
+    def members(self, kind=SELF):
+        key = self._load(kind)
+        return [m.decode() for m in self.conn.smembers(key) if m.decode() != self.EMPTY_MEMBER]
+
+    def contains(self, document_id, kind=SELF):
+        return bool(self.conn.sismember(self._load(kind), document_id))
+
+    def intersection(self, document_ids, kind=SELF):
+        """document_ids 中在个人库的文献"""
+        document_ids = list(set(d_id for d_id in document_ids if d_id))
+        if not document_ids:
+            return []
+        key = self._load(kind)
+        exists = self.conn.smismember(key, document_ids)
+        return [d_id for d_id, e in zip(document_ids, exists) if e]
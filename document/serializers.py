@@ -7,7 +7,7 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from collection.models import Collection
-from document.models import Document, DocumentLibrary
+from document.models import Document, DocumentLibrary, ImportJob, DocumentRefreshJob
 
 logger = logging.getLogger(__name__)
 
@@ -201,6 +201,8 @@ class DocumentRagUpdateSerializer(BaseModelSerializer):
 class DocumentUploadFileSerializer(serializers.Serializer):
     object_path = serializers.CharField(required=True, allow_blank=False, allow_null=False)
     filename = serializers.CharField(required=True, allow_blank=False, allow_null=False)
+    # 文件 sha256，有值时相同内容的文件不重复入库
+    checksum = serializers.RegexField(r'^[a-f0-9]{64}$', required=False, allow_null=True, default=None)
 
     def validate(self, attrs):
         filename = attrs.get('filename')
@@ -467,3 +469,24 @@ class ImportPapersToCollectionSerializer(serializers.Serializer):
             raise serializers.ValidationError('personal_collection_id is not exist')
 
         return attrs
+
+
+class ImportJobDetailSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    @staticmethod
+    def get_progress(obj: ImportJob):
+        return round(obj.processed / obj.total, 4) if obj.total else 1
+
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'collection_id', 'source_collection_id', 'source_collection_type', 'status', 'total',
+                  'processed', 'add_num', 'skip_ids', 'progress', 'error', 'updated_at', 'created_at']
+
+
+class DocumentRefreshJobDetailSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = DocumentRefreshJob
+        fields = ['id', 'begin_doc_id', 'end_doc_id', 'cursor', 'status', 'processed', 'updated_num', 'skip_num',
+                  'error', 'updated_at', 'created_at']
@@ -5,27 +5,35 @@ import uuid
 from collections import Counter
 
 import boto3
+from celery import chord
 from botocore.config import Config
 from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
 from django.db.models import Q, F
 from django.utils.translation import gettext_lazy as _
+from redis.exceptions import LockError
 
+from bot.base_service import bot_documents_refresh_by_collections
 from bot.models import BotSubscribe, Bot, BotCollection
 from bot.rag_service import Document as RagDocument
 from bot.rag_service import Authors as RagAuthors
-from collection.models import Collection, CollectionDocument
+from collection.base_service import collections_update_total_personal, CollectionResyncScheduler
+from collection.models import Collection, CollectionDocument, CollectionStats
 from collection.serializers import CollectionDocumentListSerializer
 from core.utils.common import str_hash
 from core.utils.date import str2date
 from core.utils.exceptions import ValidationError
 from document.base_service import document_update_from_rag_ret, update_document_lib, search_result_delete_cache, \
-    search_result_from_cache, search_result_cache_data
-from document.models import Document, DocumentLibrary, bulk_insert_ignore_duplicates
+    search_result_from_cache, search_result_cache_data, personal_upload_lock, personal_upload_duplicate, \
+    doc_lib_ref_counts, rag_outbox_add
+from document.models import Document, DocumentLibrary, ImportJob, DocumentRefreshJob, RagOutbox, \
+    DocumentLibraryCache, bulk_insert_ignore_duplicates
 from document.serializers import DocumentLibraryPersonalSerializer, DocLibAddQuerySerializer, \
-    DocumentLibraryListQuerySerializer, DocumentRagCreateSerializer, AuthorsDetailSerializer, SearchQuerySerializer
-from document.tasks import async_document_library_task, async_update_document, async_update_conversation_by_collection, \
-    update_document_library_task
+    DocumentLibraryListQuerySerializer, DocumentRagCreateSerializer, AuthorsDetailSerializer, SearchQuerySerializer, \
+    ImportJobDetailSerializer, DocumentRefreshJobDetailSerializer
+from document.tasks import async_document_library_task, async_update_document, async_import_job_chunk, \
+    async_import_job_complete, async_document_refresh_job, async_rag_outbox_task
 from vip.base_service import MemberTimeClock
 from vip.models import MemberUsageLog
 from vip.serializers import LimitCheckSerializer
@@ -524,77 +532,147 @@ def document_update_from_rag(collection_type, collection_id, doc_id):
     return document_update_from_rag_ret(doc_info)
 
 
-def documents_update_from_rag(begin_id, end_id):
-    documents = Document.objects.filter(doc_id__gte=begin_id, doc_id__lte=end_id).values_list(
-        'doc_id', 'collection_id', 'collection_type', named=True).all()
-    for d in documents:
-        document_update_from_rag(d.collection_type, d.collection_id, d.doc_id)
-        logger.info(f"success update doc_Id: {d.doc_id}")
-    return True
+def documents_update_from_rag(begin_id=None, end_id=None):
+    """从 rag 刷新 document 信息，doc_id 在 [begin_id, end_id] 范围内，为空表示全部"""
+    job = DocumentRefreshJob.objects.create(begin_doc_id=begin_id, end_doc_id=end_id)
+    async_document_refresh_job.apply_async(args=(job.id,))
+    return DocumentRefreshJobDetailSerializer(job).data
+
+
+def document_refresh_job_resume(job: DocumentRefreshJob):
+    """
+    任务出错或中断（in_progress 超时未更新）后从 cursor 继续
+    条件更新状态，正在执行的任务不会再派发一条并行的任务链
+    """
+    stale_at = datetime.datetime.now() - datetime.timedelta(seconds=DocumentRefreshJob.STALE_SECONDS)
+    resumed = DocumentRefreshJob.objects.filter(
+        Q(status=DocumentRefreshJob.StatusChoices.ERROR)
+        | Q(status=DocumentRefreshJob.StatusChoices.IN_PROGRESS, updated_at__lt=stale_at),
+        pk=job.id,
+    ).update(status=DocumentRefreshJob.StatusChoices.IN_PROGRESS, error=None, updated_at=datetime.datetime.now())
+    if resumed:
+        async_document_refresh_job.apply_async(args=(job.id,))
+    job.refresh_from_db()
+    return DocumentRefreshJobDetailSerializer(job).data
 
 
 def import_papers_to_collection(collection_papers):
+    """
+    rag 文献导入收藏夹：创建 ImportJob，按 chunk 拆分为 celery chord 并行执行，
+    所有 chunk 完成后回调统一更新收藏夹文献数
+    """
     info = collection_papers
-    personal_collection_id = info['personal_collection_id']
-    collection_type = info['collection_type']
-    collection_id = info['collection_id']
-    doc_ids = info['doc_ids']
-    num = len(doc_ids)
-    count = 0
-    c_doc_objs = []
-    add_num = 0
-    skip_ids = []
-    for doc_id in doc_ids:
-        try:
-            document = document_update_from_rag(collection_type, collection_id, doc_id)
-        except Exception as e:
-            logger.error(f"import_papers_to_collection error: {doc_id}, {e}")
-            skip_ids.append(doc_id)
-            continue
-        count += 1
-        c_doc_objs.append(CollectionDocument(
-            collection_id=personal_collection_id,
-            document_id=document.id,
-            full_text_accessible=True,
-            del_flag=False,
-        ))
-        coll_doc = {
-            'collection_id': personal_collection_id,
-            'document_id': document.id,
-            'full_text_accessible': True,
-            'del_flag': False,
-        }
-        collection, created = CollectionDocument.objects.update_or_create(
-            coll_doc, collection_id=personal_collection_id, document_id=document.id)
-        if created:
-            add_num += 1
-    if add_num:
-        collection = Collection.objects.filter(id=personal_collection_id).first()
-        collection.total_personal += add_num
-        collection.save()
-    return {
-        'total': num,
-        'add_num': add_num,
-        'skip_ids': skip_ids,
-        'id_list': doc_ids
-    }
+    doc_ids = list(dict.fromkeys(info['doc_ids']))
+    job = ImportJob.objects.create(
+        collection_id=info['personal_collection_id'],
+        source_collection_id=info['collection_id'],
+        source_collection_type=info['collection_type'],
+        doc_ids=doc_ids,
+        total=len(doc_ids),
+    )
+    import_job_dispatch(job)
+    # 兼容原接口返回的 total, add_num, skip_ids, id_list；add_num/skip_ids 为任务开始时的值，进度通过 job id 查询
+    return {**ImportJobDetailSerializer(job).data, 'id_list': doc_ids}
+
+
+def import_job_dispatch(job: ImportJob):
+    """派发未完成的 chunk，用于新建任务和中断后恢复"""
+    chunk_indexes = [index for index, _ in job.chunks if index not in job.finished_chunks]
+    if not chunk_indexes:
+        async_import_job_complete.apply_async(args=([], job.id))
+        return job
+    job.status = ImportJob.StatusChoices.IN_PROGRESS
+    job.error = None
+    job.save()
+    chord(
+        async_import_job_chunk.s(job.id, index) for index in chunk_indexes
+    )(async_import_job_complete.s(job.id))
+    return job
+
+
+def import_job_progress(job: ImportJob):
+    return ImportJobDetailSerializer(job).data
 
 
 def update_exist_documents():
-    page_size = 200
-    page_num = 1
-    documents = Document.objects.filter(del_flag=False).values(
-        'collection_type', 'doc_id', 'collection_id').order_by(
-        'updated_at')[page_size * (page_num - 1):page_size * page_num]
-    while documents:
-        logger.debug(f'ddddddddd page_size: {page_size}, page_num: {page_num}')
-        for d in documents:
-            document_update_from_rag(d['collection_type'], d['collection_id'], d['doc_id'])
-            logger.debug(f"ddddddddd success update doc_id: {d['doc_id']}")
-        page_num += 1
-        documents = Document.objects.filter(del_flag=False).values(
-            'collection_type', 'doc_id', 'collection_id').order_by(
-            'updated_at')[page_size * (page_num - 1):page_size * page_num]
+    return documents_update_from_rag()
+
+
+def _personal_upload_filename(user_id, filename):
+    filename_count = DocumentLibrary.objects.filter(
+        filename__startswith=filename, user_id=user_id, del_flag=False).count()
+    return f"{filename}({filename_count})" if filename_count else filename
+
+
+def _personal_upload_ingest(user_id, file, openapi_key_id=None):
+    doc_lib_data = {
+        'user_id': user_id,
+        'filename': _personal_upload_filename(user_id, file['filename']),
+        'object_path': file['object_path'],
+        'checksum': file.get('checksum'),
+        'del_flag': False,
+        'task_status': DocumentLibrary.TaskStatusChoices.PENDING,
+        'task_type': Document.TypeChoices.PERSONAL,
+        'task_id': None,
+        'error': None,
+    }
+    try:
+        rag_ret = RagDocument.ingest_personal_paper(user_id, file['object_path'], file.get('checksum'))
+        doc_lib_data['task_id'] = rag_ret['task_id']
+        doc_lib_data['task_status'] = (
+            rag_ret['task_status']
+            if rag_ret['task_status'] != DocumentLibrary.TaskStatusChoices.COMPLETED
+            else DocumentLibrary.TaskStatusChoices.IN_PROGRESS
+        )
+        if doc_lib_data['task_status'] == DocumentLibrary.TaskStatusChoices.ERROR:
+            doc_lib_data['error'] = {'error_code': rag_ret['error_code'], 'error_message': rag_ret['error_message']}
+    except Exception as e:
+        logger.warning(f"RagDocument.ingest_personal_paper error: {e}")
+    instance, _ = DocumentLibrary.objects.update_or_create(
+        doc_lib_data, user_id=user_id, filename=file['filename'], object_path=file['object_path'])
+    DocumentLibraryCache.invalidate(user_id)
+    # add record to MemberUsageLog
+    clock_time = MemberTimeClock.get_member_time_clock(user_id)
+    if clock_time:
+        now = clock_time
+    else:
+        now = datetime.datetime.now()
+    member_ul = MemberUsageLog.objects.create(
+        user_id=user_id,
+        openapi_key_id=openapi_key_id,
+        type=MemberUsageLog.UType.EMBEDDING,
+        obj_id1=instance.id,
+        obj_id2=instance.task_id,
+        status=MemberUsageLog.Status.UNKNOWN,
+        created_at=now,
+    )
+    if clock_time:
+        MemberUsageLog.objects.filter(id=member_ul.id).update(created_at=now)
+    return instance
+
+
+def _personal_upload_link_duplicate(user_id, file, duplicate: DocumentLibrary):
+    """
+    相同内容文件已上传过：新记录共用已有的 task/document/object_path，不再调用 rag 入库，不计入 embedding 用量
+    入库中的任务完成后 update_document_library_task 会按 task_id 同步更新所有共用的记录
+    """
+    logger.info(f'personal upload duplicate, user_id: {user_id}, checksum: {file["checksum"]}, '
+                f'doc_lib: {duplicate.id}, task_id: {duplicate.task_id}')
+    instance = DocumentLibrary.objects.create(
+        user_id=user_id,
+        filename=_personal_upload_filename(user_id, file['filename']),
+        object_path=duplicate.object_path,
+        checksum=duplicate.checksum,
+        document_id=duplicate.document_id,
+        doc_id=duplicate.doc_id,
+        collection_id=duplicate.collection_id,
+        task_type=Document.TypeChoices.PERSONAL,
+        task_id=duplicate.task_id,
+        task_status=duplicate.task_status,
+        error=None,
+    )
+    DocumentLibraryCache.invalidate(user_id)
+    return instance
 
 
 def document_personal_upload(validated_data):
@@ -602,7 +680,9 @@ def document_personal_upload(validated_data):
     files = vd.get('files')
     openapi_key_id = vd.get('openapi_key_id')
     instances = []
-    document_count = len(files)
+    # 重复文件不入库、不计入 embedding 用量
+    document_count = len([
+        f for f in files if not (f.get('checksum') and personal_upload_duplicate(vd['user_id'], f['checksum']))])
     limit_info = LimitCheckSerializer.embedding_limit(vd['user_id'])
     if limit_info['daily'] and limit_info['daily'] < limit_info['used_day'] + document_count:
         return 130006, 'exceed day limit', {
@@ -614,52 +694,27 @@ def document_personal_upload(validated_data):
         }
 
     for file in files:
-        doc_lib_data = {
-            'user_id': vd['user_id'],
-            'filename': file['filename'],
-            'object_path': file['object_path'],
-            'del_flag': False,
-            'task_status': DocumentLibrary.TaskStatusChoices.PENDING,
-            'task_type': Document.TypeChoices.PERSONAL,
-            'task_id': None,
-            'error': None,
-        }
-        filename_count = DocumentLibrary.objects.filter(
-            filename__startswith=file['filename'], user_id=vd['user_id'], del_flag=False).count()
-        if filename_count:
-            doc_lib_data['filename'] = f"{file['filename']}({filename_count})"
-        try:
-            rag_ret = RagDocument.ingest_personal_paper(vd['user_id'], file['object_path'])
-            doc_lib_data['task_id'] = rag_ret['task_id']
-            doc_lib_data['task_status'] = (
-                rag_ret['task_status']
-                if rag_ret['task_status'] != DocumentLibrary.TaskStatusChoices.COMPLETED
-                else DocumentLibrary.TaskStatusChoices.IN_PROGRESS
-            )
-            if doc_lib_data['task_status'] == DocumentLibrary.TaskStatusChoices.ERROR:
-                doc_lib_data['error'] = {'error_code': rag_ret['error_code'], 'error_message': rag_ret['error_message']}
-        except Exception as e:
-            logger.warning(f"RagDocument.ingest_personal_paper error: {e}")
-        instance, _ = DocumentLibrary.objects.update_or_create(
-            doc_lib_data, user_id=vd['user_id'], filename=file['filename'], object_path=file['object_path'])
-        instances.append(instance)
-        # add record to MemberUsageLog
-        clock_time = MemberTimeClock.get_member_time_clock(vd['user_id'])
-        if clock_time:
-            now = clock_time
+        if checksum := file.get('checksum'):
+            lock = personal_upload_lock(vd['user_id'], checksum)
+            if not lock.acquire():
+                # 等锁超时按普通上传入库
+                logger.warning(f'personal upload lock timeout, user_id: {vd["user_id"]}, checksum: {checksum}')
+                instance = _personal_upload_ingest(vd['user_id'], file, openapi_key_id)
+            else:
+                try:
+                    if duplicate := personal_upload_duplicate(vd['user_id'], checksum):
+                        instance = _personal_upload_link_duplicate(vd['user_id'], file, duplicate)
+                    else:
+                        instance = _personal_upload_ingest(vd['user_id'], file, openapi_key_id)
+                finally:
+                    try:
+                        lock.release()
+                    except LockError as e:
+                        # 处理超过锁的有效期，锁已过期
+                        logger.warning(f'personal upload lock release error, checksum: {checksum}, {e}')
         else:
-            now = datetime.datetime.now()
-        member_ul = MemberUsageLog.objects.create(
-            user_id=vd['user_id'],
-            openapi_key_id=openapi_key_id,
-            type=MemberUsageLog.UType.EMBEDDING,
-            obj_id1=instance.id,
-            obj_id2=instance.task_id,
-            status=MemberUsageLog.Status.UNKNOWN,
-            created_at=now,
-        )
-        if clock_time:
-            MemberUsageLog.objects.filter(id=member_ul.id).update(created_at=now)
+            instance = _personal_upload_ingest(vd['user_id'], file, openapi_key_id)
+        instances.append(instance)
     return 0, 'success', instances
 
 
@@ -696,31 +751,29 @@ def document_library_add(
     elif add_type == DocLibAddQuerySerializer.AddTypeChoices.COLLECTION_ARXIV:
         coll_documents, d1, d2, _ = CollectionDocumentListSerializer.get_collection_documents(
             user_id, collection_ids, 'arxiv')
-        all_document_ids = [d['document_id'] for d in coll_documents.all()] if coll_documents else []
+        all_document_ids = coll_documents.values('document_id')
     elif add_type == DocLibAddQuerySerializer.AddTypeChoices.COLLECTION_S2:
         coll_documents, d1, d2, _ = CollectionDocumentListSerializer.get_collection_documents(
             user_id, collection_ids, 's2')
-        all_document_ids = [d['document_id'] for d in coll_documents.all()] if coll_documents else []
+        all_document_ids = coll_documents.values('document_id')
     elif add_type == DocLibAddQuerySerializer.AddTypeChoices.COLLECTION_SUBSCRIBE_FULL_TEXT:
         coll_documents, d1, d2, _ = CollectionDocumentListSerializer.get_collection_documents(
             user_id, collection_ids, 'subscribe_full_text', bot)
-        all_document_ids = [d['document_id'] for d in coll_documents.all()] if coll_documents else []
+        all_document_ids = coll_documents.values('document_id')
     elif add_type == DocLibAddQuerySerializer.AddTypeChoices.COLLECTION_DOCUMENT_LIBRARY:
         if bot_id:
             collections = BotCollection.objects.filter(bot_id=bot_id, del_flag=False).values('collection_id').all()
             collection_ids += [c['collection_id'] for c in collections]
         coll_documents, d1, d2, _ = CollectionDocumentListSerializer.get_collection_documents(
             user_id, collection_ids, 'document_library')
-        all_document_ids = [d['document_id'] for d in coll_documents.all()] if coll_documents else []
+        all_document_ids = coll_documents.values('document_id')
     elif add_type == DocLibAddQuerySerializer.AddTypeChoices.COLLECTION_ALL:
         if bot_id:
             collections = BotCollection.objects.filter(bot_id=bot_id, del_flag=False).values('collection_id').all()
             collection_ids += [c['collection_id'] for c in collections]
         coll_documents, d1, d2, ref_ds = CollectionDocumentListSerializer.get_collection_documents(
             user_id, collection_ids, 'all', bot)
-        all_document_ids = [d['document_id'] for d in coll_documents.all()] if coll_documents else []
-        if ref_ds:
-            all_document_ids += ref_ds
+        all_document_ids = coll_documents.values('document_id')
     else:
         # get document_ids
         is_all = False
@@ -734,17 +787,16 @@ def document_library_add(
             collections = Collection.objects.filter(
                 id__in=collection_ids, del_flag=False, type=Collection.TypeChoices.PERSONAL).values('id').all()
             collection_ids = [c['id'] for c in collections]
-            coll_document = CollectionDocument.objects.filter(
-                collection__id__in=collection_ids, del_flag=False).values('document_id').all()
-            all_document_ids = [d['document_id'] for d in coll_document]
-    if not document_ids:
-        document_ids = all_document_ids
-    else:
-        document_ids = list(set(all_document_ids) - set(document_ids)) \
-            if is_all else list(set(document_ids + all_document_ids))
+            all_document_ids = CollectionDocument.objects.filter(
+                collection__id__in=collection_ids, del_flag=False).values('document_id')
+    # 收藏夹文献集合作为子查询，不取出 id 列表
+    filter_query = Q(id__in=all_document_ids)
+    if document_ids:
+        filter_query = filter_query & ~Q(id__in=document_ids) if is_all else filter_query | Q(id__in=document_ids)
     # document_ids = _get_public_document_ids(user_id, document_ids)
     if ref_ds:
-        document_ids = list(set(document_ids) | set(ref_ds))
+        filter_query |= Q(id__in=ref_ds)
+    document_ids = Document.objects.filter(filter_query).values('id')
     code, msg, data = update_document_lib(user_id, document_ids, keyword=keyword)
     if code == 0:
         async_document_library_task.apply_async()
@@ -830,56 +882,60 @@ def document_library_delete(user_id, ids, list_type, keyword=None):
         filter_query &= (Q(document_title__icontains=keyword) | Q(filename__icontains=keyword))
     doc_libs = DocumentLibrary.objects.filter(filter_query)
     all_doc_libs = doc_libs.all()
-    user_per_document_ids = [doclib.document_id for doclib in all_doc_libs if doclib.document_id and doclib.filename]
+    all_doc_lib_ids = [doclib.id for doclib in all_doc_libs]
+    # 相同内容去重上传的记录共用 document/task，仍有其他记录引用时不删除 document，不取消 task
+    document_ref_counts = doc_lib_ref_counts(
+        'document_id', [doclib.document_id for doclib in all_doc_libs if doclib.filename], all_doc_lib_ids)
+    task_ref_counts = doc_lib_ref_counts(
+        'task_id', [doclib.task_id for doclib in all_doc_libs if doclib.filename], all_doc_lib_ids)
+    user_per_document_ids = list(set([
+        doclib.document_id for doclib in all_doc_libs
+        if doclib.document_id and doclib.filename and not document_ref_counts.get(doclib.document_id)
+    ]))
     user_pub_doc_ids = [doclib.document_id for doclib in all_doc_libs if doclib.task_type == 'public']
-    in_progress_document_libs = [doclib for doclib in all_doc_libs if doclib.task_status in ['in_progress', 'queueing']]
-    # delete CollectionDocument
-    user_collections = Collection.objects.filter(user_id=user_id, del_flag=False).values('id').all()
-    user_collection_ids = [c['id'] for c in user_collections]
-    for coll_id in user_collection_ids:
-        effect_num = CollectionDocument.objects.filter(
-            document_id__in=user_per_document_ids,
-            collection_id=coll_id,
-        ).update(del_flag=True)
-        if effect_num:
-            coll_documents_total = CollectionDocument.objects.filter(collection_id=coll_id, del_flag=False).count()
-            Collection.objects.filter(id=coll_id).update(total_personal=coll_documents_total)
-            async_update_conversation_by_collection.apply_async(args=(coll_id,))
+    in_progress_document_libs = [
+        doclib for doclib in all_doc_libs
+        if doclib.task_status in ['in_progress', 'queueing'] and not task_ref_counts.get(doclib.task_id)
+    ]
+    # 共用 task 的记录只需取消一次
+    in_progress_document_libs = list({doclib.task_id: doclib for doclib in in_progress_document_libs}.values())
+    # delete CollectionDocument, 一条 UPDATE 重新统计受影响收藏夹的文献数
+    user_collection_ids = list(
+        Collection.objects.filter(user_id=user_id, del_flag=False).values_list('id', flat=True))
+    effect_coll_doc_query = CollectionDocument.objects.filter(
+        collection_id__in=user_collection_ids, document_id__in=user_per_document_ids, del_flag=False)
+    effect_coll_ids = list(effect_coll_doc_query.values_list('collection_id', flat=True).distinct())
     effect_pub_coll_ids = CollectionDocument.objects.filter(
         collection_id__in=user_collection_ids, document_id__in=user_pub_doc_ids
     ).values_list('collection_id', flat=True).distinct('collection_id').all()
-    for coll_id in effect_pub_coll_ids:
-        async_update_conversation_by_collection.apply_async(args=(coll_id,))
-
-    # delete Document
-    Document.objects.filter(id__in=user_per_document_ids, collection_id=user_id).update(del_flag=True)
-    # todo rag delete
-    to_del_documents = Document.objects.filter(
-        id__in=user_per_document_ids, collection_type=Document.TypeChoices.PERSONAL
-    ).values('id', 'collection_id', 'doc_id').all()
-    for document in to_del_documents:
-        RagDocument.delete_personal_paper(document['collection_id'], document['doc_id'])
-    failed_tasks = []
-    for task in in_progress_document_libs:
-        new_task, task_result = update_document_library_task(task)
-        if new_task:
-            if new_task.task_status == DocumentLibrary.TaskStatusChoices.COMPLETED and task.task_type == 'personal':
-                RagDocument.delete_personal_paper(task_result['paper']['collection_id'], task_result['paper']['doc_id'])
-            elif new_task.task_status in [
-                DocumentLibrary.TaskStatusChoices.IN_PROGRESS, DocumentLibrary.TaskStatusChoices.PENDING
-            ]:
-                RagDocument.cancel_ingest_task(task.task_id)
-        else:
-            failed_tasks.append(task)
+    with transaction.atomic():
+        if effect_coll_ids:
+            effect_coll_doc_query.update(del_flag=True)
+            collections_update_total_personal(effect_coll_ids)
+        # delete Document
+        Document.objects.filter(id__in=user_per_document_ids, collection_id=user_id).update(del_flag=True)
+        # rag 删除/取消任务写入 outbox，由 async_rag_outbox_task 异步执行并重试
+        to_del_documents = Document.objects.filter(
+            id__in=user_per_document_ids, collection_type=Document.TypeChoices.PERSONAL
+        ).values('collection_id', 'doc_id').all()
+        rag_outbox_add(RagOutbox.ActionChoices.DELETE_PERSONAL_PAPER, [
+            {'collection_id': d['collection_id'], 'doc_id': d['doc_id']} for d in to_del_documents
+        ])
+        rag_outbox_add(RagOutbox.ActionChoices.CANCEL_INGEST_TASK, [
+            {'task_id': doc_lib.task_id, 'task_type': doc_lib.task_type}
+            for doc_lib in in_progress_document_libs if doc_lib.task_id
+        ])
+        # delete DocumentLibrary
+        effected_num = DocumentLibrary.objects.filter(id__in=all_doc_lib_ids).update(del_flag=True)
+        DocumentLibraryCache.invalidate(user_id)
+        CollectionStats.refresh(set(effect_coll_ids) | set(effect_pub_coll_ids))
+        transaction.on_commit(lambda: async_rag_outbox_task.apply_async())
+
+    bot_documents_refresh_by_collections(effect_coll_ids)
+    CollectionResyncScheduler().mark(*(set(effect_coll_ids) | set(effect_pub_coll_ids)))
     # delete search cache when delete personal document_library
     if user_per_document_ids:
         search_result_delete_cache(user_id)
-    # delete DocumentLibrary
-    effected_num = doc_libs.update(del_flag=True)
-    for failed_task in failed_tasks:
-        failed_task.del_flag = False
-        failed_task.save()
-        effected_num -= 1
     return effected_num
 
 
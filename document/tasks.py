@@ -1,25 +1,30 @@
 import datetime
 import logging
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from celery import shared_task
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction, connection
+from django.db.models import Q, F
 # from django_db_geventpool.utils import close_connection
 
-from bot.base_service import recreate_bot, bot_detail, bot_documents
-from bot.models import BotCollection, Bot
+from bot.base_service import sync_bot, bot_documents_refresh, bot_publish_sweep, bot_log_snapshot_id, is_subscribed, \
+    bot_publish_outbox_process, bot_publish_outbox_wake, bot_preset_answers_refresh
+from bot.models import BotCollection, Bot, BotDocument
 from bot.rag_service import Document as RagDocument
-from chat.models import Conversation, Question, ConversationShare
+from chat.models import Conversation, Question, ConversationShare, ConversationCollection, QuestionReference
 from chat.serializers import QuestionListSerializer
-from collection.base_service import update_conversation_by_collection
-from collection.models import Collection
-from collection.serializers import bot_subscribe_personal_document_num
+from collection.base_service import update_conversation_by_collection, collection_stats_reconcile, \
+    CollectionResyncScheduler
+from collection.models import Collection, CollectionDocument, CollectionStats
 from document.base_service import document_update_from_rag_ret, reference_doc_to_document, \
-    reference_doc_to_document_library, search_result_delete_cache
-from document.models import DocumentLibrary, Document
+    reference_doc_to_document_library, search_result_delete_cache, rag_documents_fetch, \
+    documents_bulk_upsert_from_rag_rets, rag_documents_get_many, AbstractCompletionQueue, rag_outbox_process
+from document.models import DocumentLibrary, Document, ImportJob, DocumentRefreshJob, DocumentLibraryCache
 from openapi.base_service import update_openapi_log_upload_status
 from openapi.models import OpenapiLog
 from user.models import UserOperationLog
+from user.service import UserOperationLogQueue
 from vip.base_service import daily_duration_award, MemberTimeClock
 from vip.models import MemberUsageLog
 
@@ -37,7 +42,7 @@ def async_document_library_task(self, task_id=None):
             if not i.filename:
                 rag_ret = RagDocument.ingest_public_paper(i.user_id, i.document.collection_id, i.document.doc_id)
             else:
-                rag_ret = RagDocument.ingest_personal_paper(i.user_id, i.object_path)
+                rag_ret = RagDocument.ingest_personal_paper(i.user_id, i.object_path, i.checksum)
             i.task_id = rag_ret['task_id']
             i.task_status = (
                 rag_ret['task_status']
@@ -47,6 +52,7 @@ def async_document_library_task(self, task_id=None):
             if i.task_status == DocumentLibrary.TaskStatusChoices.ERROR:
                 i.error = {'error_code': rag_ret['error_code'], 'error_message': rag_ret['error_code']}
             i.save()
+            DocumentLibraryCache.invalidate(i.user_id)
             if i.task_status != DocumentLibrary.TaskStatusChoices.ERROR:
                 # add record to MemberUsageLog
                 clock_time = MemberTimeClock.get_member_time_clock(i.user_id)
@@ -70,8 +76,16 @@ def async_document_library_task(self, task_id=None):
         DocumentLibrary.TaskStatusChoices.IN_PROGRESS, DocumentLibrary.TaskStatusChoices.QUEUEING,
         DocumentLibrary.TaskStatusChoices.TO_BE_CANCELLED
     ]).all():
+        ref_finished = False
         for i in instances:
-            update_document_library_task(i)
+            doc_lib, _ = update_document_library_task(i)
+            if doc_lib and doc_lib.user_id == '0000' and doc_lib.task_status in [
+                DocumentLibrary.TaskStatusChoices.COMPLETED, DocumentLibrary.TaskStatusChoices.ERROR
+            ]:
+                ref_finished = True
+        # 公共库文献入库完成，唤醒等待中的专题发布
+        if ref_finished and bot_publish_outbox_wake():
+            async_bot_publish_dispatch.apply_async()
     return True
 
 
@@ -112,6 +126,12 @@ def update_document_library_task(doc_lib: DocumentLibrary):
             return doc_lib, rag_ret
     doc_lib.task_status = task_status
     doc_lib.save()
+    DocumentLibraryCache.invalidate(doc_lib.user_id)
+    if (
+        doc_lib.document_id and doc_lib.task_status in [
+            DocumentLibrary.TaskStatusChoices.ERROR, DocumentLibrary.TaskStatusChoices.CANCELLED]
+    ):
+        CollectionStats.refresh_by_documents(doc_lib.user_id, [doc_lib.document_id])
     if doc_lib.task_status == DocumentLibrary.TaskStatusChoices.COMPLETED and doc_lib.task_type == 'personal':
         search_result_delete_cache(doc_lib.user_id)
     return doc_lib, rag_ret
@@ -126,23 +146,43 @@ def _update_member_usage_upload_status(obj_id1, obj_id2, status):
 @shared_task(bind=True)
 # @close_connection
 def async_schedule_publish_bot_task(self, task_id=None):
-    logger.info(f'xxxxx async_schedule_publish_bot_task, {self}, {task_id}')
-    bots = Bot.objects.filter(type=Bot.TypeChoices.IN_PROGRESS).all()
-    for bot in bots:
-        personal_documents, ref_documents = bot_subscribe_personal_document_num(
-            bot.user_id, bot_collections=None, bot=bot)
-        ref_result_count = DocumentLibrary.objects.filter(
-            user_id='0000', document_id__in=ref_documents,
-            task_status__in=[DocumentLibrary.TaskStatusChoices.ERROR, DocumentLibrary.TaskStatusChoices.COMPLETED],
-        ).count()
-        if ref_result_count == len(ref_documents):
-            bot.type = Bot.TypeChoices.PUBLIC
-            bot.pub_date = datetime.datetime.now()
-            bot.save()
-        logger.info(f"async_schedule_publish_bot_task, {bot.id}, bot.type: {bot.type}")
+    """
+    兜底：补写遗漏的发布 outbox 并执行
+    """
+    added_num = bot_publish_sweep()
+    if added_num:
+        logger.warning(f'async_schedule_publish_bot_task added outbox: {added_num}')
+    async_bot_publish_dispatch.apply_async()
     return True
 
 
+@shared_task(bind=True, time_limit=300, soft_time_limit=240)
+# @close_connection
+def async_bot_publish_dispatch(self, max_batches=5):
+    for _ in range(max_batches):
+        published_bot_ids, waiting_num = bot_publish_outbox_process()
+        logger.info(f'async_bot_publish_dispatch published: {published_bot_ids}, waiting: {waiting_num}')
+        for bot_id in published_bot_ids:
+            async_bot_preset_answers.apply_async(args=[bot_id])
+        if not published_bot_ids and not waiting_num:
+            break
+    return True
+
+
+@shared_task(bind=True, time_limit=1800, soft_time_limit=1500)
+# @close_connection
+def async_bot_preset_answers(self, bot_id):
+    """
+    预先问答公开专题的预置问题
+    """
+    bot = Bot.objects.filter(pk=bot_id).first()
+    if not bot:
+        return 0
+    refreshed_num = bot_preset_answers_refresh(bot)
+    logger.info(f'async_bot_preset_answers bot_id: {bot_id}, refreshed: {refreshed_num}')
+    return refreshed_num
+
+
 @shared_task(bind=True)
 # @close_connection
 def async_update_document(self, document_ids, rag_search_documents=None):
@@ -177,8 +217,11 @@ def async_update_document(self, document_ids, rag_search_documents=None):
                     need_update = True
                 setattr(temp_document, f, data[f])
         if need_update:
+            # 只写入了部分字段，与 rag 不一定一致，清空 metadata_hash 让刷新任务重新写入
+            temp_document.metadata_hash = None
             update_documents.append(temp_document)
-    Document.objects.bulk_update(documents, fileds)
+    Document.objects.bulk_update(documents, fileds + ['metadata_hash'])
+    BotDocument.sync_titles([d.id for d in update_documents])
     logger.info(f'async_update_document end, documents len: {len(documents)}, update len: {len(update_documents)}')
     return True
 
@@ -204,6 +247,30 @@ def async_update_conversation_by_collection(self, collection_id):
     """
     收藏夹有调整 更新相关问答 和专题
     """
+    return collection_resync(collection_id)
+
+
+@shared_task(bind=True, time_limit=300, soft_time_limit=240)
+# @close_connection
+def async_collection_resync_sweep(self, limit=100):
+    """
+    处理防抖到期的收藏夹，每个收藏夹只同步一次
+    同步成功后 ack，失败重新 mark 后 ack；worker 中断未 ack 的租约过期后由下一次 sweep 重新取出
+    """
+    scheduler = CollectionResyncScheduler()
+    collection_ids = scheduler.claim_due(limit)
+    for collection_id in collection_ids:
+        try:
+            collection_resync(collection_id)
+        except Exception as e:
+            logger.error(f'async_collection_resync_sweep error, collection_id: {collection_id}, {e}')
+            scheduler.mark(collection_id)
+        scheduler.ack(collection_id)
+    logger.info(f'async_collection_resync_sweep collection_ids: {collection_ids}')
+    return len(collection_ids)
+
+
+def collection_resync(collection_id):
     collection_query = BotCollection.objects.filter(collection_id=collection_id)
     collection = Collection.objects.filter(pk=collection_id).first()
     if collection:
@@ -216,16 +283,35 @@ def async_update_conversation_by_collection(self, collection_id):
                 bot_id=bot.id, del_flag=False).values_list('collection_id', flat=True).all()
             collections = Collection.objects.filter(id__in=bot_collections, del_flag=False).all()
             old_agent_id = bot.agent_id
-            recreate_bot(bot, collections)
+            sync_bot(bot, collections)
             bot.save()
-            Conversation.objects.filter(agent_id=old_agent_id).update(agent_id=bot.agent_id)
-
-        conversations = Conversation.objects.filter(collections__contains=collection_id, del_flag=False).all()
-        for conv in conversations:
-            all_collections = list(
-                set(conv.collections if conv.collections else [])
-                | set(conv.public_collection_ids if conv.public_collection_ids else []))
-            update_conversation_by_collection(collection.user_id, conv, all_collections)
+            if old_agent_id != bot.agent_id:
+                Conversation.objects.filter(agent_id=old_agent_id).update(agent_id=bot.agent_id)
+            if bot.type == Bot.TypeChoices.PUBLIC:
+                async_bot_preset_answers.apply_async(args=[bot.id])
+
+        conversations = Conversation.objects.filter(
+            id__in=ConversationCollection.objects.filter(collection_id=collection_id).values('conversation_id'),
+            del_flag=False
+        ).all()
+
+        def _update(conv):
+            try:
+                all_collections = list(
+                    set(conv.collections if conv.collections else [])
+                    | set(conv.public_collection_ids if conv.public_collection_ids else []))
+                update_conversation_by_collection(collection.user_id, conv, all_collections)
+            finally:
+                connection.close()
+
+        # 有限并发请求 rag
+        with ThreadPoolExecutor(max_workers=settings.COLLECTION_RESYNC_CONCURRENCY) as executor:
+            futures = {executor.submit(_update, conv): conv.id for conv in conversations}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f'collection_resync error, conversation_id: {futures[future]}, {e}')
     return True
 
 
@@ -237,15 +323,18 @@ def async_add_user_operation_log(
     """
     添加用户操作日志
     """
-    result = None
+    result, snapshot_id = None, None
     if operation_type == UserOperationLog.OperationType.BOT_DETAIL:
-        # 保存 bot detail 到 result
-        result = _bot_detail_to_log(user_id, obj_id1)
+        # 专题快照去重存储，日志只记录 snapshot_id
+        if bot := Bot.objects.filter(pk=obj_id1).first():
+            snapshot_id = bot_log_snapshot_id(bot)
+            result = {'subscribed': is_subscribed(user_id, bot)}
     operation_log = UserOperationLog.objects.create(
         user_id=user_id,
         operation_type=operation_type,
         operation_content=operation_content,
         result=result,
+        snapshot_id=snapshot_id,
         obj_id1=obj_id1,
         obj_id2=obj_id2,
         obj_id3=obj_id3,
@@ -255,14 +344,82 @@ def async_add_user_operation_log(
     return True
 
 
-def _bot_detail_to_log(user_id, bot_id):
-    bot = Bot.objects.filter(pk=bot_id).first()
-    detail = bot_detail(user_id, bot)
-    documents = bot_documents(user_id, bot, 'all', 2000, 1)
-    return {
-        'bot_detail': detail,
-        'documents': documents,
-    }
+@shared_task(bind=True, time_limit=300, soft_time_limit=240)
+# @close_connection
+def async_flush_user_operation_log(self, batch_size=5000, max_batches=10):
+    """
+    批量写入用户操作日志队列，单个 flusher 执行
+    同一批写入失败超过 MAX_ATTEMPTS 次后逐条写入，写入失败的事件移到 dead，不再阻塞后续日志
+    """
+    queue = UserOperationLogQueue()
+    lock = queue.lock()
+    if not lock.acquire():
+        return 0
+    flushed_num, dead_num = 0, 0
+    try:
+        for _ in range(max_batches):
+            if not (events := queue.claim(batch_size)):
+                break
+            if queue.attempt() > queue.MAX_ATTEMPTS:
+                dead_events = []
+                for e in events:
+                    try:
+                        user_operation_logs_bulk_create([e])
+                    except Exception as ex:
+                        logger.error(f'async_flush_user_operation_log dead event: {e}, {ex}')
+                        dead_events.append(e)
+                dead_num += queue.dead(dead_events)
+            else:
+                user_operation_logs_bulk_create(events)
+            queue.ack()
+            flushed_num += len(events)
+    finally:
+        lock.release()
+    logger.info(f'async_flush_user_operation_log flushed: {flushed_num}, dead: {dead_num}')
+    return flushed_num
+
+
+def user_operation_logs_bulk_create(events):
+    """
+    按事件 id 写入，重复的事件忽略；专题详情快照每个专题只计算一次
+    created_at 取事件写入队列的时间
+    """
+    bot_ids = set(e['obj_id1'] for e in events if e['operation_type'] == UserOperationLog.OperationType.BOT_DETAIL)
+    bots = Bot.objects.in_bulk(list(bot_ids)) if bot_ids else {}
+    snapshot_ids = {bot_id: bot_log_snapshot_id(bot) for bot_id, bot in bots.items()}
+    operation_logs = []
+    for e in events:
+        result, snapshot_id = e.get('result'), None
+        if e['operation_type'] == UserOperationLog.OperationType.BOT_DETAIL and e['obj_id1'] in bots:
+            snapshot_id = snapshot_ids[e['obj_id1']]
+            if result is None:
+                result = {'subscribed': is_subscribed(e['user_id'], bots[e['obj_id1']])}
+        operation_logs.append(UserOperationLog(
+            id=e['id'],
+            user_id=e['user_id'],
+            operation_type=e['operation_type'],
+            operation_content=e.get('operation_content'),
+            result=result,
+            snapshot_id=snapshot_id,
+            obj_id1=e.get('obj_id1'),
+            obj_id2=e.get('obj_id2'),
+            obj_id3=e.get('obj_id3'),
+            source=e.get('source'),
+        ))
+    # 已写入的事件（processing 重新写入）忽略，created_at 也不再更新
+    exist_ids = set(UserOperationLog.objects.filter(
+        id__in=[e['id'] for e in events]).values_list('id', flat=True))
+    UserOperationLog.objects.bulk_create(
+        [o for o in operation_logs if o.id not in exist_ids], batch_size=1000, ignore_conflicts=True)
+    # auto_now_add 在 bulk_create 时会覆盖 created_at，写入后按事件时间更新
+    pushed_logs = []
+    for operation_log, e in zip(operation_logs, events):
+        if e.get('created_at') and operation_log.id not in exist_ids:
+            operation_log.created_at = datetime.datetime.fromtimestamp(e['created_at'], tz=datetime.timezone.utc)
+            pushed_logs.append(operation_log)
+    if pushed_logs:
+        UserOperationLog.objects.bulk_update(pushed_logs, ['created_at'], batch_size=1000)
+    return operation_logs
 
 
 @shared_task(bind=True)
@@ -279,8 +436,9 @@ def async_update_conversation_share_content(self, conversation_share_id, convers
     selected_questions_dict = {q['id']:q for q in selected_questions}
     filter_query = Q(conversation_id=conversation_id, del_flag=False)
     # filter_query &= ~Q(id__in=selected_question_ids)
-    query_set = Question.objects.filter(filter_query).all()
-    question_data = QuestionListSerializer(query_set, many=True).data
+    query_set = list(Question.objects.filter(filter_query).defer('stream').all())
+    references = QuestionReference.references_map([q.id for q in query_set])
+    question_data = QuestionListSerializer(query_set, many=True, context={'references': references}).data
     new_question_data = []
     for index, q in enumerate(question_data):
         if q['id'] in selected_questions_dict:
@@ -310,18 +468,185 @@ def async_update_conversation_share_content(self, conversation_share_id, convers
 @shared_task(bind=True)
 # @close_connection
 def async_complete_abstract(self, user_id, document_ids):
-    documents = Document.objects.filter(pk__in=document_ids).all()
-    for d in documents:
-        ret, times = None, 0
-        while not ret and times < 3:
-            try:
-                ret = RagDocument.complete_abstract(user_id, d.collection_id, d.doc_id)
-            except Exception as e:
-                logger.error(f'async_complete_abstract error: {e}')
-                sleep(5)
+    AbstractCompletionQueue().push(user_id, document_ids)
+    async_complete_abstract_batch.apply_async()
     return True
 
 
+@shared_task(bind=True, time_limit=300, soft_time_limit=240)
+# @close_connection
+def async_complete_abstract_batch(self, max_batches=4):
+    """处理补全摘要队列，单个 worker 执行；失败的按退避时间进入重试集合，到期后由定时任务继续处理"""
+    queue = AbstractCompletionQueue()
+    lock = queue.lock()
+    if not lock.acquire():
+        return True
+    try:
+        for _ in range(max_batches):
+            success_num, failed_num = queue.process()
+            logger.info(f'async_complete_abstract_batch success: {success_num}, failed: {failed_num}')
+            if not success_num and not failed_num:
+                break
+    finally:
+        lock.release()
+    return True
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, time_limit=300, soft_time_limit=240)
+# @close_connection
+def async_import_job_chunk(self, job_id, chunk_index):
+    """
+    导入一个 chunk：并发获取 rag 文献信息，批量写入 document/collection_document
+    acks_late，worker 中断后任务重新投递；已完成的 chunk 直接跳过，重复执行结果一致
+    出错时返回失败结果不抛出，保证 chord 回调执行，任务标记为 error 后可 resume
+    """
+    job = ImportJob.objects.filter(pk=job_id).first()
+    if not job or chunk_index in job.finished_chunks:
+        return {'chunk_index': chunk_index, 'skipped': True}
+    try:
+        return _import_job_chunk(job, chunk_index)
+    except Exception as e:
+        logger.error(f'async_import_job_chunk {job_id}, chunk: {chunk_index}, error: {e}')
+        return {'chunk_index': chunk_index, 'error': str(e)[:2000]}
+
+
+def _import_job_chunk(job: ImportJob, chunk_index):
+    job_id = job.id
+    doc_ids = dict(job.chunks)[chunk_index]
+    rag_rets, skip_ids = rag_documents_fetch(job.source_collection_type, job.source_collection_id, doc_ids)
+    doc_id_document_ids, invalid_ids, _ = documents_bulk_upsert_from_rag_rets(rag_rets)
+    skip_ids += invalid_ids
+    add_num = 0
+    if document_ids := list(doc_id_document_ids.values()):
+        exist_document_ids = set(CollectionDocument.objects.filter(
+            collection_id=job.collection_id, document_id__in=document_ids
+        ).values_list('document_id', flat=True))
+        CollectionDocument.objects.filter(
+            collection_id=job.collection_id, document_id__in=exist_document_ids
+        ).update(full_text_accessible=True, del_flag=False)
+        c_doc_objs = [
+            CollectionDocument(
+                collection_id=job.collection_id,
+                document_id=document_id,
+                doc_id=doc_id,
+                doc_collection_id=job.source_collection_id,
+                full_text_accessible=True,
+                del_flag=False,
+            )
+            for doc_id, document_id in doc_id_document_ids.items() if document_id not in exist_document_ids
+        ]
+        CollectionDocument.objects.bulk_create(c_doc_objs, ignore_conflicts=True)
+        add_num = len(c_doc_objs)
+    with transaction.atomic():
+        job = ImportJob.objects.select_for_update().get(pk=job_id)
+        if chunk_index not in job.finished_chunks:
+            job.finished_chunks.append(chunk_index)
+            job.processed += len(doc_ids)
+            job.add_num += add_num
+            job.skip_ids += skip_ids
+            job.status = ImportJob.StatusChoices.IN_PROGRESS
+            job.save()
+    logger.info(f'async_import_job_chunk {job_id}, chunk: {chunk_index}, add_num: {add_num}, skip: {skip_ids}')
+    return {'chunk_index': chunk_index, 'add_num': add_num}
+
+
+@shared_task(bind=True)
+# @close_connection
+def async_import_job_complete(self, chunk_results, job_id):
+    """chord 回调：所有 chunk 完成后重新统计一次收藏夹文献数"""
+    job = ImportJob.objects.filter(pk=job_id).first()
+    if not job:
+        return False
+    coll_documents_total = CollectionDocument.objects.filter(collection_id=job.collection_id, del_flag=False).count()
+    Collection.objects.filter(id=job.collection_id).update(total_personal=coll_documents_total)
+    CollectionStats.refresh([job.collection_id])
+    bot_documents_refresh(BotCollection.objects.filter(
+        collection_id=job.collection_id, del_flag=False).values_list('bot_id', flat=True))
+    finished = len(job.finished_chunks) == len(job.chunks)
+    job.status = ImportJob.StatusChoices.COMPLETED if finished else ImportJob.StatusChoices.ERROR
+    if not finished:
+        job.error = {
+            'error_message': 'some chunks not finished, resume the job to retry',
+            'chunk_errors': [r for r in (chunk_results or []) if r and r.get('error')],
+        }
+    job.save()
+    logger.info(f'async_import_job_complete {job_id}, status: {job.status}, add_num: {job.add_num}')
+    return True
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, time_limit=300, soft_time_limit=240)
+# @close_connection
+def async_document_refresh_job(self, job_id):
+    """
+    刷新一批 document，按主键 keyset 取下一批，保存 cursor 后派发下一批
+    主键不会因刷新改变，并发写入时不会漏掉或重复处理记录
+    cursor 按旧值条件更新，更新不到说明已有其他任务链推进了 cursor，本任务链结束
+    与原 doc_id 范围刷新一致，已删除的 document 也会刷新
+    """
+    job = DocumentRefreshJob.objects.filter(pk=job_id, del_flag=False).first()
+    if not job or job.status != DocumentRefreshJob.StatusChoices.IN_PROGRESS:
+        return False
+    job_query = DocumentRefreshJob.objects.filter(
+        pk=job_id, cursor=job.cursor, status=DocumentRefreshJob.StatusChoices.IN_PROGRESS)
+    filter_query = Q()
+    if job.cursor:
+        filter_query &= Q(id__gt=job.cursor)
+    if job.begin_doc_id is not None:
+        filter_query &= Q(doc_id__gte=job.begin_doc_id)
+    if job.end_doc_id is not None:
+        filter_query &= Q(doc_id__lte=job.end_doc_id)
+    try:
+        documents = list(Document.objects.filter(filter_query).order_by('id').values(
+            'id', 'collection_type', 'collection_id', 'doc_id')[:job.batch_size])
+        if not documents:
+            job_query.update(status=DocumentRefreshJob.StatusChoices.COMPLETED, updated_at=datetime.datetime.now())
+            logger.info(f'async_document_refresh_job {job_id} completed, processed: {job.processed}, '
+                        f'updated: {job.updated_num}')
+            return True
+        docs = [{
+            'collection_type': d['collection_type'], 'collection_id': d['collection_id'], 'doc_id': d['doc_id']
+        } for d in documents]
+        rag_rets, skip_docs = rag_documents_get_many(docs)
+        _, invalid_ids, updated_num = documents_bulk_upsert_from_rag_rets(rag_rets, only_changed=True)
+    except Exception as e:
+        logger.error(f'async_document_refresh_job {job_id} error, cursor: {job.cursor}, {e}')
+        job_query.update(
+            status=DocumentRefreshJob.StatusChoices.ERROR, error={'error_message': str(e)[:2000]},
+            updated_at=datetime.datetime.now())
+        return False
+    advanced = job_query.update(
+        cursor=documents[-1]['id'],
+        processed=F('processed') + len(documents),
+        updated_num=F('updated_num') + updated_num,
+        skip_num=F('skip_num') + len(skip_docs) + len(invalid_ids),
+        updated_at=datetime.datetime.now(),
+    )
+    if not advanced:
+        logger.warning(f'async_document_refresh_job {job_id} cursor {job.cursor} already advanced, stop')
+        return False
+    async_document_refresh_job.apply_async(args=(job_id,))
+    return True
+
+
+@shared_task(bind=True, time_limit=300, soft_time_limit=240)
+# @close_connection
+def async_rag_outbox_task(self, max_batches=5):
+    for _ in range(max_batches):
+        success_num, failed_num = rag_outbox_process()
+        logger.info(f'async_rag_outbox_task success: {success_num}, failed: {failed_num}')
+        if not success_num and not failed_num:
+            break
+    return True
+
+
+@shared_task(bind=True, time_limit=1800, soft_time_limit=1500)
+# @close_connection
+def async_collection_stats_reconcile(self):
+    checked_num, drift_num = collection_stats_reconcile()
+    logger.info(f'async_collection_stats_reconcile checked: {checked_num}, drift: {drift_num}')
+    return drift_num
+
+
 @shared_task(bind=True)
 # @close_connection
 def async_daily_member_status(self):
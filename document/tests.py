@@ -0,0 +1,182 @@
+import datetime
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from core.utils.model import raw_by_composite_keys
+from document.base_service import _rag_outbox_execute, rag_outbox_add, rag_outbox_process
+from document.models import Document, DocumentLibrary, RagOutbox
+from document.service import document_library_delete
+
+HOSTILE_COLLECTION_IDS = [
+    "x'); DROP TABLE document; --",
+    'a"b',
+    "o'brien",
+    "%' OR '1'='1",
+    '\\',
+]
+
+
+class RawByCompositeKeysSqlTest(SimpleTestCase):
+    key_columns = [('collection_id', 'text'), ('doc_id', 'bigint')]
+
+    def test_sql_text_does_not_depend_on_keys(self):
+        one = raw_by_composite_keys(Document, self.key_columns, [('arxiv', 1)])
+        many = raw_by_composite_keys(Document, self.key_columns, [('arxiv', 1), ('s2', 2), ('arxiv', 3)])
+        self.assertEqual(one.raw_query, many.raw_query)
+
+    def test_key_values_are_bound_as_params(self):
+        keys = [(c_id, i) for i, c_id in enumerate(HOSTILE_COLLECTION_IDS)]
+        query_set = raw_by_composite_keys(Document, self.key_columns, keys)
+        for c_id in HOSTILE_COLLECTION_IDS:
+            self.assertNotIn(c_id, query_set.raw_query)
+        self.assertEqual(query_set.params, [HOSTILE_COLLECTION_IDS, list(range(len(HOSTILE_COLLECTION_IDS)))])
+
+    def test_duplicate_keys_are_removed(self):
+        query_set = raw_by_composite_keys(Document, self.key_columns, [('arxiv', 1), ['arxiv', 1], ('arxiv', 2)])
+        self.assertEqual(query_set.params, [['arxiv', 'arxiv'], [1, 2]])
+
+
+class RawByCompositeKeysTest(TestCase):
+
+    def setUp(self):
+        self.documents = {
+            (c_id, i): Document.objects.create(
+                collection_id=c_id, doc_id=i, collection_type=Document.TypeChoices.PUBLIC, title=f'doc {i}')
+            for i, c_id in enumerate(HOSTILE_COLLECTION_IDS + ['arxiv'])
+        }
+
+    def test_hostile_keys_match_exact_rows(self):
+        keys = [(c_id, i) for i, c_id in enumerate(HOSTILE_COLLECTION_IDS)]
+        documents = list(Document.raw_by_docs([{'collection_id': c_id, 'doc_id': i} for c_id, i in keys]))
+        self.assertCountEqual([d.id for d in documents], [self.documents[k].id for k in keys])
+        self.assertIn(Document._meta.db_table, connection.introspection.table_names())
+
+    def test_keys_match_both_columns(self):
+        # collection_id 与 doc_id 分别存在但组合不存在时不返回
+        documents = list(Document.raw_by_docs([{'collection_id': 'arxiv', 'doc_id': 0}]))
+        self.assertEqual(documents, [])
+
+    def test_fields_and_where(self):
+        c_id = HOSTILE_COLLECTION_IDS[0]
+        Document.objects.filter(collection_id=c_id).update(del_flag=True)
+        documents = list(Document.raw_by_docs(
+            [{'collection_id': c_id, 'doc_id': 0}, {'collection_id': 'arxiv', 'doc_id': len(HOSTILE_COLLECTION_IDS)}],
+            fileds='id, title', where='"document"."del_flag" = false'))
+        self.assertEqual([d.title for d in documents], [f'doc {len(HOSTILE_COLLECTION_IDS)}'])
+
+
+@mock.patch('document.base_service.RagDocument')
+class RagOutboxExecuteTest(SimpleTestCase):
+    paper = {'collection_id': 'user-1', 'doc_id': 10}
+
+    def _cancel(self, rag_document, task_status, task_type='personal'):
+        rag_document.get_ingest_task.return_value = {'task_status': task_status, 'paper': self.paper}
+        _rag_outbox_execute(RagOutbox(
+            action=RagOutbox.ActionChoices.CANCEL_INGEST_TASK, payload={'task_id': 't1', 'task_type': task_type}))
+
+    def test_completed_personal_task_deletes_paper(self, rag_document):
+        self._cancel(rag_document, DocumentLibrary.TaskStatusChoices.COMPLETED)
+        rag_document.delete_personal_paper.assert_called_once_with('user-1', 10)
+        rag_document.cancel_ingest_task.assert_not_called()
+
+    def test_completed_public_task_keeps_paper(self, rag_document):
+        self._cancel(rag_document, DocumentLibrary.TaskStatusChoices.COMPLETED, task_type='public')
+        rag_document.delete_personal_paper.assert_not_called()
+        rag_document.cancel_ingest_task.assert_not_called()
+
+    def test_running_task_is_cancelled(self, rag_document):
+        self._cancel(rag_document, DocumentLibrary.TaskStatusChoices.IN_PROGRESS)
+        rag_document.cancel_ingest_task.assert_called_once_with('t1')
+        rag_document.delete_personal_paper.assert_not_called()
+
+    def test_finished_task_is_left_alone(self, rag_document):
+        for task_status in [DocumentLibrary.TaskStatusChoices.CANCELLED, DocumentLibrary.TaskStatusChoices.ERROR]:
+            self._cancel(rag_document, task_status)
+        rag_document.cancel_ingest_task.assert_not_called()
+        rag_document.delete_personal_paper.assert_not_called()
+
+    def test_delete_personal_paper(self, rag_document):
+        _rag_outbox_execute(RagOutbox(action=RagOutbox.ActionChoices.DELETE_PERSONAL_PAPER, payload=self.paper))
+        rag_document.delete_personal_paper.assert_called_once_with('user-1', 10)
+
+    def test_unknown_action(self, rag_document):
+        with self.assertRaises(ValueError):
+            _rag_outbox_execute(RagOutbox(action='unknown', payload={}))
+
+
+@mock.patch('document.base_service.RagDocument')
+class RagOutboxProcessTest(TestCase):
+
+    def setUp(self):
+        self.outbox = rag_outbox_add(
+            RagOutbox.ActionChoices.DELETE_PERSONAL_PAPER, [{'collection_id': 'user-1', 'doc_id': 10}])[0]
+
+    def _outbox(self):
+        return RagOutbox.objects.get(pk=self.outbox.pk)
+
+    def test_success_is_completed(self, rag_document):
+        self.assertEqual(rag_outbox_process(), (1, 0))
+        self.assertEqual(self._outbox().status, RagOutbox.StatusChoices.COMPLETED)
+        self.assertEqual(rag_outbox_process(), (0, 0))
+        rag_document.delete_personal_paper.assert_called_once_with('user-1', 10)
+
+    def test_failure_is_retried_later(self, rag_document):
+        rag_document.delete_personal_paper.side_effect = Exception('rag down')
+        self.assertEqual(rag_outbox_process(), (0, 1))
+        outbox = self._outbox()
+        self.assertEqual(outbox.status, RagOutbox.StatusChoices.PENDING)
+        self.assertEqual(outbox.attempts, 1)
+        self.assertEqual(outbox.error, 'rag down')
+        self.assertGreater(outbox.next_retry_at, datetime.datetime.now())
+        # 未到重试时间不会再次领取
+        self.assertEqual(rag_outbox_process(), (0, 0))
+
+    def test_max_attempts_is_dead(self, rag_document):
+        rag_document.delete_personal_paper.side_effect = Exception('rag down')
+        RagOutbox.objects.filter(pk=self.outbox.pk).update(attempts=2)
+        self.assertEqual(rag_outbox_process(max_attempts=3), (0, 1))
+        outbox = self._outbox()
+        self.assertEqual(outbox.status, RagOutbox.StatusChoices.DEAD)
+        self.assertEqual(outbox.attempts, 3)
+
+    def test_stale_in_progress_is_reclaimed(self, rag_document):
+        # worker 中断，记录停在 in_progress
+        RagOutbox.objects.filter(pk=self.outbox.pk).update(
+            status=RagOutbox.StatusChoices.IN_PROGRESS,
+            updated_at=datetime.datetime.now() - datetime.timedelta(hours=1))
+        self.assertEqual(rag_outbox_process(), (1, 0))
+        self.assertEqual(self._outbox().status, RagOutbox.StatusChoices.COMPLETED)
+
+
+@mock.patch('document.service.async_rag_outbox_task')
+@mock.patch('document.service.search_result_delete_cache')
+@mock.patch('document.service.CollectionResyncScheduler')
+@mock.patch('document.service.DocumentLibraryCache')
+class DocumentLibraryDeleteOutboxTest(TestCase):
+    user_id = 'test-user'
+
+    def _doc_lib(self, task_id, task_type, task_status, filename=None):
+        return DocumentLibrary.objects.create(
+            user_id=self.user_id, task_id=task_id, task_type=task_type, task_status=task_status, filename=filename)
+
+    def test_cancel_payload_records_task_type(self, *mocks):
+        doc_libs = [
+            self._doc_lib('t1', 'personal', DocumentLibrary.TaskStatusChoices.IN_PROGRESS, filename='a.pdf'),
+            self._doc_lib('t2', 'public', DocumentLibrary.TaskStatusChoices.QUEUEING),
+            self._doc_lib('t3', 'personal', DocumentLibrary.TaskStatusChoices.COMPLETED, filename='b.pdf'),
+        ]
+        document_library_delete(self.user_id, [d.id for d in doc_libs], None)
+        payloads = RagOutbox.objects.filter(
+            action=RagOutbox.ActionChoices.CANCEL_INGEST_TASK).values_list('payload', flat=True)
+        self.assertCountEqual(payloads, [
+            {'task_id': 't1', 'task_type': 'personal'}, {'task_id': 't2', 'task_type': 'public'}])
+        self.assertFalse(DocumentLibrary.objects.filter(user_id=self.user_id, del_flag=False).exists())
+
+    def test_shared_task_is_not_cancelled(self, *mocks):
+        doc_lib = self._doc_lib('t1', 'personal', DocumentLibrary.TaskStatusChoices.IN_PROGRESS, filename='a.pdf')
+        # 去重上传的另一条记录仍引用同一 task
+        self._doc_lib('t1', 'personal', DocumentLibrary.TaskStatusChoices.IN_PROGRESS, filename='a copy.pdf')
+        document_library_delete(self.user_id, [doc_lib.id], None)
+        self.assertFalse(RagOutbox.objects.filter(action=RagOutbox.ActionChoices.CANCEL_INGEST_TASK).exists())
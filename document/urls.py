@@ -25,6 +25,8 @@ urlpatterns = [
 
     path('documents/rag/update', views.DocumentsRagUpdate.as_view()),
     path('documents/rag/update/<int:begin_id>/<int:end_id>', views.DocumentsRagUpdate.as_view()),
+    path('documents/rag/import/<str:job_id>', views.DocumentsImportJob.as_view()),
+    path('documents/rag/refresh/<str:job_id>', views.DocumentsRefreshJob.as_view()),
 
 
     path('search', views.Search.as_view()),
@@ -9,19 +9,21 @@ from rest_framework.views import APIView
 
 from bot.rag_service import Document as RagDocument
 from core.utils.views import extract_json, my_json_response
-from document.models import Document, DocumentLibrary, SearchHistoryCache
+from document.base_service import document_update_from_rag_ret
+from document.models import Document, DocumentLibrary, SearchHistoryCache, ImportJob, DocumentRefreshJob
 from document.serializers import DocumentDetailSerializer, GenPresignedUrlQuerySerializer, \
     DocumentUploadQuerySerializer, \
     DocumentLibraryListQuerySerializer, DocumentRagUpdateSerializer, DocLibUpdateNameQuerySerializer, \
     DocLibAddQuerySerializer, DocLibDeleteQuerySerializer, DocLibCheckQuerySerializer, DocumentRagCreateSerializer, \
     ImportPapersToCollectionSerializer, AuthorsSearchQuerySerializer, AuthorsDocumentsQuerySerializer, \
-    DocumentUploadResultSerializer, SearchQuerySerializer
+    DocumentUploadResultSerializer, SearchQuerySerializer, DocumentRefreshJobDetailSerializer
 from document.service import search, presigned_url, document_personal_upload, \
     get_document_library_list, document_library_add, document_library_delete, doc_lib_batch_operation_check, \
     get_url_by_object_path, get_reference_formats, update_exist_documents, import_papers_to_collection, \
+    import_job_dispatch, import_job_progress, documents_update_from_rag, document_refresh_job_resume, \
     document_update_from_rag, search_authors, author_detail, author_documents, get_csl_reference_formats, get_citations, \
     get_references
-from document.tasks import async_add_user_operation_log
+from user.service import UserOperationLogQueue
 from vip.serializers import LimitCheckSerializer
 
 logger = logging.getLogger(__name__)
@@ -66,11 +68,11 @@ class Search(APIView):
             return my_json_response(serial.errors, code=100001, msg=f'validate error, {list(serial.errors.keys())}')
         post_data = serial.validated_data
         data = search(user_id, post_data)
-        async_add_user_operation_log.apply_async(kwargs={
-            'user_id': user_id,
-            'operation_type': 'search',
-            'operation_content': body['content'],
-        })
+        UserOperationLogQueue().push(
+            user_id=user_id,
+            operation_type='search',
+            operation_content=body['content'],
+        )
         # add search history
         if data:
             history_key = f"scinav:paper:search_history:{user_id}"
@@ -167,13 +169,13 @@ class Documents(APIView):
         document_data['citation_count'] = len(document_data['citations']) if document_data['citations'] else document_data['citation_count']
         document_data['reference_count'] = len(document_data['references']) if document_data['references'] else document_data['reference_count']
         document_data['reference_formats'] = get_reference_formats(document)
-        async_add_user_operation_log.apply_async(kwargs={
-            'user_id': user_id,
-            'operation_type': 'document_detail',
-            'obj_id1': document.id,
-            'obj_id2': document.collection_id,
-            'obj_id3': document.doc_id,
-        })
+        UserOperationLogQueue().push(
+            user_id=user_id,
+            operation_type='document_detail',
+            obj_id1=document.id,
+            obj_id2=document.collection_id,
+            obj_id3=document.doc_id,
+        )
         return my_json_response(document_data)
 
 
@@ -191,13 +193,13 @@ class DocumentsByDocId(APIView):
         document_data['citation_count'] = len(document_data['citations']) if document_data['citations'] else document_data['citation_count']
         document_data['reference_count'] = len(document_data['references']) if document_data['references'] else document_data['reference_count']
         document_data['reference_formats'] = get_reference_formats(document)
-        async_add_user_operation_log.apply_async(kwargs={
-            'user_id': user_id,
-            'operation_type': 'document_detail',
-            'obj_id1': document.id,
-            'obj_id2': document.collection_id,
-            'obj_id3': document.doc_id,
-        })
+        UserOperationLogQueue().push(
+            user_id=user_id,
+            operation_type='document_detail',
+            obj_id1=document.id,
+            obj_id2=document.collection_id,
+            obj_id3=document.doc_id,
+        )
         return my_json_response(document_data)
 
 
@@ -413,13 +415,13 @@ class DocumentsUrl(APIView):
             url = get_url_by_object_path(user_id, document['object_path'])
             url_document = document
         if url_document:
-            async_add_user_operation_log.apply_async(kwargs={
-                'user_id': user_id,
-                'operation_type': 'document_url',
-                'obj_id1': url_document['id'],
-                'obj_id2': url_document['collection_id'],
-                'obj_id3': url_document['doc_id'],
-            })
+            UserOperationLogQueue().push(
+                user_id=user_id,
+                operation_type='document_url',
+                obj_id1=url_document['id'],
+                obj_id2=url_document['collection_id'],
+                obj_id3=url_document['doc_id'],
+            )
 
         return my_json_response({
             'id': document['id'],
@@ -435,9 +437,11 @@ class DocumentsUrl(APIView):
 @permission_classes([AllowAny])
 class DocumentsRagUpdate(APIView):
     @staticmethod
-    def get(request, *args, **kwargs):
-        data = {}
-        update_exist_documents()
+    def get(request, begin_id=None, end_id=None, *args, **kwargs):
+        if begin_id is not None or end_id is not None:
+            data = documents_update_from_rag(begin_id, end_id)
+        else:
+            data = update_exist_documents()
         return my_json_response(data)
 
     @staticmethod
@@ -463,16 +467,53 @@ class DocumentsRagUpdate(APIView):
         serial = DocumentRagCreateSerializer(data=doc_info)
         if not serial.is_valid():
             return my_json_response(serial.errors, code=100000, msg='invalid get rag paper info')
-        document, _ = Document.objects.update_or_create(
-            serial.validated_data,
-            doc_id=serial.validated_data['doc_id'],
-            collection_type=serial.validated_data['collection_type'],
-            collection_id=serial.validated_data['collection_id']
-        )
+        document = document_update_from_rag_ret(doc_info)
         data = DocumentRagUpdateSerializer(document).data
         return my_json_response(data)
 
 
+@method_decorator([extract_json], name='dispatch')
+@method_decorator(require_http_methods(['GET', 'PUT']), name='dispatch')
+@permission_classes([AllowAny])
+class DocumentsImportJob(APIView):
+    @staticmethod
+    def get(request, job_id, *args, **kwargs):
+        job = ImportJob.objects.filter(pk=job_id, del_flag=False).first()
+        if not job:
+            return my_json_response({}, code=100002, msg='import job not found')
+        data = import_job_progress(job)
+        return my_json_response(data)
+
+    @staticmethod
+    def put(request, job_id, *args, **kwargs):
+        """resume: 重新派发未完成的 chunk"""
+        job = ImportJob.objects.filter(pk=job_id, del_flag=False).first()
+        if not job:
+            return my_json_response({}, code=100002, msg='import job not found')
+        job = import_job_dispatch(job)
+        return my_json_response(import_job_progress(job))
+
+
+@method_decorator([extract_json], name='dispatch')
+@method_decorator(require_http_methods(['GET', 'PUT']), name='dispatch')
+@permission_classes([AllowAny])
+class DocumentsRefreshJob(APIView):
+    @staticmethod
+    def get(request, job_id, *args, **kwargs):
+        job = DocumentRefreshJob.objects.filter(pk=job_id, del_flag=False).first()
+        if not job:
+            return my_json_response({}, code=100002, msg='refresh job not found')
+        return my_json_response(DocumentRefreshJobDetailSerializer(job).data)
+
+    @staticmethod
+    def put(request, job_id, *args, **kwargs):
+        """resume: 从 cursor 继续刷新"""
+        job = DocumentRefreshJob.objects.filter(pk=job_id, del_flag=False).first()
+        if not job:
+            return my_json_response({}, code=100002, msg='refresh job not found')
+        return my_json_response(document_refresh_job_resume(job))
+
+
 @method_decorator([extract_json], name='dispatch')
 @method_decorator(require_http_methods(['GET']), name='dispatch')
 class DocumentsLibraryStatus(APIView):
@@ -4,10 +4,11 @@ import logging
 
 import requests
 from dateutil.relativedelta import relativedelta
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadedfile import UploadedFile
 from django.db.models import Q
 
 from chat.models import Conversation
+from document.base_service import personal_upload_duplicate
 from document.service import presigned_url, document_personal_upload
 from openapi.models import OpenapiKey, OpenapiLog
 from openapi.serializers import OpenapiKeyDetailSerializer, OpenapiKeyCreateDetailSerializer, UsageBaseSerializer, \
@@ -23,27 +24,35 @@ def get_request_openapi_key_id(request):
     return int(openapi_key_id)
 
 
-def upload_paper(user_id, file: InMemoryUploadedFile, openapi_key_id):
-    ret = presigned_url(user_id, file.name)
-    url = ret['presigned_url']
-    object_path = ret['object_path']
-    headers = {
-        'Content-Type': 'application/octet-stream',
-        'x-ms-blob-type': 'BlockBlob',
-    }
-
-    res = requests.put(url, data=file.file, headers=headers)
+def upload_paper(user_id, file: UploadedFile, openapi_key_id):
+    checksum = getattr(file, 'checksum', None)
+    if duplicate := personal_upload_duplicate(user_id, checksum):
+        # 相同内容已上传过，无需再次上传文件
+        object_path = duplicate.object_path
+    else:
+        ret = presigned_url(user_id, file.name)
+        url = ret['presigned_url']
+        object_path = ret['object_path']
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'x-ms-blob-type': 'BlockBlob',
+            'Content-Length': str(file.size),
+        }
+        # 文件对象按块流式发送，不整体读入内存
+        file.seek(0)
+        res = requests.put(url, data=file.file, headers=headers)
 
-    if res.status_code != 201:
-        logger.warning(f'upload_paper res.content: {res.content}')
-        return 100000, 'upload paper failed', {}
+        if res.status_code != 201:
+            logger.warning(f'upload_paper res.content: {res.content}')
+            return 100000, 'upload paper failed', {}
     doc_person_lib_data = {
         'user_id': user_id,
         'files': [{
             'object_path': object_path,
             'filename': file.name,
+            'checksum': checksum,
         }],
-        'open_key_id': openapi_key_id,
+        'openapi_key_id': openapi_key_id,
     }
     logger.info(f'upload paper, info: {doc_person_lib_data}')
     code, msg, data = document_personal_upload(doc_person_lib_data)
@@ -1,5 +1,4 @@
 import logging
-from operator import itemgetter
 
 from django.db.models import Q
 
@@ -9,7 +8,6 @@ from bot.rag_service import Document as Rag_Document
 from chat.service import update_simple_conversation
 from collection.base_service import update_conversation_by_collection
 from collection.models import Collection
-from core.utils.common import cmp_ignore_order
 from document.models import Document, DocumentLibrary
 from document.serializers import DocumentRagCreateSerializer
 from document.service import get_documents_by_rag, get_reference_formats
@@ -125,8 +123,10 @@ def update_conversation(conversation, validated_data):
             'full_text_accessible': d.id in doc_libs,
         } for d in documents] if documents else []
         rag_update_data['paper_ids'] = new_paper_ids
-        if not cmp_ignore_order(conversation.paper_ids, new_papers_info,sort_fun=itemgetter('collection_id', 'doc_id')):
+        if conversation.is_papers_changed(new_papers_info):
             RagConversation.update(**rag_update_data)
+            conversation.set_papers(new_papers_info)
+            conversation.save()
             is_updated = True
     if not is_updated and diff_model:
         conversation.model = diff_model
@@ -2,7 +2,7 @@ import json
 import logging
 import os
 
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadedfile import UploadedFile
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_http_methods
 from drf_spectacular.types import OpenApiTypes
@@ -16,10 +16,10 @@ from bot.models import Bot
 from bot.service import bot_list_all, bot_list_mine
 from chat.service import chat_query
 from core.utils.throttling import UserRateThrottle
+from core.utils.upload_handlers import ChecksumUploadHandler
 from core.utils.views import extract_json, streaming_response, openapi_response, \
     openapi_exception_response
 from document.service import get_document_library_list
-from document.tasks import async_add_user_operation_log
 from openapi.base_service import record_openapi_log
 from openapi.models import OpenapiLog
 from openapi.serializers_openapi import ChatResponseSerializer, UploadFileResponseSerializer, \
@@ -29,6 +29,7 @@ from openapi.serializers_openapi import ChatResponseSerializer, UploadFileRespon
 from openapi.serializers_openapi import SearchQuerySerializer, ExceptionResponseSerializer, TopicListSerializer
 from openapi.service import upload_paper, get_request_openapi_key_id
 from openapi.service_openapi import search, collection_list_mine, update_conversation
+from user.service import UserOperationLogQueue
 
 logger = logging.getLogger(__name__)
 
@@ -125,12 +126,12 @@ print(response.text)
             return openapi_exception_response(100001, error_msg)
         vd = serial.validated_data
         data = search(user_id, vd['content'], vd['limit'])
-        async_add_user_operation_log.apply_async(kwargs={
-            'user_id': user_id,
-            'operation_type': 'search',
-            'operation_content': vd['content'],
-            'source': 'api'
-        })
+        UserOperationLogQueue().push(
+            user_id=user_id,
+            operation_type='search',
+            operation_content=vd['content'],
+            source='api',
+        )
         # record_openapi_log(user_id, openapi_key_id, OpenapiLog.Api.SEARCH, OpenapiLog.Status.SUCCESS)
         return openapi_response(data)
 
@@ -253,14 +254,15 @@ print(response.text)
     def put(request, filename, *args, **kwargs):
         openapi_key_id = get_request_openapi_key_id(request)
         user_id = request.user.id
-        file: InMemoryUploadedFile = request.data.get('file')
-        if not file.name.endswith('.pdf'):
-            error_msg = 'filename is invalid, must end with .pdf'
-            return openapi_exception_response(100001, error_msg)
-
+        # 边接收边计算 checksum，文件写入临时文件
+        request.upload_handlers.insert(0, ChecksumUploadHandler(request))
+        file: UploadedFile = request.data.get('file')
         if not file:
             error_msg = 'file not found'
             return openapi_exception_response(100001, error_msg)
+        if not file.name.endswith('.pdf'):
+            error_msg = 'filename is invalid, must end with .pdf'
+            return openapi_exception_response(100001, error_msg)
         # logger.debug(f'ddddddddd file: {file.name}, {file.file}')
         code, msg, data = upload_paper(user_id, file, openapi_key_id)
 
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0007_myuser_inviter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperationLogSnapshot',
+            fields=[
+                ('id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('content', models.JSONField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'operation log snapshot',
+                'db_table': 'operation_log_snapshot',
+            },
+        ),
+        migrations.AddField(
+            model_name='useroperationlog',
+            name='snapshot',
+            field=models.ForeignKey(
+                db_column='snapshot_id', db_constraint=False, db_default=None, default=None, null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING, related_name='user_operation_log',
+                to='user.operationlogsnapshot'),
+        ),
+    ]
@@ -53,9 +53,25 @@ class UserOperationLog(models.Model):
     obj_id3 = models.BigIntegerField(null=True, db_index=True, default=None, db_default=None)
     operation_content = models.TextField(null=True, default=None, db_default=None)
     result = models.JSONField(null=True, default=None, db_default=None)
+    snapshot = models.ForeignKey(
+        'user.OperationLogSnapshot', db_constraint=False, on_delete=models.DO_NOTHING, null=True, default=None,
+        db_default=None, db_column='snapshot_id', related_name='user_operation_log')
     source = models.CharField(null=True, max_length=512, default=None, db_default=None)
     created_at = models.DateTimeField(null=False, auto_now_add=True)
 
     class Meta:
         db_table = 'user_operation_log'
         verbose_name = 'user operation log'
+
+
+class OperationLogSnapshot(models.Model):
+    """
+    操作日志快照，按内容 sha256 去重，相同内容只存一份，日志记录 snapshot_id
+    """
+    id = models.CharField(max_length=64, primary_key=True)
+    content = models.JSONField(null=True)
+    created_at = models.DateTimeField(null=True, auto_now_add=True)
+
+    class Meta:
+        db_table = 'operation_log_snapshot'
+        verbose_name = 'operation log snapshot'
@@ -1,4 +1,13 @@
-from user.models import MyUser
+import json
+import logging
+import time
+import uuid
+
+from django_redis import get_redis_connection
+
+from user.models import MyUser, UserOperationLog
+
+logger = logging.getLogger(__name__)
 
 
 def save_auth_user_info(user_info):
@@ -27,4 +36,86 @@ def sync_user_info(user: MyUser, user_info):
         user.register_source = user_info['registerSource']
         user.avatar = user_info['photo']
         user.save()
-    return user
\ No newline at end of file
+    return user
+
+
+class UserOperationLogQueue:
+    """
+    用户操作日志写入队列，不经过 celery
+    1. queue: 视图写入的日志事件，id 即 UserOperationLog.id，重复写入按主键去重；created_at 为写入队列的时间
+    2. processing: 正在写入的一批事件，写入成功后删除；flusher 中断后下次先重新写入这一批（至少一次）
+    3. attempts: processing 这一批的写入次数，超过 MAX_ATTEMPTS 后逐条写入，写入失败的事件移到 dead
+    """
+    QUEUE_KEY = 'scinav:operation_log:queue'
+    PROCESSING_KEY = 'scinav:operation_log:processing'
+    ATTEMPTS_KEY = 'scinav:operation_log:attempts'
+    DEAD_KEY = 'scinav:operation_log:dead'
+    LOCK_KEY = 'scinav:operation_log:lock'
+    MAX_ATTEMPTS = 3
+    LUA_CLAIM = """
+    if redis.call('LLEN', KEYS[2]) > 0 then
+        return redis.call('LRANGE', KEYS[2], 0, -1)
+    end
+    local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #items > 0 then
+        redis.call('RPUSH', KEYS[2], unpack(items))
+        redis.call('LTRIM', KEYS[1], #items, -1)
+    end
+    return items
+    """
+
+    def __init__(self):
+        self.conn = get_redis_connection('default')
+
+    def push(self, user_id, operation_type, operation_content=None, obj_id1=None, obj_id2=None, obj_id3=None,
+             source=None, result=None):
+        event = {
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'operation_type': operation_type,
+            'operation_content': operation_content,
+            'obj_id1': obj_id1,
+            'obj_id2': obj_id2,
+            'obj_id3': obj_id3,
+            'source': source,
+            'result': result,
+            'created_at': time.time(),
+        }
+        try:
+            self.conn.rpush(self.QUEUE_KEY, json.dumps(event, ensure_ascii=False))
+        except Exception as e:
+            # redis 不可用时直接写入数据库，不丢日志（不计算专题快照）
+            logger.error(f'user operation log push error: {e}, {event}')
+            try:
+                UserOperationLog.objects.create(
+                    **{k: v for k, v in event.items() if k != 'created_at'})
+            except Exception as create_error:
+                logger.error(f'user operation log create error: {create_error}, {event}')
+        return event['id']
+
+    def size(self):
+        return self.conn.llen(self.QUEUE_KEY)
+
+    def lock(self, timeout=300):
+        return self.conn.lock(self.LOCK_KEY, timeout=timeout, blocking=False)
+
+    def claim(self, batch_size=5000):
+        """未确认的一批优先返回，否则从 queue 移动一批到 processing"""
+        items = self.conn.register_script(self.LUA_CLAIM)(
+            keys=[self.QUEUE_KEY, self.PROCESSING_KEY], args=[batch_size])
+        return [json.loads(i) for i in items]
+
+    def attempt(self):
+        """processing 这一批的写入次数 +1"""
+        return self.conn.incr(self.ATTEMPTS_KEY)
+
+    def dead(self, events):
+        if events:
+            self.conn.rpush(self.DEAD_KEY, *[json.dumps(e, ensure_ascii=False) for e in events])
+        return len(events)
+
+    def ack(self):
+        pipe = self.conn.pipeline()
+        pipe.delete(self.PROCESSING_KEY)
+        pipe.delete(self.ATTEMPTS_KEY)
+        pipe.execute()